@@ -165,7 +165,7 @@ class FullTokenizer(object):
     self.vocab = load_vocab(vocab_file)
     self.inv_vocab = {v: k for k, v in self.vocab.items()}
     self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
-    self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab)
+    self.wordpiece_tokenizer = TrieWordpieceTokenizer(vocab=self.vocab)
 
   def tokenize(self, text):
     split_tokens = []
@@ -359,6 +359,69 @@ class WordpieceTokenizer(object):
     return output_tokens
 
 
+class TrieWordpieceTokenizer(WordpieceTokenizer):
+  """Runs WordPiece tokenization with the vocabulary compiled into prefix tries.
+
+  Gives the output of `WordpieceTokenizer` without rebuilding and looking up
+  every candidate substring: one walk down a trie from each piece start finds
+  the longest vocabulary piece.
+  """
+
+  def __init__(self, vocab, unk_token="[UNK]", max_input_chars_per_word=200):
+    super(TrieWordpieceTokenizer, self).__init__(vocab, unk_token,
+                                                 max_input_chars_per_word)
+    self.word_trie = {}  # every vocabulary entry, walked from a word start
+    self.subword_trie = {}  # "##" pieces without their "##"
+    for piece in vocab:
+      _trie_insert(self.word_trie, piece, piece)
+      if piece.startswith("##") and len(piece) > 2:
+        _trie_insert(self.subword_trie, piece[2:], piece)
+
+  def tokenize(self, text):
+    text = convert_to_unicode(text)
+
+    output_tokens = []
+    for token in whitespace_tokenize(text):
+      if len(token) > self.max_input_chars_per_word:
+        output_tokens.append(self.unk_token)
+        continue
+      if token in self.vocab:
+        output_tokens.append(token)
+        continue
+
+      sub_tokens = []
+      start, trie = 0, self.word_trie
+      while start < len(token):
+        node, cur_substr, end = trie, None, start
+        for i in range(start, len(token)):
+          node = node.get(token[i])
+          if node is None:
+            break
+          if _TRIE_PIECE in node:
+            cur_substr, end = node[_TRIE_PIECE], i + 1
+        if cur_substr is None:
+          sub_tokens = None
+          break
+        sub_tokens.append(cur_substr)
+        start, trie = end, self.subword_trie
+
+      if sub_tokens is None:
+        output_tokens.append(self.unk_token)
+      else:
+        output_tokens.extend(sub_tokens)
+    return output_tokens
+
+
+_TRIE_PIECE = None  # key of the piece ending at a trie node, never a character
+
+
+def _trie_insert(trie, chars, piece):
+  node = trie
+  for char in chars:
+    node = node.setdefault(char, {})
+  node[_TRIE_PIECE] = piece
+
+
 def _is_whitespace(char):
   """Checks whether `chars` is a whitespace character."""
   # \t, \n, and \r are technically contorl characters but we treat them
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Measures the cold-start latency of run_classifier.py for one model type against importing every transformers architecture."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from tools.common import init_logger, logger
+
+# Run in a fresh interpreter so that nothing is already in ``sys.modules``: imports run_classifier.py and resolves
+# the classes of a model type, after importing every name exported by ``transformers`` first in ``eager`` mode (the
+# former behaviour of ``transformers/__init__.py``). Prints the time taken and the number of ``transformers`` submodules.
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+mode, model_type = sys.argv[1], sys.argv[2]
+if mode == 'eager':
+    import transformers
+    for name, module_name in transformers._name_to_module.items():
+        if module_name in transformers._import_structure or transformers.is_torch_available():
+            getattr(transformers, name)
+import run_classifier
+run_classifier.MODEL_CLASSES[model_type]
+print(time.perf_counter() - start, sum(1 for module in sys.modules if module.startswith('transformers.')))
+"""
+
+
+def time_import(mode, model_type, repeats):
+    """ Median seconds and number of ``transformers`` submodules of the ``mode`` startup in ``repeats`` fresh processes """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT, mode, model_type], cwd=cwd)
+        seconds, modules = output.decode('utf-8').split()
+        runs.append((float(seconds), int(modules)))
+    runs.sort()
+    return runs[len(runs) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_type", default="bert", type=str,
+                        help="Model type of run_classifier.py whose startup is measured.")
+    parser.add_argument("--repeats", default=5, type=int,
+                        help="Fresh interpreters per measurement; the median is reported.")
+    parser.add_argument("--output_file", default="", type=str, help="Write the report to this json file.")
+    args = parser.parse_args()
+    init_logger()
+
+    lazy_seconds, lazy_modules = time_import('lazy', args.model_type, args.repeats)
+    eager_seconds, eager_modules = time_import('eager', args.model_type, args.repeats)
+    report = {
+        'model_type': args.model_type,
+        'lazy_seconds': lazy_seconds,
+        'lazy_modules': lazy_modules,
+        'eager_seconds': eager_seconds,
+        'eager_modules': eager_modules,
+        'speedup': eager_seconds / lazy_seconds,
+    }
+    logger.info("run_classifier.py startup with %s: %.3fs, %d transformers modules; with every architecture "
+                "imported: %.3fs, %d modules (%.2fx)", args.model_type, lazy_seconds, lazy_modules, eager_seconds,
+                eager_modules, report['speedup'])
+    if args.output_file:
+        with open(args.output_file, 'w') as writer:
+            json.dump(report, writer, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
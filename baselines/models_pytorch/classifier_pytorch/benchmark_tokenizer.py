@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" Checks the trie WordPiece tokenizer against the greedy reference on the CLUE corpora and compares their throughput."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import time
+
+from processors import clue_processors as processors
+from tools.common import init_logger, logger
+from transformers import BertTokenizer, WordpieceTokenizer
+
+
+def load_texts(data_dir, task_name):
+    """ text_a and text_b of every train/dev/test example of ``task_name`` found under ``data_dir`` """
+    processor = processors[task_name]()
+    texts = []
+    for set_type in ('train', 'dev', 'test'):
+        if not os.path.exists(os.path.join(data_dir, '%s.json' % set_type)):
+            continue
+        for example in processor.iter_examples(data_dir, set_type):
+            texts.append(example.text_a)
+            if example.text_b:
+                texts.append(example.text_b)
+    return texts
+
+
+def timed_tokenize(tokenize, words, repeats):
+    """ Best time of ``repeats`` passes of ``tokenize`` over ``words``, and the pieces of the last one """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pieces = [tokenize(word) for word in words]
+        best = min(best, time.perf_counter() - start)
+    return pieces, best
+
+
+def check_task(args, tokenizer, reference, task_name):
+    texts = load_texts(os.path.join(args.data_dir, task_name), task_name)
+    if not texts:
+        logger.info("%s: no data under %s, skipped", task_name, os.path.join(args.data_dir, task_name))
+        return None
+    words = [word for text in texts
+             for word in tokenizer.basic_tokenizer.tokenize(text, never_split=tokenizer.all_special_tokens)]
+    expected, reference_seconds = timed_tokenize(reference.tokenize, words, args.repeats)
+    actual, trie_seconds = timed_tokenize(tokenizer.wordpiece_tokenizer.tokenize, words, args.repeats)
+    mismatches = [(word, e, a) for word, e, a in zip(words, expected, actual) if e != a]
+    for word, e, a in mismatches[:10]:
+        logger.error("%s: %r -> %r (reference %r)", task_name, word, a, e)
+    result = {
+        'texts': len(texts),
+        'words': len(words),
+        'pieces': sum(len(p) for p in expected),
+        'mismatches': len(mismatches),
+        'reference_words_per_s': len(words) / reference_seconds,
+        'trie_words_per_s': len(words) / trie_seconds,
+        'speedup': reference_seconds / trie_seconds,
+    }
+    logger.info("%s: %d texts, %d words, %d mismatches, %.0f -> %.0f words/s (%.2fx)", task_name, len(texts),
+                len(words), len(mismatches), result['reference_words_per_s'], result['trie_words_per_s'],
+                result['speedup'])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", default=None, type=str, required=True,
+                        help="Directory (or shortcut name) of the BERT vocabulary to check.")
+    parser.add_argument("--data_dir", default="CLUEdatasets", type=str,
+                        help="Directory with one sub-directory of train/dev/test json files per task.")
+    parser.add_argument("--task_names", default=",".join(processors.keys()), type=str,
+                        help="Comma separated CLUE tasks to check; tasks without data are skipped.")
+    parser.add_argument("--do_lower_case", action='store_true',
+                        help="Set this flag if you are using an uncased model.")
+    parser.add_argument("--repeats", default=3, type=int,
+                        help="Passes over each corpus; the fastest one is reported.")
+    parser.add_argument("--output_file", default="", type=str, help="Write the report to this json file.")
+    args = parser.parse_args()
+    init_logger()
+
+    tokenizer = BertTokenizer.from_pretrained(args.model_name_or_path, do_lower_case=args.do_lower_case)
+    reference = WordpieceTokenizer(vocab=tokenizer.vocab, unk_token=tokenizer.unk_token)
+    report = {}
+    for task_name in args.task_names.lower().split(','):
+        result = check_task(args, tokenizer, reference, task_name)
+        if result is not None:
+            report[task_name] = result
+    if args.output_file:
+        with open(args.output_file, 'w') as writer:
+            json.dump(report, writer, indent=2, sort_keys=True)
+    if any(result['mismatches'] for result in report.values()):
+        raise ValueError("The trie tokenizer differs from WordpieceTokenizer, see the errors above")
+
+
+if __name__ == "__main__":
+    main()
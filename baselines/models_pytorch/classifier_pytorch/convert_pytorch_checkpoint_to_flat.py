@@ -0,0 +1,46 @@
+"""Convert a PyTorch checkpoint (pytorch_model.bin) to a memory-mappable flat checkpoint (pytorch_model.flat)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import torch
+
+from transformers import WEIGHTS_NAME, FLAT_WEIGHTS_NAME, save_flat_state_dict
+
+import logging
+logging.basicConfig(level=logging.INFO)
+
+def convert_pytorch_checkpoint_to_flat(pytorch_checkpoint_path, flat_dump_path):
+    # Accept a model directory as well as the weights file itself
+    if os.path.isdir(pytorch_checkpoint_path):
+        pytorch_checkpoint_path = os.path.join(pytorch_checkpoint_path, WEIGHTS_NAME)
+    if os.path.isdir(flat_dump_path):
+        flat_dump_path = os.path.join(flat_dump_path, FLAT_WEIGHTS_NAME)
+
+    print("Loading PyTorch weights from {}".format(pytorch_checkpoint_path))
+    state_dict = torch.load(pytorch_checkpoint_path, map_location='cpu')
+
+    print("Save flat weights to {}".format(flat_dump_path))
+    save_flat_state_dict(state_dict, flat_dump_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    ## Required parameters
+    parser.add_argument("--pytorch_checkpoint_path",
+                        default = None,
+                        type = str,
+                        required = True,
+                        help = "Path to the PyTorch weights file, or to the model directory holding it.")
+    parser.add_argument("--flat_dump_path",
+                        default = None,
+                        type = str,
+                        required = True,
+                        help = "Path to the output flat weights file, or to the model directory to write it to. \n"
+                            "from_pretrained loads pytorch_model.flat in place of pytorch_model.bin when both exist.")
+    args = parser.parse_args()
+    convert_pytorch_checkpoint_to_flat(args.pytorch_checkpoint_path,
+                                       args.flat_dump_path)
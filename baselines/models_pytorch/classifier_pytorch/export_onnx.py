@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+""" Exports a fine-tuned CLUE classifier to ONNX, checks it against PyTorch and predicts through onnxruntime."""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import torch
+
+from processors import clue_output_modes as output_modes
+from processors import clue_processors as processors
+from run_classifier import MODEL_CLASSES, get_argparse, get_eval_dataloader, load_and_cache_examples, evaluate, predict
+from tools.common import seed_everything
+from tools.common import init_logger, logger
+from tools.onnx_inference import OPTIMIZATION_LEVELS, OnnxModel, check_parity, create_session, export_onnx
+from tools.quantization import timed, model_size
+
+
+def compare_backends(args, model, onnx_model, tokenizer):
+    """ Dev metrics, latency and throughput of the PyTorch model and of its onnxruntime session """
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    num_batches = (len(eval_dataset) + args.per_gpu_eval_batch_size - 1) // args.per_gpu_eval_batch_size
+    report = {}
+    for name, backend in (('pytorch', model), ('onnxruntime', onnx_model)):
+        metrics, elapsed = timed(evaluate, args, backend, tokenizer, prefix=name, eval_dataset=eval_dataset,
+                                 show_progress=False)
+        report[name] = {
+            'metrics': metrics,
+            'seconds': elapsed,
+            'latency_ms_per_batch': 1000.0 * elapsed / max(num_batches, 1),
+            'throughput_examples_per_s': len(eval_dataset) / elapsed if elapsed > 0 else float('inf'),
+        }
+    report['delta'] = {
+        'metrics': {key: report['onnxruntime']['metrics'][key] - report['pytorch']['metrics'][key]
+                    for key in report['pytorch']['metrics'] if key in report['onnxruntime']['metrics']},
+        'speedup': report['pytorch']['seconds'] / report['onnxruntime']['seconds']
+        if report['onnxruntime']['seconds'] > 0 else float('inf'),
+    }
+    logger.info("******** PyTorch vs onnxruntime ({}) ********".format(args.onnx_optimization))
+    for name in ('pytorch', 'onnxruntime'):
+        logger.info("  %s: %s, %.1f ms/batch, %.1f examples/s", name,
+                    ", ".join("%s = %.4f" % (k, v) for k, v in sorted(report[name]['metrics'].items())),
+                    report[name]['latency_ms_per_batch'], report[name]['throughput_examples_per_s'])
+    logger.info("  speedup = %.2fx", report['delta']['speedup'])
+    with open(os.path.join(args.output_dir, "onnx_benchmark.json"), "w") as writer:
+        json.dump(report, writer, indent=2, sort_keys=True)
+    return report
+
+
+def main():
+    parser = get_argparse()
+    parser.add_argument("--onnx_file", default="", type=str,
+                        help="Where to export the model; defaults to model.onnx in the output directory. "
+                             "An existing file is reused unless --overwrite_output_dir is set.")
+    parser.add_argument("--onnx_opset", default=14, type=int,
+                        help="ONNX opset version of the export.")
+    parser.add_argument("--onnx_optimization", default='all', type=str, choices=OPTIMIZATION_LEVELS,
+                        help="onnxruntime graph optimization level.")
+    parser.add_argument("--onnx_threads", default=0, type=int,
+                        help="onnxruntime intra-op threads (0: as many as PyTorch uses).")
+    parser.add_argument("--onnx_atol", default=1e-4, type=float,
+                        help="Largest logit difference to PyTorch accepted by the parity check.")
+    parser.add_argument("--onnx_parity_batches", default=10, type=int,
+                        help="Dev batches compared by the parity check.")
+    parser.add_argument("--onnx_benchmark", action='store_true',
+                        help="Compare dev metrics, latency and throughput of PyTorch and onnxruntime.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    args.output_dir = args.output_dir + '{}_onnx'.format(args.model_type)
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    init_logger(log_file=args.output_dir + '/{}-{}-onnx.log'.format(args.model_type, args.task_name))
+    if args.local_rank != -1:
+        raise ValueError("ONNX export and inference run on a single process")
+    args.device = torch.device("cpu")  # the export, the parity check and the benchmark run on CPU
+    args.n_gpu = 0
+    seed_everything(args.seed)
+
+    args.task_name = args.task_name.lower()
+    if args.task_name not in processors:
+        raise ValueError("Task not found: %s" % (args.task_name))
+    args.output_mode = output_modes[args.task_name]
+    label_list = processors[args.task_name]().get_labels()
+
+    args.model_type = args.model_type.lower()
+    if args.model_type not in ('bert', 'roberta', 'albert'):
+        raise ValueError("ONNX export is available for bert, roberta and albert models")
+    _, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path,
+                                                do_lower_case=args.do_lower_case)
+    model = model_class.from_pretrained(args.model_name_or_path)
+    model.to(args.device)
+    model.eval()
+    logger.info("Export parameters %s", args)
+
+    onnx_file = args.onnx_file or os.path.join(args.output_dir, 'model.onnx')
+    if not os.path.exists(onnx_file) or args.overwrite_output_dir:
+        export_onnx(model, onnx_file, opset_version=args.onnx_opset)
+    optimized_file = '{}.{}.onnx'.format(os.path.splitext(onnx_file)[0], args.onnx_optimization) \
+        if args.onnx_optimization != 'disable' else None
+    session = create_session(onnx_file, optimization=args.onnx_optimization, num_threads=args.onnx_threads,
+                             optimized_file=optimized_file)
+    onnx_model = OnnxModel(session, num_labels=1 if args.output_mode == "regression" else len(label_list))
+    logger.info("ONNX model: %.1f MB, PyTorch model: %.1f MB", os.path.getsize(onnx_file) / 2 ** 20,
+                model_size(model) / 2 ** 20)
+
+    # Dev batches are dynamically padded, so they cover several batch and sequence sizes
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    eval_dataloader, _ = get_eval_dataloader(args, eval_dataset, args.per_gpu_eval_batch_size)
+    batches = []
+    for batch in eval_dataloader:
+        batches.append(tuple(batch[:3]))
+        if len(batches) >= args.onnx_parity_batches:
+            break
+    max_diff = check_parity(model, onnx_model, batches)
+    logger.info("Parity check on %d dev batches: max |logits difference| = %.3g", len(batches), max_diff)
+    if max_diff > args.onnx_atol:
+        raise ValueError("onnxruntime logits differ from PyTorch by {:.3g} (> --onnx_atol {})".format(
+            max_diff, args.onnx_atol))
+
+    if args.onnx_benchmark:
+        compare_backends(args, model, onnx_model, tokenizer)
+
+    if args.do_predict:
+        predict(args, onnx_model, tokenizer, label_list)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,21 @@ import csv
 import sys
 import logging
 
+import numpy as np
+import torch
+
 logger = logging.getLogger(__name__)
 
-try:
-    from scipy.stats import pearsonr, spearmanr
-    from sklearn.metrics import matthews_corrcoef, f1_score
-    _has_sklearn = True
-except (AttributeError, ImportError) as e:
-    logger.warning("To use data.metrics please install scikit-learn. See https://scikit-learn.org/stable/index.html")
-    _has_sklearn = False
+# Every CLUE task is scored by accuracy, in compute_metrics and StreamingMetrics alike
+CLUE_TASKS = ("cls", "cmnli", "iflytek", "wsc", "tnews", "afqmc", "copa")
+
 
 def simple_accuracy(preds, labels):
     return (preds == labels).mean()
 
 def acc_and_f1(preds, labels):
+    # scikit-learn is only needed (and imported) by the tasks that report f1
+    from sklearn.metrics import f1_score
     acc = simple_accuracy(preds, labels)
     f1 = f1_score(y_true=labels, y_pred=preds)
     return {
@@ -25,6 +26,7 @@ def acc_and_f1(preds, labels):
     }
 
 def pearson_and_spearman(preds, labels):
+    from scipy.stats import pearsonr, spearmanr
     pearson_corr = pearsonr(preds, labels)[0]
     spearman_corr = spearmanr(preds, labels)[0]
     return {
@@ -35,19 +37,95 @@ def pearson_and_spearman(preds, labels):
 
 def compute_metrics(task_name, preds, labels):
     assert len(preds) == len(labels)
-    if task_name == "cls":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "cmnli":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "iflytek":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "wsc":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "tnews":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "afqmc":
-        return {"acc": simple_accuracy(preds, labels)}
-    elif task_name == "copa":
-        return {"acc": simple_accuracy(preds, labels)}
-    else:
+    if task_name not in CLUE_TASKS:
         raise KeyError(task_name)
+    return {"acc": simple_accuracy(preds, labels)}
+
+
+def _is_distributed():
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+class ConfusionMatrix(object):
+    '''
+    ``num_labels x num_labels`` confusion matrix (rows: labels, columns: predictions) updated per
+    batch with one ``bincount`` on the device of the batch, so nothing is read back until a metric
+    is asked for. Matrices of several processes are merged by ``all_reduce()``.
+
+    Example:
+        >>> matrix = ConfusionMatrix(num_labels, device=args.device)
+        >>> for batch in eval_dataloader:
+        >>>     matrix.update(logits, labels)
+        >>> matrix.all_reduce()  # distributed evaluation only
+        >>> matrix.accuracy(), matrix.f1('macro')
+    '''
+
+    def __init__(self, num_labels, device='cpu'):
+        self.num_labels = num_labels
+        self.matrix = torch.zeros((num_labels, num_labels), dtype=torch.long, device=device)
+
+    def update(self, preds, labels):
+        ''' ``preds`` are predicted label ids, or logits of shape ``(batch, num_labels)`` '''
+        if preds.dim() > 1:
+            preds = preds.argmax(dim=-1)
+        index = labels.view(-1).long().to(self.matrix.device) * self.num_labels + \
+            preds.view(-1).long().to(self.matrix.device)
+        self.matrix += torch.bincount(index, minlength=self.num_labels ** 2).view(self.num_labels, self.num_labels)
+
+    def all_reduce(self):
+        if _is_distributed():
+            torch.distributed.all_reduce(self.matrix)
+
+    def accuracy(self):
+        matrix = self.matrix.cpu().numpy()
+        return np.trace(matrix) / matrix.sum()
+
+    def f1(self, average='macro'):
+        '''
+        ``'binary'``: f1 of label 1, ``'micro'``: f1 of the pooled counts, ``'macro'``: mean f1 over the labels
+        present in the labels or the predictions (as scikit-learn's ``f1_score``).
+        '''
+        matrix = self.matrix.cpu().numpy().astype(np.float64)
+        tp = np.diag(matrix)
+        fp = matrix.sum(axis=0) - tp
+        fn = matrix.sum(axis=1) - tp
+        if average == 'micro':
+            tp, fp, fn = tp.sum(), fp.sum(), fn.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f1 = np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+        if average == 'binary':
+            return f1[1]
+        if average == 'macro':
+            return f1[(tp + fp + fn) > 0].mean()
+        return float(f1)
+
+
+class StreamingMetrics(object):
+    '''
+    The accuracy of ``compute_metrics`` for ``task_name``, with the macro and micro f1 of the same
+    confusion matrix, accumulated batch by batch from the logits instead of computed once every
+    prediction has been collected.
+
+    Example:
+        >>> metrics = StreamingMetrics(args.task_name, num_labels, device=args.device)
+        >>> for batch in eval_dataloader:
+        >>>     metrics.update(logits, labels)
+        >>> metrics.all_reduce()  # distributed evaluation only
+        >>> result = metrics.compute()
+    '''
+
+    def __init__(self, task_name, num_labels, device='cpu'):
+        if task_name not in CLUE_TASKS:
+            raise KeyError(task_name)
+        self.matrix = ConfusionMatrix(num_labels, device=device)
+
+    def update(self, logits, labels):
+        self.matrix.update(logits, labels)
+
+    def all_reduce(self):
+        self.matrix.all_reduce()
+
+    def compute(self):
+        return {"acc": self.matrix.accuracy(),
+                "macro_f1": self.matrix.f1('macro'),
+                "micro_f1": self.matrix.f1('micro')}
@@ -1,4 +1,9 @@
 from .utils import InputExample, InputFeatures, DataProcessor
 from .clue import (clue_output_modes, clue_processors, clue_tasks_num_labels,
-                   clue_convert_examples_to_features, collate_fn, xlnet_collate_fn)
-
+                   clue_convert_examples_to_features, clue_iter_examples_to_features,
+                   collate_fn, xlnet_collate_fn, dynamic_collate_fn)
+from .feature_cache import FeatureCacheWriter, FeatureCacheDataset, save_features_cache, is_feature_cache
+from .sampler import (BucketBatchSampler, DistributedBucketBatchSampler, SequentialDistributedSampler,
+                      MultiTaskBatchSampler, SkipSampler)
+from .streaming import StreamingFeatureDataset
+from .multitask import MultiTaskDataset
@@ -5,7 +5,9 @@
 # @Last Modified time: 2020-01-01 11:39:23
 """ CLUE processors and helpers """
 
+import collections
 import logging
+import multiprocessing
 import os
 import torch
 from .utils import DataProcessor, InputExample, InputFeatures
@@ -39,19 +41,125 @@ def xlnet_collate_fn(batch):
     return all_input_ids, all_attention_mask, all_token_type_ids, all_labels
 
 
-def clue_convert_examples_to_features(examples, tokenizer,
-                                      max_length=512,
-                                      task=None,
-                                      label_list=None,
-                                      output_mode=None,
-                                      pad_on_left=False,
-                                      pad_token=0,
-                                      pad_token_segment_id=0,
-                                      mask_padding_with_zero=True):
+def dynamic_collate_fn(batch, pad_token=0, pad_token_segment_id=0, pad_on_left=False):
     """
-    Loads a data file into a list of ``InputFeatures``
+    batch should be a list of variable-length (input_ids, attention_mask, token_type_ids, length, label) tuples...
+    Returns tensors padded to the longest sequence of the batch.
+    """
+    all_input_ids, all_attention_mask, all_token_type_ids, all_lens, all_labels = zip(*batch)
+    all_lens = torch.stack(all_lens)
+    all_labels = torch.stack(all_labels)
+    max_len = max(all_lens).item()
+    input_ids = torch.full((len(batch), max_len), pad_token, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+    token_type_ids = torch.full((len(batch), max_len), pad_token_segment_id, dtype=torch.long)
+    for i, length in enumerate(all_lens.tolist()):
+        span = slice(max_len - length, max_len) if pad_on_left else slice(0, length)
+        input_ids[i, span] = all_input_ids[i]
+        attention_mask[i, span] = all_attention_mask[i]
+        token_type_ids[i, span] = all_token_type_ids[i]
+    return input_ids, attention_mask, token_type_ids, all_labels
+
+
+def _convert_example(example, tokenizer, max_length, label_map, output_mode, pad_to_max_length,
+                     pad_on_left, pad_token, pad_token_segment_id, mask_padding_with_zero):
+    inputs = tokenizer.encode_plus(
+        example.text_a,
+        example.text_b,
+        add_special_tokens=True,
+        max_length=max_length
+    )
+    input_ids, token_type_ids = inputs["input_ids"], inputs["token_type_ids"]
+
+    # The mask has 1 for real tokens and 0 for padding tokens. Only real
+    # tokens are attended to.
+    attention_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
+    input_len = len(input_ids)
+    if pad_to_max_length:
+        # Zero-pad up to the sequence length.
+        padding_length = max_length - len(input_ids)
+        if pad_on_left:
+            input_ids = ([pad_token] * padding_length) + input_ids
+            attention_mask = ([0 if mask_padding_with_zero else 1] * padding_length) + attention_mask
+            token_type_ids = ([pad_token_segment_id] * padding_length) + token_type_ids
+        else:
+            input_ids = input_ids + ([pad_token] * padding_length)
+            attention_mask = attention_mask + ([0 if mask_padding_with_zero else 1] * padding_length)
+            token_type_ids = token_type_ids + ([pad_token_segment_id] * padding_length)
+
+        assert len(input_ids) == max_length, "Error with input length {} vs {}".format(len(input_ids), max_length)
+        assert len(attention_mask) == max_length, "Error with input length {} vs {}".format(len(attention_mask),
+                                                                                            max_length)
+        assert len(token_type_ids) == max_length, "Error with input length {} vs {}".format(len(token_type_ids),
+                                                                                            max_length)
+    if output_mode == "classification":
+        label = label_map[example.label]
+    elif output_mode == "regression":
+        label = float(example.label)
+    else:
+        raise KeyError(output_mode)
+    return InputFeatures(input_ids=input_ids,
+                         attention_mask=attention_mask,
+                         token_type_ids=token_type_ids,
+                         label=label,
+                         input_len=input_len)
+
+
+# Per-process state of the conversion workers, set once by ``_init_convert_worker``
+_worker_tokenizer = None
+_worker_kwargs = None
+
+
+def _init_convert_worker(tokenizer, kwargs):
+    global _worker_tokenizer, _worker_kwargs
+    _worker_tokenizer = tokenizer
+    _worker_kwargs = kwargs
+
+
+def _convert_chunk(examples):
+    return [_convert_example(example, _worker_tokenizer, **_worker_kwargs) for example in examples]
+
+
+def _chunks(examples, chunk_size):
+    chunk = []
+    for example in examples:
+        chunk.append(example)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bounded_imap(pool, chunks, max_pending):
+    """ Ordered ``pool.imap`` that keeps at most ``max_pending`` chunks in flight, so a stream of
+    examples is never read ahead of the consumer (``Pool.imap`` drains its whole input). """
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_convert_chunk, (chunk,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def clue_iter_examples_to_features(examples, tokenizer,
+                                   max_length=512,
+                                   task=None,
+                                   label_list=None,
+                                   output_mode=None,
+                                   pad_on_left=False,
+                                   pad_token=0,
+                                   pad_token_segment_id=0,
+                                   mask_padding_with_zero=True,
+                                   pad_to_max_length=True,
+                                   num_workers=1,
+                                   chunk_size=1000):
+    """
+    Lazily converts examples into ``InputFeatures``, so that a stream of examples can be turned into
+    features (and written to the feature cache) in constant memory.
     Args:
-        examples: List of ``InputExamples`` or ``tf.data.Dataset`` containing the examples.
+        examples: Iterable of ``InputExamples``, e.g. ``DataProcessor.iter_examples``.
         tokenizer: Instance of a tokenizer that will tokenize the examples
         max_length: Maximum example length
         task: CLUE task
@@ -63,10 +171,13 @@ def clue_convert_examples_to_features(examples, tokenizer,
         mask_padding_with_zero: If set to ``True``, the attention mask will be filled by ``1`` for actual values
             and by ``0`` for padded values. If set to ``False``, inverts it (``1`` for padded values, ``0`` for
             actual values)
+        pad_to_max_length: If set to ``False``, features keep their real length and padding is left to
+            ``dynamic_collate_fn``
+        num_workers: If > 1, examples are converted in that many processes, each with its own copy of the tokenizer
+        chunk_size: Number of examples sent to a worker at a time
 
     Returns:
-        If the input is a list of ``InputExamples``, will return
-        a list of task-specific ``InputFeatures`` which can be fed to the model.
+        A generator of task-specific ``InputFeatures``, in the order of ``examples``.
 
     """
     if task is not None:
@@ -79,63 +190,93 @@ def clue_convert_examples_to_features(examples, tokenizer,
             logger.info("Using output mode %s for task %s" % (output_mode, task))
 
     label_map = {label: i for i, label in enumerate(label_list)}
+    kwargs = dict(max_length=max_length,
+                  label_map=label_map,
+                  output_mode=output_mode,
+                  pad_to_max_length=pad_to_max_length,
+                  pad_on_left=pad_on_left,
+                  pad_token=pad_token,
+                  pad_token_segment_id=pad_token_segment_id,
+                  mask_padding_with_zero=mask_padding_with_zero)
+
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers, initializer=_init_convert_worker, initargs=(tokenizer, kwargs))
+        converted = _bounded_imap(pool, _chunks(examples, chunk_size), max_pending=2 * num_workers)
+    else:
+        converted = ([_convert_example(example, tokenizer, **kwargs) for example in chunk]
+                     for chunk in _chunks(examples, chunk_size))
+
+    ex_index = 0
+    try:
+        for chunk in converted:
+            for feature in chunk:
+                if ex_index % 10000 == 0:
+                    logger.info("Writing example %d" % (ex_index))
+                if ex_index < 5:
+                    logger.info("*** Example ***")
+                    logger.info("input_ids: %s" % " ".join([str(x) for x in feature.input_ids]))
+                    logger.info("attention_mask: %s" % " ".join([str(x) for x in feature.attention_mask]))
+                    logger.info("token_type_ids: %s" % " ".join([str(x) for x in feature.token_type_ids]))
+                    logger.info("label: %s" % (feature.label))
+                    logger.info("input length: %d" % (feature.input_len))
+                yield feature
+                ex_index += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    features = []
-    for (ex_index, example) in enumerate(examples):
-        if ex_index % 10000 == 0:
-            logger.info("Writing example %d" % (ex_index))
-
-        inputs = tokenizer.encode_plus(
-            example.text_a,
-            example.text_b,
-            add_special_tokens=True,
-            max_length=max_length
-        )
-        input_ids, token_type_ids = inputs["input_ids"], inputs["token_type_ids"]
-
-        # The mask has 1 for real tokens and 0 for padding tokens. Only real
-        # tokens are attended to.
-        attention_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
-        input_len = len(input_ids)
-        # Zero-pad up to the sequence length.
-        padding_length = max_length - len(input_ids)
-        if pad_on_left:
-            input_ids = ([pad_token] * padding_length) + input_ids
-            attention_mask = ([0 if mask_padding_with_zero else 1] * padding_length) + attention_mask
-            token_type_ids = ([pad_token_segment_id] * padding_length) + token_type_ids
-        else:
-            input_ids = input_ids + ([pad_token] * padding_length)
-            attention_mask = attention_mask + ([0 if mask_padding_with_zero else 1] * padding_length)
-            token_type_ids = token_type_ids + ([pad_token_segment_id] * padding_length)
 
-        assert len(input_ids) == max_length, "Error with input length {} vs {}".format(len(input_ids), max_length)
-        assert len(attention_mask) == max_length, "Error with input length {} vs {}".format(len(attention_mask),
-                                                                                            max_length)
-        assert len(token_type_ids) == max_length, "Error with input length {} vs {}".format(len(token_type_ids),
-                                                                                            max_length)
-        if output_mode == "classification":
-            label = label_map[example.label]
-        elif output_mode == "regression":
-            label = float(example.label)
-        else:
-            raise KeyError(output_mode)
-
-        if ex_index < 5:
-            logger.info("*** Example ***")
-            logger.info("guid: %s" % (example.guid))
-            logger.info("input_ids: %s" % " ".join([str(x) for x in input_ids]))
-            logger.info("attention_mask: %s" % " ".join([str(x) for x in attention_mask]))
-            logger.info("token_type_ids: %s" % " ".join([str(x) for x in token_type_ids]))
-            logger.info("label: %s (id = %d)" % (example.label, label))
-            logger.info("input length: %d" % (input_len))
-
-        features.append(
-            InputFeatures(input_ids=input_ids,
-                          attention_mask=attention_mask,
-                          token_type_ids=token_type_ids,
-                          label=label,
-                          input_len=input_len))
-    return features
+def clue_convert_examples_to_features(examples, tokenizer,
+                                      max_length=512,
+                                      task=None,
+                                      label_list=None,
+                                      output_mode=None,
+                                      pad_on_left=False,
+                                      pad_token=0,
+                                      pad_token_segment_id=0,
+                                      mask_padding_with_zero=True,
+                                      pad_to_max_length=True,
+                                      num_workers=1,
+                                      chunk_size=1000):
+    """
+    Loads a data file into a list of ``InputFeatures``
+    Args:
+        examples: List (or any iterable) of ``InputExamples`` containing the examples.
+        tokenizer: Instance of a tokenizer that will tokenize the examples
+        max_length: Maximum example length
+        task: CLUE task
+        label_list: List of labels. Can be obtained from the processor using the ``processor.get_labels()`` method
+        output_mode: String indicating the output mode. Either ``regression`` or ``classification``
+        pad_on_left: If set to ``True``, the examples will be padded on the left rather than on the right (default)
+        pad_token: Padding token
+        pad_token_segment_id: The segment ID for the padding token (It is usually 0, but can vary such as for XLNet where it is 4)
+        mask_padding_with_zero: If set to ``True``, the attention mask will be filled by ``1`` for actual values
+            and by ``0`` for padded values. If set to ``False``, inverts it (``1`` for padded values, ``0`` for
+            actual values)
+        pad_to_max_length: If set to ``False``, features keep their real length and padding is left to
+            ``dynamic_collate_fn``
+        num_workers: If > 1, examples are converted in that many processes, each with its own copy of the tokenizer
+        chunk_size: Number of examples sent to a worker at a time
+
+    Returns:
+        If the input is a list of ``InputExamples``, will return
+        a list of task-specific ``InputFeatures`` which can be fed to the model.
+
+    """
+    return list(clue_iter_examples_to_features(examples, tokenizer,
+                                               max_length=max_length,
+                                               task=task,
+                                               label_list=label_list,
+                                               output_mode=output_mode,
+                                               pad_on_left=pad_on_left,
+                                               pad_token=pad_token,
+                                               pad_token_segment_id=pad_token_segment_id,
+                                               mask_padding_with_zero=mask_padding_with_zero,
+                                               pad_to_max_length=pad_to_max_length,
+                                               num_workers=num_workers,
+                                               chunk_size=chunk_size))
 
 
 class TnewsProcessor(DataProcessor):
@@ -165,17 +306,14 @@ class TnewsProcessor(DataProcessor):
             labels.append(str(100 + i))
         return labels
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = line['sentence']
             text_b = None
             label = str(line['label']) if set_type != 'test' else "100"
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class IflytekProcessor(DataProcessor):
@@ -203,17 +341,14 @@ class IflytekProcessor(DataProcessor):
             labels.append(str(i))
         return labels
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = line['sentence']
             text_b = None
             label = str(line['label']) if set_type != 'test' else "0"
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class AfqmcProcessor(DataProcessor):
@@ -238,17 +373,14 @@ class AfqmcProcessor(DataProcessor):
         """See base class."""
         return ["0", "1"]
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = line['sentence1']
             text_b = line['sentence2']
             label = str(line['label']) if set_type != 'test' else "0"
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class CmnliProcessor(DataProcessor):
@@ -273,17 +405,14 @@ class CmnliProcessor(DataProcessor):
         """See base class."""
         return ["contradiction", "entailment", "neutral"]
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = line["sentence1"]
             text_b = line["sentence2"]
             label = str(line["gold_label"]) if set_type != 'test' else 'neutral'
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class CslProcessor(DataProcessor):
@@ -308,17 +437,14 @@ class CslProcessor(DataProcessor):
         """See base class."""
         return ["0", "1"]
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = " ".join(line['keyword'])
             text_b = line['abst']
             label = str(line['label']) if set_type != 'test' else '0'
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class WscProcessor(DataProcessor):
@@ -343,9 +469,8 @@ class WscProcessor(DataProcessor):
         """See base class."""
         return ["true", "false"]
 
-    def _create_examples(self, lines, set_type):
+    def _iter_examples(self, lines, set_type):
         """Creates examples for the training and dev sets."""
-        examples = []
         for (i, line) in enumerate(lines):
             guid = "%s-%s" % (set_type, i)
             text_a = line['text']
@@ -370,9 +495,7 @@ class WscProcessor(DataProcessor):
             text_a = "".join(text_a_list)
             text_b = None
             label = str(line['label']) if set_type != 'test' else 'true'
-            examples.append(
-                InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-        return examples
+            yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
 class CopaProcessor(DataProcessor):
@@ -397,8 +520,7 @@ class CopaProcessor(DataProcessor):
         """See base class."""
         return ["0", "1"]
 
-    def _create_examples(self, lines, set_type):
-        examples = []
+    def _iter_examples(self, lines, set_type):
         for (i, line) in enumerate(lines):
             i = 2 * i
             guid1 = "%s-%s" % (set_type, i)
@@ -420,11 +542,8 @@ class CopaProcessor(DataProcessor):
                 text_b2 = premise
             else:
                 raise ValueError(f'unknowed {line["question"]} type')
-            examples.append(
-                InputExample(guid=guid1, text_a=text_a, text_b=text_b, label=label))
-            examples.append(
-                InputExample(guid=guid2, text_a=text_a2, text_b=text_b2, label=label2))
-        return examples
+            yield InputExample(guid=guid1, text_a=text_a, text_b=text_b, label=label)
+            yield InputExample(guid=guid2, text_a=text_a2, text_b=text_b2, label=label2)
 
     def _create_examples_version2(self, lines, set_type):
         """Creates examples for the training and dev sets."""
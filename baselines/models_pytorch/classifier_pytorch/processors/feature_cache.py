@@ -0,0 +1,210 @@
+""" Memory-mapped, columnar cache for CLUE features """
+
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_META_NAME = 'meta.json'
+CACHE_COLUMNS = ('input_ids', 'attention_mask', 'token_type_ids', 'offsets', 'input_len', 'labels')
+
+
+def _ids_dtype(vocab_size):
+    """ Smallest integer type able to hold every token id of the vocabulary. """
+    if vocab_size is not None and vocab_size <= np.iinfo(np.int16).max + 1:
+        return np.int16
+    return np.int32
+
+
+def _column_file(cache_dir, name):
+    return os.path.join(cache_dir, name + '.bin')
+
+
+def is_feature_cache(cache_dir):
+    """ Returns ``True`` if ``cache_dir`` holds a complete feature cache. """
+    return os.path.isfile(os.path.join(cache_dir, CACHE_META_NAME))
+
+
+class FeatureCacheWriter(object):
+    """
+    Appends ``InputFeatures`` to a columnar cache directory.
+
+    The ``array.array`` token buffers of the features are read through the buffer protocol,
+    without going through Python ints.
+
+    Only the real (non padded) tokens of every feature are stored: the token columns are
+    concatenated into flat arrays and ``offsets`` marks where each feature starts. Columns are
+    raw little-endian binaries described by ``meta.json`` so they can be opened with ``np.memmap``.
+    The cache is written to a temporary directory and renamed into place on ``close()``, so
+    readers never observe a partially written cache.
+
+    Example:
+        >>> writer = FeatureCacheWriter(cache_dir, vocab_size=len(tokenizer), max_length=128)
+        >>> for feature in features:
+        >>>     writer.add(feature)
+        >>> writer.close()
+    """
+
+    def __init__(self, cache_dir, vocab_size=None, max_length=None, output_mode='classification',
+                 pad_on_left=False, pad_token=0, pad_token_segment_id=0, buffer_size=10000):
+        self.cache_dir = cache_dir
+        self.tmp_dir = '{}.tmp{}'.format(cache_dir.rstrip('/'), os.getpid())
+        self.max_length = max_length
+        self.output_mode = output_mode
+        self.pad_on_left = pad_on_left
+        self.pad_token = pad_token
+        self.pad_token_segment_id = pad_token_segment_id
+        self.buffer_size = buffer_size
+        self.dtypes = {
+            'input_ids': _ids_dtype(vocab_size),
+            'attention_mask': np.int8,
+            'token_type_ids': np.int8,
+            'offsets': np.int64,
+            'input_len': np.int32,
+            'labels': np.int64 if output_mode == 'classification' else np.float32,
+        }
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+        self._files = {name: open(_column_file(self.tmp_dir, name), 'wb') for name in CACHE_COLUMNS}
+        self._buffers = {name: [] for name in CACHE_COLUMNS}
+        self.num_examples = 0
+        self.num_tokens = 0
+        self._buffers['offsets'].append(0)
+
+    def _real_tokens(self, values, input_len):
+        if len(values) == input_len:
+            return values
+        return values[-input_len:] if self.pad_on_left else values[:input_len]
+
+    def add(self, feature):
+        input_len = feature.input_len
+        self._buffers['input_ids'].append(self._real_tokens(feature.input_ids, input_len))
+        self._buffers['attention_mask'].append(self._real_tokens(feature.attention_mask, input_len))
+        self._buffers['token_type_ids'].append(self._real_tokens(feature.token_type_ids, input_len))
+        self.num_tokens += input_len
+        self.num_examples += 1
+        self._buffers['offsets'].append(self.num_tokens)
+        self._buffers['input_len'].append(input_len)
+        self._buffers['labels'].append(feature.label)
+        if len(self._buffers['input_len']) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        for name in CACHE_COLUMNS:
+            values = self._buffers[name]
+            if not values:
+                continue
+            if name in ('input_ids', 'attention_mask', 'token_type_ids'):
+                data = np.concatenate([np.asarray(v, dtype=self.dtypes[name]) for v in values])
+            else:
+                data = np.asarray(values, dtype=self.dtypes[name])
+            self._files[name].write(data.astype(data.dtype.newbyteorder('<'), copy=False).tobytes())
+            self._buffers[name] = []
+
+    def close(self, overwrite=False):
+        """ Publishes the cache. An existing cache at ``cache_dir`` is only replaced with ``overwrite=True``. """
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        meta = {
+            'version': CACHE_VERSION,
+            'num_examples': self.num_examples,
+            'num_tokens': self.num_tokens,
+            'max_length': self.max_length,
+            'output_mode': self.output_mode,
+            'pad_on_left': self.pad_on_left,
+            'pad_token': self.pad_token,
+            'pad_token_segment_id': self.pad_token_segment_id,
+            'dtypes': {name: np.dtype(dtype).newbyteorder('<').str for name, dtype in self.dtypes.items()},
+        }
+        with open(os.path.join(self.tmp_dir, CACHE_META_NAME), 'w') as writer:
+            json.dump(meta, writer, indent=2, sort_keys=True)
+        if overwrite and os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        try:
+            # Fails if the target exists: a published cache is never removed under a reader
+            os.rename(self.tmp_dir, self.cache_dir)
+        except OSError:
+            # Another process published the same cache first, keep theirs.
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        return self.cache_dir
+
+
+def save_features_cache(features, cache_dir, overwrite=False, **kwargs):
+    """ Writes an iterable of ``InputFeatures`` to ``cache_dir`` (see ``FeatureCacheWriter``),
+    replacing an existing cache only with ``overwrite=True``. """
+    writer = FeatureCacheWriter(cache_dir, **kwargs)
+    for feature in features:
+        writer.add(feature)
+    return writer.close(overwrite=overwrite)
+
+
+class FeatureCacheDataset(Dataset):
+    """
+    A ``Dataset`` over a cache written by ``FeatureCacheWriter``.
+
+    Columns are opened lazily with ``np.memmap`` in read-only mode, so construction is
+    instantaneous, pages are loaded on demand and are shared through the OS page cache between
+    DDP ranks and DataLoader workers. Pickling the dataset (e.g. for spawned workers) only
+    transfers the cache path, never the data.
+
+    Items are ``(input_ids, attention_mask, token_type_ids, input_len, label)`` tensors holding
+    only the real tokens; batches are padded by ``dynamic_collate_fn`` using the padding values
+    recorded in ``meta``.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, CACHE_META_NAME), 'r') as reader:
+            self.meta = json.load(reader)
+        if self.meta['version'] != CACHE_VERSION:
+            raise ValueError("Unsupported feature cache version {} in {}".format(self.meta['version'], cache_dir))
+        self._arrays = None
+
+    def _open(self):
+        if self._arrays is None:
+            sizes = {'offsets': self.meta['num_examples'] + 1,
+                     'input_len': self.meta['num_examples'],
+                     'labels': self.meta['num_examples']}
+            arrays = {}
+            for name in CACHE_COLUMNS:
+                dtype = np.dtype(self.meta['dtypes'][name])
+                size = sizes.get(name, self.meta['num_tokens'])
+                if size == 0:
+                    arrays[name] = np.zeros(0, dtype=dtype)
+                else:
+                    arrays[name] = np.memmap(_column_file(self.cache_dir, name), dtype=dtype, mode='r', shape=(size,))
+            self._arrays = arrays
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    @property
+    def lengths(self):
+        """ Number of real tokens of every feature, as a memory-mapped array. """
+        return self._open()['input_len']
+
+    def __getitem__(self, index):
+        arrays = self._open()
+        start, end = arrays['offsets'][index], arrays['offsets'][index + 1]
+        label = arrays['labels'][index]
+        return (torch.from_numpy(arrays['input_ids'][start:end].astype(np.int64)),
+                torch.from_numpy(arrays['attention_mask'][start:end].astype(np.int64)),
+                torch.from_numpy(arrays['token_type_ids'][start:end].astype(np.int64)),
+                torch.tensor(int(arrays['input_len'][index]), dtype=torch.long),
+                torch.tensor(label.item(), dtype=torch.long if self.meta['output_mode'] == 'classification'
+                             else torch.float))
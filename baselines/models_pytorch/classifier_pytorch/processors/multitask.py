@@ -0,0 +1,45 @@
+""" Several CLUE datasets behind one index space, for multi-task training """
+
+import bisect
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+class MultiTaskDataset(Dataset):
+    """
+    Concatenates one dataset per task (e.g. ``FeatureCacheDataset``), in ``task_names`` order.
+
+    Items are ``(task_id, item)``; ``collate_fn`` pads a single-task batch with the collate function
+    of its task and appends the task id as a 0-dim tensor, so batches are
+    ``(input_ids, attention_mask, token_type_ids, labels, task_id)``. Use together with
+    ``MultiTaskBatchSampler`` which never mixes tasks inside a batch.
+
+    Args:
+        datasets: One dataset per task.
+        collate_fns: One collate function per task.
+    """
+
+    def __init__(self, datasets, collate_fns):
+        self.datasets = list(datasets)
+        self.collate_fns = list(collate_fns)
+        self.sizes = [len(dataset) for dataset in self.datasets]
+        self.offsets = np.cumsum([0] + self.sizes).tolist()
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def task_of(self, index):
+        return bisect.bisect_right(self.offsets, index) - 1
+
+    def __getitem__(self, index):
+        task = self.task_of(index)
+        return task, self.datasets[task][index - self.offsets[task]]
+
+    def collate_fn(self, batch):
+        tasks = set(task for task, _ in batch)
+        if len(tasks) != 1:
+            raise ValueError("A multi-task batch must hold a single task, got tasks {}".format(sorted(tasks)))
+        task = tasks.pop()
+        return tuple(self.collate_fns[task]([item for _, item in batch])) + (torch.tensor(task),)
@@ -0,0 +1,263 @@
+""" Length-aware batch samplers for CLUE features """
+
+import itertools
+import math
+
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Groups examples of similar length into the same batch so that ``collate_fn`` trims
+    as much padding as possible.
+
+    Examples are sorted by length, split into buckets of ``bucket_size`` examples of
+    neighbouring lengths, shuffled inside their bucket and cut into batches; the batch
+    order is shuffled as well. With ``shuffle=False`` the batches simply follow the length
+    order, which is what evaluation wants.
+
+    Args:
+        lengths: Number of real tokens of every example, e.g. ``FeatureCacheDataset.lengths``.
+        batch_size: Maximum number of examples per batch (``0`` for no limit, needs ``max_tokens``).
+        max_tokens: If > 0, batches are also limited to ``max_tokens`` padded tokens,
+            i.e. ``len(batch) * longest_example <= max_tokens``.
+        bucket_size: Number of examples sorted together. Defaults to ``100 * batch_size``.
+        shuffle: Shuffle inside buckets and the batch order.
+        seed: Base seed, combined with the epoch given to ``set_epoch``.
+        drop_last: Drop the last, incomplete batch of every bucket.
+
+    Example:
+        >>> sampler = BucketBatchSampler(dataset.lengths, batch_size=32, seed=42)
+        >>> dataloader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+        >>> for epoch in range(num_epochs):
+        >>>     sampler.set_epoch(epoch)
+    """
+
+    def __init__(self, lengths, batch_size, max_tokens=0, bucket_size=None, shuffle=True, seed=42,
+                 drop_last=False):
+        if batch_size <= 0 and max_tokens <= 0:
+            raise ValueError("Either batch_size or max_tokens must be positive")
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size or max(batch_size, 1) * 100
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        self._cache = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _split(self, indices):
+        """ Cuts ``indices`` into consecutive batches honouring ``batch_size`` and ``max_tokens``. """
+        batches = []
+        batch, longest = [], 0
+        for index in indices:
+            length = max(int(self.lengths[index]), 1)
+            new_longest = max(longest, length)
+            full = self.batch_size > 0 and len(batch) >= self.batch_size
+            over_budget = self.max_tokens > 0 and batch and new_longest * (len(batch) + 1) > self.max_tokens
+            if full or over_budget:
+                batches.append(batch)
+                batch, new_longest = [], length
+            batch.append(index)
+            longest = new_longest
+        if batch and not (self.drop_last and self.batch_size > 0 and len(batch) < self.batch_size):
+            batches.append(batch)
+        return batches
+
+    def batches(self):
+        """ All batches of the current epoch, in iteration order. """
+        if self._cache is not None and self._cache[0] == self.epoch:
+            return self._cache[1]
+        if not self.shuffle:
+            order = np.argsort(-self.lengths, kind='mergesort')
+            batches = self._split(order.tolist())
+        else:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            permutation = rng.permutation(len(self.lengths))
+            order = permutation[np.argsort(-self.lengths[permutation], kind='mergesort')]
+            batches = []
+            for start in range(0, len(order), self.bucket_size):
+                bucket = order[start:start + self.bucket_size]
+                rng.shuffle(bucket)
+                batches.extend(self._split(bucket.tolist()))
+            rng.shuffle(batches)
+        self._cache = (self.epoch, batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
+
+
+class DistributedBucketBatchSampler(BucketBatchSampler):
+    """
+    ``BucketBatchSampler`` for distributed training.
+
+    Every rank builds the same global batch list from the shared seed and keeps every
+    ``num_replicas``-th batch. With ``pad=True`` batches are repeated so that all ranks run
+    the same number of steps, as ``DistributedSampler`` does.
+    """
+
+    def __init__(self, lengths, batch_size, num_replicas=None, rank=None, pad=True, **kwargs):
+        super(DistributedBucketBatchSampler, self).__init__(lengths, batch_size, **kwargs)
+        if num_replicas is None:
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            rank = dist.get_rank()
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.pad = pad
+
+    def __iter__(self):
+        return iter(self.local_batches())
+
+    def local_batches(self):
+        batches = self.batches()
+        if self.pad and batches:
+            total = int(math.ceil(len(batches) / float(self.num_replicas))) * self.num_replicas
+            batches = batches + [batches[i % len(batches)] for i in range(total - len(batches))]
+        return batches[self.rank::self.num_replicas]
+
+    def __len__(self):
+        return len(self.local_batches())
+
+
+class SequentialDistributedSampler(Sampler):
+    """
+    Distributed evaluation sampler: splits the dataset into ``num_replicas`` contiguous shards, in order
+    and without the duplicated examples ``DistributedSampler`` pads with, so shard sizes differ by at
+    most one and concatenating the shards in rank order gives back the dataset order.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            rank = dist.get_rank()
+        self.num_examples = len(dataset)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.start = rank * self.num_examples // num_replicas
+        self.end = (rank + 1) * self.num_examples // num_replicas
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class MultiTaskBatchSampler(Sampler):
+    """
+    Mixes the batches of several datasets concatenated into one ``MultiTaskDataset``; every batch
+    holds examples of a single task, so one head is run per step.
+
+    Each task is shuffled and cut into batches of its own. The task of every step is drawn with
+    probability proportional to ``num_batches ** (1 / temperature)``: ``temperature=1`` samples
+    tasks in proportion to their size (every batch is seen exactly once per epoch), larger
+    temperatures up-sample the small tasks, whose batches are then cycled through again.
+
+    Args:
+        sizes: Number of examples of every task, in ``MultiTaskDataset`` order.
+        batch_size: Number of examples per batch.
+        temperature: Task sampling temperature, see above.
+        shuffle: If ``False``, tasks are visited in order, each batch once (evaluation).
+        seed: Base seed, combined with the epoch given to ``set_epoch``.
+        num_replicas, rank: For distributed training, every rank keeps every ``num_replicas``-th batch.
+
+    Example:
+        >>> dataset = MultiTaskDataset([afqmc_dataset, tnews_dataset])
+        >>> sampler = MultiTaskBatchSampler(dataset.sizes, batch_size=32, temperature=2.0)
+        >>> dataloader = DataLoader(dataset, batch_sampler=sampler, collate_fn=dataset.collate_fn)
+    """
+
+    def __init__(self, sizes, batch_size, temperature=1.0, shuffle=True, seed=42, num_replicas=1, rank=0):
+        self.sizes = [int(size) for size in sizes]
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)]).astype(np.int64)
+        self.batch_size = batch_size
+        self.temperature = temperature
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._cache = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _task_batches(self, task, rng):
+        indices = np.arange(self.offsets[task], self.offsets[task + 1])
+        if rng is not None:
+            rng.shuffle(indices)
+        return [indices[start:start + self.batch_size].tolist() for start in range(0, len(indices), self.batch_size)]
+
+    def batches(self):
+        """ All batches of the current epoch (all ranks), in iteration order. """
+        if self._cache is not None and self._cache[0] == self.epoch:
+            return self._cache[1]
+        if not self.shuffle:
+            batches = [batch for task in range(len(self.sizes)) for batch in self._task_batches(task, None)]
+        else:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            task_batches = [self._task_batches(task, rng) for task in range(len(self.sizes))]
+            counts = np.array([len(b) for b in task_batches], dtype=np.float64)
+            if self.temperature == 1.0:
+                batches = [batch for b in task_batches for batch in b]
+                rng.shuffle(batches)
+            else:
+                probs = counts ** (1.0 / self.temperature)
+                probs /= probs.sum()
+                positions = [0] * len(task_batches)
+                batches = []
+                for task in rng.choice(len(task_batches), size=int(counts.sum()), p=probs):
+                    if positions[task] == len(task_batches[task]):
+                        task_batches[task] = self._task_batches(task, rng)
+                        positions[task] = 0
+                    batches.append(task_batches[task][positions[task]])
+                    positions[task] += 1
+        self._cache = (self.epoch, batches)
+        return batches
+
+    def local_batches(self):
+        batches = self.batches()
+        if self.num_replicas > 1 and batches:
+            total = int(math.ceil(len(batches) / float(self.num_replicas))) * self.num_replicas
+            batches = batches + [batches[i % len(batches)] for i in range(total - len(batches))]
+        return batches[self.rank::self.num_replicas]
+
+    def __iter__(self):
+        return iter(self.local_batches())
+
+    def __len__(self):
+        return len(self.local_batches())
+
+
+class SkipSampler(Sampler):
+    """
+    Resumes a sampler (or batch sampler) in the middle of an epoch: ``sampler`` is iterated from
+    the start, consuming its randomness exactly as an uninterrupted epoch would, and its first
+    ``num_skip`` items are dropped.
+    """
+
+    def __init__(self, sampler, num_skip):
+        self.sampler = sampler
+        self.num_skip = num_skip
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        return itertools.islice(iter(self.sampler), self.num_skip, None)
+
+    def __len__(self):
+        return max(len(self.sampler) - self.num_skip, 0)
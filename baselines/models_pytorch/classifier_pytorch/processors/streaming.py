@@ -0,0 +1,99 @@
+""" Constant-memory, iterable datasets over CLUE data files """
+
+import random
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .clue import _convert_example
+
+
+class StreamingFeatureDataset(IterableDataset):
+    """
+    Reads examples straight from a CLUE json file and converts them on the fly, so training on
+    very large (or augmented) corpora never holds more than ``shuffle_buffer_size`` features.
+
+    Examples are sharded across DDP ranks and DataLoader workers by line: shard
+    ``rank * num_workers + worker_id`` keeps every ``world_size * num_workers``-th example.
+    Items have the same layout as ``FeatureCacheDataset`` and ``meta`` carries the padding
+    values, so batches are built with the same ``dynamic_collate_fn``.
+
+    Args:
+        processor: A ``DataProcessor`` instance.
+        data_dir: Directory holding ``{set_type}.json``.
+        set_type: ``train``, ``dev`` or ``test``.
+        tokenizer: Tokenizer used to encode the examples.
+        label_list: Labels of the task, in id order.
+        shuffle_buffer_size: If > 1, examples are drawn at random from a buffer of that size.
+        seed: Seed of the shuffle buffer, combined with the epoch given to ``set_epoch``.
+        rank, world_size: Position of this process in distributed training.
+    """
+
+    def __init__(self, processor, data_dir, set_type, tokenizer, label_list, max_length=512,
+                 output_mode='classification', pad_on_left=False, pad_token=0, pad_token_segment_id=0,
+                 shuffle_buffer_size=0, seed=42, rank=0, world_size=1):
+        self.processor = processor
+        self.data_dir = data_dir
+        self.set_type = set_type
+        self.tokenizer = tokenizer
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.convert_kwargs = dict(max_length=max_length,
+                                   label_map={label: i for i, label in enumerate(label_list)},
+                                   output_mode=output_mode,
+                                   pad_to_max_length=False,
+                                   pad_on_left=pad_on_left,
+                                   pad_token=pad_token,
+                                   pad_token_segment_id=pad_token_segment_id,
+                                   mask_padding_with_zero=True)
+        self.meta = {'max_length': max_length,
+                     'output_mode': output_mode,
+                     'pad_on_left': pad_on_left,
+                     'pad_token': pad_token,
+                     'pad_token_segment_id': pad_token_segment_id}
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _shard(self):
+        worker_info = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker_info is None else (worker_info.num_workers, worker_info.id)
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def _features(self):
+        shard_id, num_shards = self._shard()
+        for i, example in enumerate(self.processor.iter_examples(self.data_dir, self.set_type)):
+            if i % num_shards == shard_id:
+                yield _convert_example(example, self.tokenizer, **self.convert_kwargs)
+
+    def _to_tensors(self, feature):
+        return (torch.from_numpy(np.frombuffer(feature.input_ids, dtype=np.int32).astype(np.int64)),
+                torch.from_numpy(np.frombuffer(feature.attention_mask, dtype=np.int8).astype(np.int64)),
+                torch.from_numpy(np.frombuffer(feature.token_type_ids, dtype=np.int8).astype(np.int64)),
+                torch.tensor(feature.input_len, dtype=torch.long),
+                torch.tensor(feature.label, dtype=torch.long if self.meta['output_mode'] == 'classification'
+                             else torch.float))
+
+    def __iter__(self):
+        features = self._features()
+        if self.shuffle_buffer_size <= 1:
+            for feature in features:
+                yield self._to_tensors(feature)
+            return
+        shard_id, _ = self._shard()
+        rng = random.Random(self.seed + self.epoch * 1000003 + shard_id)
+        buffer = []
+        for feature in features:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(feature)
+                continue
+            index = rng.randrange(len(buffer))
+            yield self._to_tensors(buffer[index])
+            buffer[index] = feature
+        rng.shuffle(buffer)
+        for feature in buffer:
+            yield self._to_tensors(feature)
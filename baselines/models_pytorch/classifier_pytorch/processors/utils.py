@@ -1,7 +1,8 @@
 import csv
+import os
 import sys
-import copy
 import json
+from array import array
 
 class InputExample(object):
     """
@@ -16,6 +17,8 @@ class InputExample(object):
         label: (Optional) string. The label of the example. This should be
         specified for train and dev examples, but not for test examples.
     """
+    __slots__ = ('guid', 'text_a', 'text_b', 'label')
+
     def __init__(self, guid, text_a, text_b=None, label=None):
         self.guid = guid
         self.text_a = text_a
@@ -27,8 +30,7 @@ class InputExample(object):
 
     def to_dict(self):
         """Serializes this instance to a Python dictionary."""
-        output = copy.deepcopy(self.__dict__)
-        return output
+        return {name: getattr(self, name) for name in self.__slots__}
 
     def to_json_string(self):
         """Serializes this instance to a JSON string."""
@@ -39,6 +41,9 @@ class InputFeatures(object):
     """
     A single set of features of data.
 
+    Token columns are kept in compact ``array.array`` buffers (4 bytes per id, 1 byte per mask
+    or segment value) instead of lists of Python ints; ``np.frombuffer`` views them without a copy.
+
     Args:
         input_ids: Indices of input sequence tokens in the vocabulary.
         attention_mask: Mask to avoid performing attention on padding token indices.
@@ -47,11 +52,12 @@ class InputFeatures(object):
         token_type_ids: Segment token indices to indicate first and second portions of the inputs.
         label: Label corresponding to the input
     """
+    __slots__ = ('input_ids', 'attention_mask', 'token_type_ids', 'input_len', 'label')
 
     def __init__(self, input_ids, attention_mask, token_type_ids, label,input_len):
-        self.input_ids = input_ids
-        self.attention_mask = attention_mask
-        self.token_type_ids = token_type_ids
+        self.input_ids = array('i', input_ids)
+        self.attention_mask = array('b', attention_mask)
+        self.token_type_ids = array('b', token_type_ids)
         self.input_len = input_len
         self.label = label
 
@@ -60,7 +66,9 @@ class InputFeatures(object):
 
     def to_dict(self):
         """Serializes this instance to a Python dictionary."""
-        output = copy.deepcopy(self.__dict__)
+        output = {name: getattr(self, name) for name in self.__slots__}
+        for name in ('input_ids', 'attention_mask', 'token_type_ids'):
+            output[name] = output[name].tolist()
         return output
 
     def to_json_string(self):
@@ -83,6 +91,18 @@ class DataProcessor(object):
         """Gets the list of labels for this data set."""
         raise NotImplementedError()
 
+    def iter_examples(self, data_dir, set_type):
+        """Lazily yields the `InputExample`s of ``set_type`` ('train', 'dev' or 'test'), one line at a time."""
+        return self._iter_examples(self._iter_json(os.path.join(data_dir, "%s.json" % set_type)), set_type)
+
+    def _iter_examples(self, lines, set_type):
+        """Yields `InputExample`s from an iterable of parsed lines."""
+        raise NotImplementedError()
+
+    def _create_examples(self, lines, set_type):
+        """Creates a list of `InputExample`s from parsed lines."""
+        return list(self._iter_examples(lines, set_type))
+
     @classmethod
     def _read_tsv(cls, input_file, quotechar=None):
         """Reads a tab separated value file."""
@@ -96,9 +116,13 @@ class DataProcessor(object):
     @classmethod
     def _read_json(cls, input_file):
         """Reads a json list file."""
-        with open(input_file, "r") as f:
-            reader = f.readlines()
-            lines = []
-            for line in reader:
-                lines.append(json.loads(line.strip()))
-            return lines
+        return list(cls._iter_json(input_file))
+
+    @classmethod
+    def _iter_json(cls, input_file):
+        """Lazily parses a json list file, one line at a time."""
+        with open(input_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
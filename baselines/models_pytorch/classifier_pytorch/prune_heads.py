@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+""" Iteratively prunes the attention heads of a fine-tuned CLUE classifier down to a FLOP or latency budget."""
+
+from __future__ import absolute_import, division, print_function
+
+import copy
+import json
+import math
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader, SequentialSampler
+
+from processors import clue_output_modes as output_modes
+from processors import clue_processors as processors
+from run_classifier import MODEL_CLASSES, get_argparse, get_collate_fn, load_and_cache_examples, train, evaluate
+from tools.common import seed_everything
+from tools.common import init_logger, logger
+from tools.progressbar import ProgressBar
+from transformers import BertForSequenceClassification
+
+
+def get_dataloader(args, dataset):
+    return DataLoader(dataset, sampler=SequentialSampler(dataset), batch_size=args.per_gpu_eval_batch_size,
+                      collate_fn=get_collate_fn(dataset))
+
+
+def model_inputs(batch):
+    return {'input_ids': batch[0], 'attention_mask': batch[1], 'token_type_ids': batch[2], 'labels': batch[3]}
+
+
+def remaining_heads(config):
+    """ Original indices of the heads left in every layer, ``config.pruned_heads`` being those already pruned """
+    return [[head for head in range(config.num_attention_heads) if head not in config.pruned_heads.get(layer, [])]
+            for layer in range(config.num_hidden_layers)]
+
+
+def encoder_flops(config, heads_per_layer, seq_length):
+    """ Floating point operations (2 per multiply-add) of the encoder on one sequence of ``seq_length`` tokens """
+    head_size = config.hidden_size // config.num_attention_heads
+    flops = 0
+    for num_heads in heads_per_layer:
+        attention_size = num_heads * head_size
+        flops += 2 * seq_length * config.hidden_size * attention_size * 3  # query, key, value
+        flops += 2 * seq_length * seq_length * attention_size * 2  # scores and context
+        flops += 2 * seq_length * attention_size * config.hidden_size  # attention output
+        flops += 2 * seq_length * config.hidden_size * config.intermediate_size * 2  # feed-forward
+    return flops
+
+
+def compute_head_importance(args, model, eval_dataset):
+    """
+    Importance of every remaining head: the absolute gradient of the loss w.r.t. a gate multiplying
+    the head's output, summed over the dev set (Michel et al., 2019), then L2-normalised per layer
+    so that scores compare across layers. Returns one tensor of shape ``(num_heads_of_the_layer,)`` per layer.
+    """
+    layers = model.bert.encoder.layer
+    head_masks = [torch.ones(layer.attention.self.num_attention_heads, device=args.device, requires_grad=True)
+                  for layer in layers]
+    importance = [torch.zeros_like(mask) for mask in head_masks]
+    requires_grad = [p.requires_grad for p in model.parameters()]
+    for p in model.parameters():
+        p.requires_grad_(False)  # only the gates need gradients
+    model.eval()
+    dataloader = get_dataloader(args, eval_dataset)
+    pbar = ProgressBar(n_total=len(dataloader), desc="Head importance")
+    for step, batch in enumerate(dataloader):
+        batch = tuple(t.to(args.device) for t in batch)
+        loss = model(head_mask=head_masks, **model_inputs(batch))[0]
+        loss.backward()
+        for layer_importance, mask in zip(importance, head_masks):
+            layer_importance += mask.grad.abs()
+            mask.grad = None
+        pbar(step)
+    print(' ')
+    for p, flag in zip(model.parameters(), requires_grad):
+        p.requires_grad_(flag)
+    return [layer_importance / (layer_importance.norm() + 1e-20) for layer_importance in importance]
+
+
+def select_heads(importance, heads, num_heads, min_heads_per_layer, within_budget):
+    """
+    The ``num_heads`` least important heads, as ``{layer: [original head indices]}``, never leaving less than
+    ``min_heads_per_layer`` heads in a layer; stops early once ``within_budget(heads_per_layer)`` holds.
+    """
+    scores = sorted((float(score), layer, position) for layer, layer_importance in enumerate(importance)
+                    for position, score in enumerate(layer_importance.tolist()))
+    heads_per_layer = [len(layer_heads) for layer_heads in heads]
+    to_prune, num_selected = {}, 0
+    for _, layer, position in scores:
+        if num_selected >= num_heads or within_budget(heads_per_layer):
+            break
+        if heads_per_layer[layer] <= min_heads_per_layer:
+            continue
+        to_prune.setdefault(layer, []).append(heads[layer][position])
+        heads_per_layer[layer] -= 1
+        num_selected += 1
+    return to_prune
+
+
+def measure_latency(args, model, eval_dataset):
+    """ Mean milliseconds per forward pass over the first ``--latency_batches`` dev batches, after a warm-up batch """
+    model.eval()
+    batches = []
+    for batch in get_dataloader(args, eval_dataset):
+        batches.append(tuple(t.to(args.device) for t in batch))
+        if len(batches) > args.latency_batches:
+            break
+    with torch.no_grad():
+        model(**model_inputs(batches[0]))
+        if args.device.type == 'cuda':
+            torch.cuda.synchronize(args.device)
+        start = time.perf_counter()
+        for batch in batches[1:]:
+            model(**model_inputs(batch))
+        if args.device.type == 'cuda':
+            torch.cuda.synchronize(args.device)
+    return 1000.0 * (time.perf_counter() - start) / max(len(batches) - 1, 1)
+
+
+def finetune(args, model, tokenizer, train_dataset):
+    """ A short fine-tuning run of ``--finetune_steps`` steps, without checkpoints nor intermediate evaluations """
+    finetune_args = copy.copy(args)
+    finetune_args.max_steps = args.finetune_steps
+    finetune_args.logging_steps = 0
+    finetune_args.save_steps = 0
+    finetune_args.resume_from_checkpoint = None
+    global_step, tr_loss = train(finetune_args, train_dataset, model, tokenizer)
+    logger.info(" fine-tuned for %s steps, average loss = %s", global_step, tr_loss)
+
+
+def prune(args, model, tokenizer, eval_dataset, train_dataset=None):
+    """
+    Prunes rounds of ``--prune_ratio_per_round`` of the original heads, the least important first, until the
+    encoder FLOPs are at most ``--target_flops_ratio`` of the unpruned model and the latency at most
+    ``--target_latency_ratio`` of the starting one (a ratio <= 0 is no target). Every round is followed by
+    ``--finetune_steps`` of training and an evaluation. Returns the report of every round.
+    """
+    config = model.config
+    full_flops = encoder_flops(config, [config.num_attention_heads] * config.num_hidden_layers, args.max_seq_length)
+    num_heads_per_round = max(1, int(math.ceil(args.prune_ratio_per_round *
+                                               config.num_attention_heads * config.num_hidden_layers)))
+
+    def flops_ratio(heads_per_layer):
+        return encoder_flops(config, heads_per_layer, args.max_seq_length) / full_flops
+
+    def within_flops_budget(heads_per_layer):
+        return args.target_flops_ratio <= 0 or flops_ratio(heads_per_layer) <= args.target_flops_ratio
+
+    rounds = []
+    start_latency = None
+    for prune_round in range(args.max_prune_rounds + 1):
+        heads = remaining_heads(config)
+        heads_per_layer = [len(layer_heads) for layer_heads in heads]
+        if prune_round > 0:
+            importance = compute_head_importance(args, model, eval_dataset)
+            to_prune = select_heads(importance, heads, num_heads_per_round, args.min_heads_per_layer,
+                                    within_flops_budget if args.target_latency_ratio <= 0 else lambda _: False)
+            if not to_prune:
+                logger.info("No head left to prune")
+                break
+            logger.info("Round %d: pruning heads %s", prune_round, to_prune)
+            model.prune_heads(to_prune)
+            heads = remaining_heads(config)
+            heads_per_layer = [len(layer_heads) for layer_heads in heads]
+            if train_dataset is not None and args.finetune_steps > 0:
+                finetune(args, model, tokenizer, train_dataset)
+        latency = measure_latency(args, model, eval_dataset)
+        if start_latency is None:
+            start_latency = latency
+        metrics = evaluate(args, model, tokenizer, prefix='round-{}'.format(prune_round), eval_dataset=eval_dataset,
+                           show_progress=False)
+        rounds.append({
+            'round': prune_round,
+            'heads_per_layer': heads_per_layer,
+            'pruned_heads': dict((layer, sorted(layer_heads)) for layer, layer_heads in config.pruned_heads.items()),
+            'flops_ratio': flops_ratio(heads_per_layer),
+            'latency_ms_per_batch': latency,
+            'latency_ratio': latency / start_latency,
+            'num_parameters': sum(p.numel() for p in model.parameters()),
+            'metrics': metrics,
+        })
+        logger.info("Round %d: %d heads, flops ratio = %.3f, latency ratio = %.3f, %s", prune_round,
+                    sum(heads_per_layer), rounds[-1]['flops_ratio'], rounds[-1]['latency_ratio'],
+                    ", ".join("%s = %.4f" % (k, v) for k, v in sorted(metrics.items())))
+        if within_flops_budget(heads_per_layer) and (
+                args.target_latency_ratio <= 0 or rounds[-1]['latency_ratio'] <= args.target_latency_ratio):
+            logger.info("Budget reached after %d rounds", prune_round)
+            break
+    return rounds
+
+
+def main():
+    parser = get_argparse()
+    parser.add_argument("--target_flops_ratio", default=0.5, type=float,
+                        help="Prune until the encoder FLOPs are at most this fraction of the unpruned model's "
+                             "(<= 0: no FLOP target).")
+    parser.add_argument("--target_latency_ratio", default=0.0, type=float,
+                        help="Prune until the dev latency is at most this fraction of the starting model's "
+                             "(<= 0: no latency target).")
+    parser.add_argument("--prune_ratio_per_round", default=0.1, type=float,
+                        help="Fraction of the original heads pruned at most per round.")
+    parser.add_argument("--max_prune_rounds", default=20, type=int,
+                        help="Maximum number of pruning rounds.")
+    parser.add_argument("--min_heads_per_layer", default=1, type=int,
+                        help="Heads kept at least in every layer.")
+    parser.add_argument("--finetune_steps", default=100, type=int,
+                        help="Training steps after every round (0: no fine-tuning).")
+    parser.add_argument("--latency_batches", default=20, type=int,
+                        help="Dev batches timed to measure the latency of every round.")
+    args = parser.parse_args()
+    if args.target_flops_ratio <= 0 and args.target_latency_ratio <= 0:
+        raise ValueError("Set --target_flops_ratio and/or --target_latency_ratio")
+
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    args.output_dir = args.output_dir + '{}_pruned'.format(args.model_type)
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    init_logger(log_file=args.output_dir + '/{}-{}-prune.log'.format(args.model_type, args.task_name))
+    if args.local_rank != -1:
+        raise ValueError("Pruning runs on a single process")
+    args.device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    args.n_gpu = 1 if args.device.type == 'cuda' else 0
+    seed_everything(args.seed)
+
+    args.task_name = args.task_name.lower()
+    if args.task_name not in processors:
+        raise ValueError("Task not found: %s" % (args.task_name))
+    args.output_mode = output_modes[args.task_name]
+
+    args.model_type = args.model_type.lower()
+    config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    if model_class is not BertForSequenceClassification:
+        raise ValueError("Head pruning is only available for bert and roberta models")
+    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path,
+                                                do_lower_case=args.do_lower_case)
+    model = model_class.from_pretrained(args.model_name_or_path)
+    model.to(args.device)
+    logger.info("Pruning parameters %s", args)
+
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    train_dataset = None
+    if args.finetune_steps > 0:
+        train_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='train')
+    rounds = prune(args, model, tokenizer, eval_dataset, train_dataset)
+
+    # config.pruned_heads is saved with the weights, from_pretrained() rebuilds the pruned architecture
+    logger.info("Saving pruned model to %s", args.output_dir)
+    model.save_pretrained(args.output_dir)
+    tokenizer.save_pretrained(args.output_dir)
+    torch.save(args, os.path.join(args.output_dir, 'training_args.bin'))
+    with open(os.path.join(args.output_dir, "prune_report.json"), "w") as writer:
+        json.dump(rounds, writer, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
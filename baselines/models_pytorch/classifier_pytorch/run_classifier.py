@@ -8,51 +8,155 @@
 from __future__ import absolute_import, division, print_function
 
 import argparse
+import collections
+import collections.abc
+import copy
+import functools
 import glob
+import itertools
 import logging
+import multiprocessing
 import os
 import json
 import numpy as np
 import torch
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler, TensorDataset
+from torch.utils.data import DataLoader, RandomSampler, SequentialSampler, IterableDataset
 from torch.utils.data.distributed import DistributedSampler
 
-from transformers import (WEIGHTS_NAME, BertConfig,
-                          BertForSequenceClassification, BertTokenizer,
-                          RobertaConfig, XLNetConfig,
-                          XLNetForSequenceClassification,
-                          XLNetTokenizer,
-                          AlbertForSequenceClassification)
+import transformers
+from transformers import (WEIGHTS_NAME, FLAT_WEIGHTS_NAME, BertForEarlyExitSequenceClassification,
+                          load_flat_state_dict)
 
 from transformers import AdamW, WarmupLinearSchedule
-from metrics.clue_compute_metrics import compute_metrics
+from metrics.clue_compute_metrics import StreamingMetrics
 from processors import clue_output_modes as output_modes
 from processors import clue_processors as processors
-from processors import clue_convert_examples_to_features as convert_examples_to_features
-from processors import collate_fn, xlnet_collate_fn
+from processors import clue_iter_examples_to_features as convert_examples_to_features
+from processors import dynamic_collate_fn
+from processors import FeatureCacheDataset, save_features_cache, is_feature_cache
+from processors import BucketBatchSampler, DistributedBucketBatchSampler, SequentialDistributedSampler, SkipSampler
+from processors import StreamingFeatureDataset
 from tools.common import seed_everything, save_numpy
 from tools.common import init_logger, logger
 from tools.progressbar import ProgressBar
+from tools.accumulator import PredictionAccumulator, gather_predictions
+from tools.train_metrics import TrainingMetrics
+from tools.profiler import Profiler, set_profiler, get_profiler
+from tools.checkpoint import (CheckpointSaver, find_checkpoint, load_training_state, get_rng_state,
+                              set_rng_state)
+from tools.async_eval import AsyncEvaluator
+from tools.quantization import quantize_dynamic, compare_quantized, timed
 
-ALL_MODELS = sum((tuple(conf.pretrained_config_archive_map.keys()) for conf in (BertConfig, XLNetConfig,
-                                                                                RobertaConfig)), ())
-MODEL_CLASSES = {
-    ## bert ernie bert_wwm bert_wwwm_ext
-    'bert': (BertConfig, BertForSequenceClassification, BertTokenizer),
-    'xlnet': (XLNetConfig, XLNetForSequenceClassification, XLNetTokenizer),
-    'roberta': (BertConfig, BertForSequenceClassification, BertTokenizer),
-    'albert': (BertConfig, AlbertForSequenceClassification, BertTokenizer)
-}
 
+class LazyModelClasses(collections.abc.Mapping):
+    """ ``{model_type: (config_class, model_class, tokenizer_class)}`` given by class names, which are only
+    imported from ``transformers`` when their model type is looked up """
+
+    def __init__(self, class_names):
+        self.class_names = class_names
+
+    def __getitem__(self, model_type):
+        return tuple(getattr(transformers, name) for name in self.class_names[model_type])
+
+    def __iter__(self):
+        return iter(self.class_names)
 
-def train(args, train_dataset, model, tokenizer):
-    """ Train the model """
+    def __len__(self):
+        return len(self.class_names)
+
+
+# Shortcut names of the pretrained models, read from the configuration modules only
+ALL_MODELS = sum((tuple(getattr(transformers, archive_map).keys())
+                  for archive_map in ('BERT_PRETRAINED_CONFIG_ARCHIVE_MAP', 'XLNET_PRETRAINED_CONFIG_ARCHIVE_MAP',
+                                      'ROBERTA_PRETRAINED_CONFIG_ARCHIVE_MAP')), ())
+MODEL_CLASSES = LazyModelClasses({
+    ## bert ernie bert_wwm bert_wwwm_ext
+    'bert': ('BertConfig', 'BertForSequenceClassification', 'BertTokenizer'),
+    'xlnet': ('XLNetConfig', 'XLNetForSequenceClassification', 'XLNetTokenizer'),
+    'roberta': ('BertConfig', 'BertForSequenceClassification', 'BertTokenizer'),
+    'albert': ('BertConfig', 'AlbertForSequenceClassification', 'BertTokenizer')
+})
+
+
+def configure_early_exit(args, model):
+    """ Applies --early_exit_threshold/--early_exit_criterion to an early-exit model (no-op otherwise) """
+    model = model.module if hasattr(model, 'module') else model
+    if args.early_exit and hasattr(model, 'early_exit_threshold'):
+        model.early_exit_threshold = args.early_exit_threshold
+        model.early_exit_criterion = args.early_exit_criterion
+
+
+def get_bucket_batch_sampler(args, dataset, batch_size, shuffle, pad=True):
+    """ Length-bucketed batches (--length_bucketing) built on the cached ``input_len`` """
+    kwargs = dict(batch_size=batch_size,
+                  max_tokens=args.max_tokens_per_batch,
+                  bucket_size=batch_size * args.bucket_batches,
+                  shuffle=shuffle,
+                  seed=args.seed)
+    if args.local_rank == -1:
+        return BucketBatchSampler(dataset.lengths, **kwargs)
+    return DistributedBucketBatchSampler(dataset.lengths, pad=pad, **kwargs)
+
+
+def get_eval_dataloader(args, dataset, batch_size):
+    """
+    Dev/test batches and their sampler. In distributed mode every rank reads its own shard of the
+    dataset, without the duplicated examples of ``DistributedSampler``.
+    """
+    if args.length_bucketing:
+        sampler = get_bucket_batch_sampler(args, dataset, batch_size, shuffle=False, pad=False)
+        return DataLoader(dataset, batch_sampler=sampler, collate_fn=get_collate_fn(dataset)), sampler
+    sampler = SequentialSampler(dataset) if args.local_rank == -1 else SequentialDistributedSampler(dataset)
+    return DataLoader(dataset, sampler=sampler, batch_size=batch_size, collate_fn=get_collate_fn(dataset)), sampler
+
+
+def get_collate_fn(dataset):
+    """ Pads batches of cached features with the padding values they were converted with """
+    if hasattr(dataset, 'collate_fn'):
+        return dataset.collate_fn
+    meta = dataset.meta
+    return functools.partial(dynamic_collate_fn,
+                             pad_token=meta['pad_token'],
+                             pad_token_segment_id=meta['pad_token_segment_id'],
+                             pad_on_left=meta['pad_on_left'])
+
+
+def resume_dataloader(dataloader, num_batches):
+    """ The rest of the current epoch of ``dataloader`` after its first ``num_batches`` batches """
+    if isinstance(dataloader.dataset, IterableDataset):
+        return itertools.islice(dataloader, num_batches, None)
+    if dataloader.batch_size is None:  # built from a batch sampler
+        return DataLoader(dataloader.dataset, batch_sampler=SkipSampler(dataloader.batch_sampler, num_batches),
+                          collate_fn=dataloader.collate_fn)
+    return DataLoader(dataloader.dataset, sampler=SkipSampler(dataloader.sampler, num_batches * dataloader.batch_size),
+                      batch_size=dataloader.batch_size, collate_fn=dataloader.collate_fn)
+
+
+def train(args, train_dataset, model, tokenizer, loss_fn=None):
+    """
+    Train the model. ``loss_fn(outputs, batch)``, if given, replaces the loss returned by the model
+    (e.g. to add the terms of a distillation objective).
+    """
     args.train_batch_size = args.per_gpu_train_batch_size * max(1, args.n_gpu)
-    train_sampler = RandomSampler(train_dataset) if args.local_rank == -1 else DistributedSampler(train_dataset)
-    train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size,
-                                  collate_fn=xlnet_collate_fn if args.model_type in ['xlnet'] else collate_fn)
+    streaming = isinstance(train_dataset, IterableDataset)
+    if streaming:
+        train_sampler = train_dataset  # carries set_epoch for the shuffle buffer
+        train_dataloader = DataLoader(train_dataset, batch_size=args.train_batch_size,
+                                      collate_fn=get_collate_fn(train_dataset))
+    elif args.length_bucketing:
+        train_sampler = get_bucket_batch_sampler(args, train_dataset, args.train_batch_size, shuffle=True)
+        train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler,
+                                      collate_fn=get_collate_fn(train_dataset))
+    else:
+        train_sampler = RandomSampler(train_dataset) if args.local_rank == -1 else DistributedSampler(train_dataset)
+        train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size,
+                                      collate_fn=get_collate_fn(train_dataset))
 
-    if args.max_steps > 0:
+    if streaming:
+        if args.max_steps <= 0:
+            raise ValueError("--streaming needs --max_steps, the number of batches of a stream is unknown")
+        t_total = args.max_steps
+    elif args.max_steps > 0:
         t_total = args.max_steps
         args.num_train_epochs = args.max_steps // (len(train_dataloader) // args.gradient_accumulation_steps) + 1
     else:
@@ -67,12 +171,25 @@ def train(args, train_dataset, model, tokenizer):
     ]
     optimizer = AdamW(optimizer_grouped_parameters, lr=args.learning_rate, eps=args.adam_epsilon)
     scheduler = WarmupLinearSchedule(optimizer, warmup_steps=args.warmup_steps, t_total=t_total)
+    training_state = None
+    if args.resume_from_checkpoint:
+        checkpoint = find_checkpoint(args.output_dir, args.resume_from_checkpoint)
+        logger.info("Resuming training from %s", checkpoint)
+        training_state = load_training_state(checkpoint)
+        load_checkpoint_weights(model, checkpoint)
+    amp = None
     if args.fp16:
         try:
             from apex import amp
         except ImportError:
             raise ImportError("Please install apex from https://www.github.com/nvidia/apex to use fp16 training.")
         model, optimizer = amp.initialize(model, optimizer, opt_level=args.fp16_opt_level)
+    if training_state is not None:
+        trainer_state, optimizer_state, scheduler_state, amp_state, rng_state = training_state
+        optimizer.load_state_dict(optimizer_state)
+        scheduler.load_state_dict(scheduler_state)
+        if amp is not None and amp_state is not None:
+            amp.load_state_dict(amp_state)
 
     # multi-gpu training (should be after apex fp16 initialization)
     if args.n_gpu > 1:
@@ -86,7 +203,8 @@ def train(args, train_dataset, model, tokenizer):
 
     # Train!
     logger.info("***** Running training *****")
-    logger.info("  Num examples = %d", len(train_dataset))
+    if not streaming:
+        logger.info("  Num examples = %d", len(train_dataset))
     logger.info("  Num Epochs = %d", args.num_train_epochs)
     logger.info("  Instantaneous batch size per GPU = %d", args.per_gpu_train_batch_size)
     logger.info("  Total train batch size (w. parallel, distributed & accumulation) = %d",
@@ -95,94 +213,166 @@ def train(args, train_dataset, model, tokenizer):
     logger.info("  Gradient Accumulation steps = %d", args.gradient_accumulation_steps)
     logger.info("  Total optimization steps = %d", t_total)
 
-    global_step = 0
-    tr_loss, logging_loss = 0.0, 0.0
+    eval_dataset, async_evaluator = None, None
+    if args.logging_steps > 0:
+        # The dev set is loaded once and shared by every evaluation of the run
+        eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+        if args.async_eval and args.local_rank == -1:
+            async_evaluator = AsyncEvaluator(
+                model, device=args.async_eval_device,
+                eval_fn=lambda eval_model, device, step: evaluate(args, eval_model, tokenizer,
+                                                                  prefix='checkpoint-{}'.format(step),
+                                                                  eval_dataset=eval_dataset, device=device,
+                                                                  show_progress=False))
+
+    global_step, start_epoch, skip_batches = 0, 0, 0
+    profiler = get_profiler()
+    metrics = TrainingMetrics(args.device, profiler=profiler)
+    saver = CheckpointSaver(args.output_dir, keep_last=args.save_total_limit)
+    if training_state is not None:
+        global_step = trainer_state['global_step']
+        start_epoch, skip_batches = trainer_state['epoch'], trainer_state['steps_in_epoch']
+        metrics.total_loss = trainer_state['total_loss']
+        if not streaming and skip_batches >= len(train_dataloader):
+            start_epoch, skip_batches = start_epoch + 1, 0
+        logger.info("  Continuing from global step %d, epoch %d, batch %d", global_step, start_epoch, skip_batches)
+    profiler.step(global_step)
     model.zero_grad()
     seed_everything(args.seed)  # Added here for reproductibility (even between python 2 and 3)
-    for _ in range(int(args.num_train_epochs)):
-        pbar = ProgressBar(n_total=len(train_dataloader), desc='Training')
-        for step, batch in enumerate(train_dataloader):
+    resume_rng_state = None
+    for epoch in range(start_epoch, int(args.num_train_epochs)):
+        if hasattr(train_sampler, 'set_epoch'):
+            train_sampler.set_epoch(epoch)
+        epoch_dataloader = train_dataloader
+        if training_state is not None and epoch == start_epoch:
+            if skip_batches > 0:
+                # Replay the epoch's sampling from its start, then continue with the RNG as it was when saved
+                set_rng_state(rng_state['epoch_start'])
+                resume_rng_state = rng_state['current']
+                epoch_dataloader = resume_dataloader(train_dataloader, skip_batches)
+            else:
+                set_rng_state(rng_state['current'])
+        epoch_rng_state = get_rng_state()
+        pbar = ProgressBar(n_total=t_total * args.gradient_accumulation_steps if streaming else len(train_dataloader),
+                           desc='Training')
+        first_step = skip_batches if epoch == start_epoch else 0
+        for step, batch in enumerate(metrics.timed(epoch_dataloader), start=first_step):
+            if resume_rng_state is not None:
+                set_rng_state(resume_rng_state)
+                resume_rng_state = None
             model.train()
-            batch = tuple(t.to(args.device) for t in batch)
+            with metrics.phase('h2d'):
+                batch = tuple(t.to(args.device) for t in batch)
             inputs = {'input_ids': batch[0],
                       'attention_mask': batch[1],
                       'labels': batch[3]}
             if args.model_type != 'distilbert':
                 inputs['token_type_ids'] = batch[2] if args.model_type in ['bert', 'xlnet', 'albert',
                                                                            'roberta'] else None  # XLM, DistilBERT don't use segment_ids
-            outputs = model(**inputs)
-            loss = outputs[0]  # model outputs are always tuple in transformers (see doc)
-
-            if args.n_gpu > 1:
-                loss = loss.mean()  # mean() to average on multi-gpu parallel training
-            if args.gradient_accumulation_steps > 1:
-                loss = loss / args.gradient_accumulation_steps
-
-            if args.fp16:
-                with amp.scale_loss(loss, optimizer) as scaled_loss:
-                    scaled_loss.backward()
-                torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), args.max_grad_norm)
-            else:
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+            with metrics.phase('forward'):
+                outputs = model(**inputs)
+                loss = outputs[0]  # model outputs are always tuple in transformers (see doc)
+                if loss_fn is not None:
+                    loss = loss_fn(outputs, batch)
+
+                if args.n_gpu > 1:
+                    loss = loss.mean()  # mean() to average on multi-gpu parallel training
+                if args.gradient_accumulation_steps > 1:
+                    loss = loss / args.gradient_accumulation_steps
+
+            with metrics.phase('backward'):
+                if args.fp16:
+                    with amp.scale_loss(loss, optimizer) as scaled_loss:
+                        scaled_loss.backward()
+                else:
+                    loss.backward()
+            with metrics.phase('clip'):
+                if args.fp16:
+                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), args.max_grad_norm)
+                else:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
 
-            pbar(step, {'loss': loss.item()})
-            tr_loss += loss.item()
+            # The loss stays on the device, it is only read back when the metrics are flushed
+            metrics.update(loss, batch[0].size(0), batch[1])
+            pbar(step, metrics.progress_info())
             if (step + 1) % args.gradient_accumulation_steps == 0:
-                optimizer.step()
-                scheduler.step()  # Update learning rate schedule
-                model.zero_grad()
+                with metrics.phase('optimizer'):
+                    optimizer.step()
+                    scheduler.step()  # Update learning rate schedule
+                    model.zero_grad()
                 global_step += 1
-
-                if args.local_rank in [-1, 0] and args.logging_steps > 0 and global_step % args.logging_steps == 0:
-                    print(" ")
-                    # Log metrics
-                    if args.local_rank == -1:  # Only evaluate when single GPU otherwise metrics may not average well
-                        evaluate(args, model, tokenizer)
+                metrics.step()
+                profiler.step(global_step)
+
+                if args.logging_steps > 0 and global_step % args.logging_steps == 0:
+                    summary = metrics.flush()
+                    if args.local_rank in [-1, 0]:
+                        print(" ")
+                        logger.info("Step %d: %s", global_step, metrics.format(summary))
+                    # Log metrics; in distributed mode every rank evaluates its shard and the metrics are merged
+                    if async_evaluator is not None:
+                        async_evaluator.submit(model, global_step)
+                    else:
+                        evaluate(args, model, tokenizer, eval_dataset=eval_dataset)
+                    metrics.reset_clock()
 
                 if args.local_rank in [-1, 0] and args.save_steps > 0 and global_step % args.save_steps == 0:
                     # Save model checkpoint
-                    output_dir = os.path.join(args.output_dir, 'checkpoint-{}'.format(global_step))
-                    if not os.path.exists(output_dir):
-                        os.makedirs(output_dir)
-                    model_to_save = model.module if hasattr(model,
-                                                            'module') else model  # Take care of distributed/parallel training
-                    model_to_save.save_pretrained(output_dir)
-                    torch.save(args, os.path.join(output_dir, 'training_args.bin'))
-                    logger.info("Saving model checkpoint to %s", output_dir)
-                    tokenizer.save_vocabulary(vocab_path=output_dir)
+                    # Save a resumable checkpoint, written to disk in the background
+                    with metrics.phase('save'):
+                        trainer_state = {'epoch': epoch,
+                                         'steps_in_epoch': step + 1,
+                                         'total_loss': metrics.running_total_loss()}
+                        saver.save(global_step, model, optimizer, scheduler, args, tokenizer, trainer_state,
+                                   rng_state={'current': get_rng_state(), 'epoch_start': epoch_rng_state}, amp=amp)
+            if 0 < args.max_steps <= global_step:
+                break
         print(" ")
+        summary = metrics.flush()
+        if args.local_rank in [-1, 0]:
+            logger.info("Epoch %d: %s", epoch, metrics.format(summary))
         if 'cuda' in str(args.device):
             torch.cuda.empty_cache()
-    return global_step, tr_loss / global_step
+        if 0 < args.max_steps <= global_step:
+            break
+    saver.close()
+    if async_evaluator is not None:
+        async_evaluator.close()
+    return global_step, metrics.total_loss / max(global_step, 1)
 
 
-def evaluate(args, model, tokenizer, prefix=""):
+def evaluate(args, model, tokenizer, prefix="", eval_dataset=None, device=None, show_progress=True):
     eval_task_names = (args.task_name,)
     eval_outputs_dirs = (args.output_dir,)
+    device = device if device is not None else args.device
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        model = model.module  # ranks run different numbers of batches, DDP's forward would wait for each other
     results = {}
     for eval_task, eval_output_dir in zip(eval_task_names, eval_outputs_dirs):
-        eval_dataset = load_and_cache_examples(args, eval_task, tokenizer, data_type='dev')
+        if eval_dataset is None:
+            eval_dataset = load_and_cache_examples(args, eval_task, tokenizer, data_type='dev')
         if not os.path.exists(eval_output_dir) and args.local_rank in [-1, 0]:
             os.makedirs(eval_output_dir)
 
         args.eval_batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
-        # Note that DistributedSampler samples randomly
-        eval_sampler = SequentialSampler(eval_dataset) if args.local_rank == -1 else DistributedSampler(eval_dataset)
-        eval_dataloader = DataLoader(eval_dataset, sampler=eval_sampler, batch_size=args.eval_batch_size,
-                                     collate_fn=xlnet_collate_fn if args.model_type in ['xlnet'] else collate_fn)
+        eval_dataloader, _ = get_eval_dataloader(args, eval_dataset, args.eval_batch_size)
 
         # Eval!
         logger.info("********* Running evaluation {} ********".format(prefix))
         eval_loss = 0.0
         nb_eval_steps = 0
-        preds = None
-        out_label_ids = None
+        num_labels = 1 if args.output_mode == "regression" else len(processors[eval_task]().get_labels())
+        # Metrics are accumulated per batch on the device, the logits are never collected
+        eval_metrics = StreamingMetrics(eval_task, num_labels, device=device)
+        configure_early_exit(args, model)
+        exit_layers = 0
+        profiler = get_profiler()
         pbar = ProgressBar(n_total=len(eval_dataloader), desc="Evaluating")
-        for step, batch in enumerate(eval_dataloader):
+        for step, batch in enumerate(profiler.timed(eval_dataloader, cat='eval')):
             model.eval()
-            batch = tuple(t.to(args.device) for t in batch)
-            with torch.no_grad():
+            with profiler.timer('h2d', cat='eval'):
+                batch = tuple(t.to(device) for t in batch)
+            with torch.no_grad(), profiler.timer('forward', cat='eval'):
                 inputs = {'input_ids': batch[0],
                           'attention_mask': batch[1],
                           'labels': batch[3]}
@@ -191,24 +381,30 @@ def evaluate(args, model, tokenizer, prefix=""):
                                                                                'roberta'] else None  # XLM, DistilBERT and RoBERTa don't use segment_ids
                 outputs = model(**inputs)
                 tmp_eval_loss, logits = outputs[:2]
-                eval_loss += tmp_eval_loss.mean().item()
+                eval_loss += tmp_eval_loss.mean()  # stays on device, no sync per step
+                if args.early_exit:
+                    exit_layers += outputs[2].sum()
             nb_eval_steps += 1
-            if preds is None:
-                preds = logits.detach().cpu().numpy()
-                out_label_ids = inputs['labels'].detach().cpu().numpy()
-            else:
-                preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
-                out_label_ids = np.append(out_label_ids, inputs['labels'].detach().cpu().numpy(), axis=0)
-            pbar(step)
-        print(' ')
-        if 'cuda' in str(args.device):
+            eval_metrics.update(logits, inputs['labels'])
+            if show_progress:
+                pbar(step)
+        if show_progress:
+            print(' ')
+        if args.local_rank != -1:
+            eval_metrics.all_reduce()
+            loss_and_steps = torch.stack([torch.as_tensor(eval_loss, dtype=torch.float, device=device),
+                                          torch.tensor(float(nb_eval_steps), device=device)])
+            torch.distributed.all_reduce(loss_and_steps)
+            eval_loss, nb_eval_steps = loss_and_steps.tolist()
+            if args.early_exit:
+                exit_layers = torch.as_tensor(exit_layers, device=device)
+                torch.distributed.all_reduce(exit_layers)
+        result = eval_metrics.compute()
+        if 'cuda' in str(device):
             torch.cuda.empty_cache()
-        eval_loss = eval_loss / nb_eval_steps
-        if args.output_mode == "classification":
-            preds = np.argmax(preds, axis=1)
-        elif args.output_mode == "regression":
-            preds = np.squeeze(preds)
-        result = compute_metrics(eval_task, preds, out_label_ids)
+        result['eval_loss'] = float(eval_loss) / nb_eval_steps
+        if args.early_exit:
+            result['avg_exit_layer'] = float(exit_layers) / len(eval_dataset)
         results.update(result)
         logger.info("  Num examples = %d", len(eval_dataset))
         logger.info("  Batch size = %d", args.eval_batch_size)
@@ -218,6 +414,94 @@ def evaluate(args, model, tokenizer, prefix=""):
     return results
 
 
+def list_weight_dirs(output_dir):
+    """ Sorted directories under ``output_dir`` holding model weights, as pickled or flat checkpoints """
+    weight_files = (glob.glob(output_dir + '/**/' + WEIGHTS_NAME, recursive=True) +
+                    glob.glob(output_dir + '/**/' + FLAT_WEIGHTS_NAME, recursive=True))
+    return sorted(set(os.path.dirname(c) for c in weight_files))
+
+
+def load_checkpoint_weights(model, checkpoint):
+    """ Loads the weights of ``checkpoint`` into ``model`` in place, reusing its modules and storage """
+    model_to_load = model.module if hasattr(model, 'module') else model
+    if os.path.isfile(os.path.join(checkpoint, FLAT_WEIGHTS_NAME)):
+        state_dict = load_flat_state_dict(os.path.join(checkpoint, FLAT_WEIGHTS_NAME))
+    else:
+        state_dict = torch.load(os.path.join(checkpoint, WEIGHTS_NAME), map_location='cpu')
+    model_to_load.load_state_dict(state_dict)
+    return model
+
+
+def load_checkpoint_model(args, model_class, model, checkpoint):
+    """ ``model`` with the weights of ``checkpoint`` loaded in place, or a model rebuilt from ``checkpoint``
+    when its shapes do not match (e.g. checkpoints with different pruned heads) """
+    try:
+        return load_checkpoint_weights(model, checkpoint)
+    except RuntimeError:
+        model = model_class.from_pretrained(checkpoint)
+        model.to(args.device)
+        return model
+
+
+# Per-process state of the checkpoint evaluation workers, set once by ``_init_checkpoint_worker``
+_checkpoint_worker = None
+
+
+def _init_checkpoint_worker(args, model_class, skeleton_dir, eval_dataset, num_threads):
+    global _checkpoint_worker
+    torch.set_num_threads(num_threads)
+    logging.getLogger("transformers.modeling_utils").setLevel(logging.WARN)
+    model = model_class.from_pretrained(skeleton_dir)
+    model.to(args.device)
+    _checkpoint_worker = (args, model_class, model, eval_dataset)
+
+
+def _evaluate_checkpoint(checkpoint):
+    global _checkpoint_worker
+    args, model_class, model, eval_dataset = _checkpoint_worker
+    prefix = checkpoint.split('/')[-1] if checkpoint.find('checkpoint') != -1 else ""
+    model = load_checkpoint_model(args, model_class, model, checkpoint)
+    _checkpoint_worker = (args, model_class, model, eval_dataset)
+    return checkpoint, evaluate(args, model, None, prefix=prefix, eval_dataset=eval_dataset, show_progress=False)
+
+
+def get_cpu_args(args):
+    """ A copy of ``args`` that runs on CPU, leaving the device of the caller's ``args`` untouched """
+    cpu_args = copy.copy(args)
+    cpu_args.device, cpu_args.n_gpu = torch.device('cpu'), 0
+    return cpu_args
+
+
+def evaluate_checkpoints(args, model_class, tokenizer, checkpoints):
+    """
+    Evaluates every checkpoint on the dev set, which is loaded once. One model skeleton is built
+    and each checkpoint's state_dict is loaded into it in place; with --eval_num_workers > 1 the
+    checkpoints are spread over that many CPU processes, each owning a skeleton.
+    Returns ``{checkpoint: result}`` in the order of ``checkpoints``.
+    """
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    results = collections.OrderedDict()
+    if args.eval_num_workers > 1 and len(checkpoints) > 1 and args.local_rank == -1:
+        worker_args = get_cpu_args(args)
+        num_workers = min(args.eval_num_workers, len(checkpoints))
+        num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+        ctx = torch.multiprocessing.get_context('spawn')
+        with ctx.Pool(num_workers, initializer=_init_checkpoint_worker,
+                      initargs=(worker_args, model_class, checkpoints[0], eval_dataset, num_threads)) as pool:
+            for checkpoint, result in pool.imap(_evaluate_checkpoint, checkpoints):
+                logger.info("Checkpoint %s: %s", checkpoint, result)
+                results[checkpoint] = result
+        return results
+
+    model = model_class.from_pretrained(checkpoints[0])
+    model.to(args.device)
+    for checkpoint in checkpoints:
+        prefix = checkpoint.split('/')[-1] if checkpoint.find('checkpoint') != -1 else ""
+        model = load_checkpoint_model(args, model_class, model, checkpoint)
+        results[checkpoint] = evaluate(args, model, tokenizer, prefix=prefix, eval_dataset=eval_dataset)
+    return results
+
+
 def predict(args, model, tokenizer, label_list, prefix=""):
     pred_task_names = (args.task_name,)
     pred_outputs_dirs = (args.output_dir,)
@@ -229,22 +513,31 @@ def predict(args, model, tokenizer, label_list, prefix=""):
             os.makedirs(pred_output_dir)
 
         args.pred_batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
-        # Note that DistributedSampler samples randomly
-        pred_sampler = SequentialSampler(pred_dataset) if args.local_rank == -1 else DistributedSampler(pred_dataset)
-        pred_dataloader = DataLoader(pred_dataset, sampler=pred_sampler, batch_size=args.pred_batch_size,
-                                     collate_fn=xlnet_collate_fn
-                                     if args.model_type in ['xlnet'] else collate_fn)
+        pred_dataloader, pred_sampler = get_eval_dataloader(args, pred_dataset, args.pred_batch_size)
+        distributed = args.local_rank != -1
+        # Dataset positions of the rows of this rank, in the order they are predicted
+        local_indices = list(itertools.chain.from_iterable(pred_sampler)) if args.length_bucketing else \
+            list(pred_sampler)
 
         logger.info("******** Running prediction {} ********".format(prefix))
         logger.info("  Num examples = %d", len(pred_dataset))
         logger.info("  Batch size = %d", args.pred_batch_size)
         nb_pred_steps = 0
-        preds = None
+        output_logits_file = os.path.join(pred_output_dir, prefix, "test_logits")
+        num_labels = 1 if args.output_mode == "regression" else len(label_list)
+        # Distributed ranks collect their shard in memory, rank 0 writes the gathered logits
+        accumulator = PredictionAccumulator(len(local_indices), num_labels, device=args.device, with_labels=False,
+                                            memmap_file=output_logits_file + '.npy'
+                                            if args.stream_logits and not distributed else None)
+        batch_indices = iter(pred_sampler) if args.length_bucketing and not distributed else None
+        configure_early_exit(args, model)
+        profiler = get_profiler()
         pbar = ProgressBar(n_total=len(pred_dataloader), desc="Predicting")
-        for step, batch in enumerate(pred_dataloader):
+        for step, batch in enumerate(profiler.timed(pred_dataloader, cat='predict')):
             model.eval()
-            batch = tuple(t.to(args.device) for t in batch)
-            with torch.no_grad():
+            with profiler.timer('h2d', cat='predict'):
+                batch = tuple(t.to(args.device) for t in batch)
+            with torch.no_grad(), profiler.timer('forward', cat='predict'):
                 inputs = {'input_ids': batch[0],
                           'attention_mask': batch[1],
                           'labels': batch[3]}
@@ -254,18 +547,16 @@ def predict(args, model, tokenizer, label_list, prefix=""):
                 outputs = model(**inputs)
                 _, logits = outputs[:2]
             nb_pred_steps += 1
-            if preds is None:
-                if pred_task == 'copa':
-                    preds = logits.softmax(-1).detach().cpu().numpy()
-                else:
-                    preds = logits.detach().cpu().numpy()
-            else:
-                if pred_task == 'copa':
-                    preds = np.append(preds, logits.softmax(-1).detach().cpu().numpy(), axis=0)
-                else:
-                    preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
+            if pred_task == 'copa':
+                logits = logits.softmax(-1)
+            accumulator.update(logits, indices=next(batch_indices) if batch_indices is not None else None)
             pbar(step)
         print(' ')
+        preds, _ = accumulator.result()
+        if distributed:
+            preds = gather_predictions(preds, local_indices, len(pred_dataset))
+            if preds is None:
+                continue  # only rank 0 writes the predictions
         if args.output_mode == "classification":
             predict_label = np.argmax(preds, axis=1)
         elif args.output_mode == "regression":
@@ -281,7 +572,6 @@ def predict(args, model, tokenizer, label_list, prefix=""):
                     predict_label.append(1)
                 i += 2
         output_submit_file = os.path.join(pred_output_dir, prefix, "test_prediction.json")
-        output_logits_file = os.path.join(pred_output_dir, prefix, "test_logits")
         # 保存标签结果
         with open(output_submit_file, "w") as writer:
             for i, pred in enumerate(predict_label):
@@ -290,24 +580,74 @@ def predict(args, model, tokenizer, label_list, prefix=""):
                 json_d['label'] = str(label_map[pred])
                 writer.write(json.dumps(json_d) + '\n')
         # 保存中间预测结果
-        save_numpy(file_path=output_logits_file, data=preds)
+        if not args.stream_logits or distributed:
+            save_numpy(file_path=output_logits_file, data=preds)
+
+
+def quantize_for_inference(args, model, tokenizer, prefix=""):
+    """ --quantize dynamic: int8 Linear layers, checked against FP32 on the dev set (on CPU) """
+    if args.device.type != 'cpu':
+        args = get_cpu_args(args)
+    int8_model = quantize_dynamic(model)
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    eval_batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
+    report = compare_quantized(model, int8_model,
+                               eval_fn=lambda m: evaluate(args, m, tokenizer, prefix=prefix,
+                                                          eval_dataset=eval_dataset, show_progress=False),
+                               num_examples=len(eval_dataset),
+                               num_batches=(len(eval_dataset) + eval_batch_size - 1) // eval_batch_size)
+    logger.info("******** Dynamic quantization report {} ********".format(prefix))
+    for name in ('fp32', 'int8'):
+        logger.info("  %s: %s, %.1f ms/batch, %.1f examples/s, %.1f MB", name,
+                    ", ".join("%s = %.4f" % (k, v) for k, v in sorted(report[name]['metrics'].items())),
+                    report[name]['latency_ms_per_batch'], report[name]['throughput_examples_per_s'],
+                    report[name]['size_mb'])
+    logger.info("  delta: %s, speedup = %.2fx, size ratio = %.2f",
+                ", ".join("%s = %+.4f" % (k, v) for k, v in sorted(report['delta']['metrics'].items())),
+                report['delta']['speedup'], report['delta']['size_ratio'])
+    output_report_file = os.path.join(args.output_dir, prefix, "quantization_report.json")
+    with open(output_report_file, "w") as writer:
+        json.dump(report, writer, indent=2, sort_keys=True)
+    return int8_model
+
+
+def early_exit_sweep(args, model, tokenizer):
+    """ Dev metrics, average exit layer and evaluation time of every --early_exit_sweep threshold """
+    eval_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='dev')
+    sweep = []
+    for threshold in [float(x) for x in args.early_exit_sweep.split(',')]:
+        sweep_args = copy.copy(args)
+        sweep_args.early_exit_threshold = threshold
+        result, elapsed = timed(evaluate, sweep_args, model, tokenizer, prefix='threshold {}'.format(threshold),
+                                eval_dataset=eval_dataset, show_progress=False)
+        sweep.append({'threshold': threshold, 'metrics': result, 'seconds': elapsed,
+                      'throughput_examples_per_s': len(eval_dataset) / elapsed if elapsed > 0 else float('inf')})
+    logger.info("******** Early exit sweep ({}) ********".format(args.early_exit_criterion))
+    for entry in sweep:
+        logger.info("  threshold %s: %s, %.1f examples/s", entry['threshold'],
+                    ", ".join("%s = %.4f" % (k, v) for k, v in sorted(entry['metrics'].items())),
+                    entry['throughput_examples_per_s'])
+    if args.local_rank in [-1, 0]:
+        with open(os.path.join(args.output_dir, "early_exit_sweep.json"), "w") as writer:
+            json.dump({'criterion': args.early_exit_criterion, 'sweep': sweep}, writer, indent=2)
+    return sweep
 
 
 def load_and_cache_examples(args, task, tokenizer, data_type='train'):
-    if args.local_rank not in [-1, 0] and not evaluate:
+    if args.local_rank not in [-1, 0]:
         torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
 
     processor = processors[task]()
     output_mode = output_modes[task]
     # Load data features from cache or dataset file
-    cached_features_file = os.path.join(args.data_dir, 'cached_{}_{}_{}_{}'.format(
+    cached_features_dir = os.path.join(args.data_dir, 'cached_{}_{}_{}_{}_mmap'.format(
         data_type,
         list(filter(None, args.model_name_or_path.split('/'))).pop(),
         str(args.max_seq_length),
         str(task)))
-    if os.path.exists(cached_features_file):
-        logger.info("Loading features from cached file %s", cached_features_file)
-        features = torch.load(cached_features_file)
+    # Only the first process builds and saves the cache, the others always load the one it published
+    if args.local_rank not in [-1, 0] or (is_feature_cache(cached_features_dir) and not args.overwrite_cache):
+        logger.info("Loading features from cached dir %s", cached_features_dir)
     else:
         logger.info("Creating features from dataset file at %s", args.data_dir)
         label_list = processor.get_labels()
@@ -315,43 +655,57 @@ def load_and_cache_examples(args, task, tokenizer, data_type='train'):
             # HACK(label indices are swapped in RoBERTa pretrained model)
             label_list[1], label_list[2] = label_list[2], label_list[1]
 
-        if data_type == 'train':
-            examples = processor.get_train_examples(args.data_dir)
-        elif data_type == 'dev':
-            examples = processor.get_dev_examples(args.data_dir)
-        else:
-            examples = processor.get_test_examples(args.data_dir)
-
+        # Examples are read, converted and written one chunk at a time: the dataset is never held in memory
+        examples = processor.iter_examples(args.data_dir, data_type)
+        pad_on_left = bool(args.model_type in ['xlnet'])  # pad on the left for xlnet
+        pad_token = tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0]
+        pad_token_segment_id = 4 if args.model_type in ['xlnet'] else 0
         features = convert_examples_to_features(examples,
                                                 tokenizer,
                                                 label_list=label_list,
                                                 max_length=args.max_seq_length,
                                                 output_mode=output_mode,
-                                                pad_on_left=bool(args.model_type in ['xlnet']),
-                                                # pad on the left for xlnet
-                                                pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
-                                                pad_token_segment_id=4 if args.model_type in ['xlnet'] else 0,
+                                                pad_on_left=pad_on_left,
+                                                pad_token=pad_token,
+                                                pad_token_segment_id=pad_token_segment_id,
+                                                pad_to_max_length=False,
+                                                num_workers=args.preprocessing_num_workers,
                                                 )
-        if args.local_rank in [-1, 0]:
-            logger.info("Saving features into cached file %s", cached_features_file)
-            torch.save(features, cached_features_file)
+        logger.info("Saving features into cached dir %s", cached_features_dir)
+        save_features_cache(features, cached_features_dir,
+                            overwrite=args.overwrite_cache,
+                            vocab_size=len(tokenizer),
+                            max_length=args.max_seq_length,
+                            output_mode=output_mode,
+                            pad_on_left=pad_on_left,
+                            pad_token=pad_token,
+                            pad_token_segment_id=pad_token_segment_id)
 
-    if args.local_rank == 0 and not evaluate:
+    if args.local_rank == 0:
         torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
-    # Convert to Tensors and build dataset
-    all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-    all_attention_mask = torch.tensor([f.attention_mask for f in features], dtype=torch.long)
-    all_token_type_ids = torch.tensor([f.token_type_ids for f in features], dtype=torch.long)
-    all_lens = torch.tensor([f.input_len for f in features], dtype=torch.long)
-    if output_mode == "classification":
-        all_labels = torch.tensor([f.label for f in features], dtype=torch.long)
-    elif output_mode == "regression":
-        all_labels = torch.tensor([f.label for f in features], dtype=torch.float)
-    dataset = TensorDataset(all_input_ids, all_attention_mask, all_token_type_ids, all_lens, all_labels)
+    # Columns are memory-mapped, features are only paged in when a batch needs them
+    dataset = FeatureCacheDataset(cached_features_dir)
     return dataset
 
 
-def main():
+def load_streaming_dataset(args, task, tokenizer, data_type='train'):
+    """ Iterable dataset converting examples on the fly (--streaming), in constant memory """
+    processor = processors[task]()
+    rank, world_size = 0, 1
+    if args.local_rank != -1:
+        rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return StreamingFeatureDataset(processor, args.data_dir, data_type, tokenizer,
+                                   label_list=processor.get_labels(),
+                                   max_length=args.max_seq_length,
+                                   output_mode=output_modes[task],
+                                   pad_on_left=bool(args.model_type in ['xlnet']),
+                                   pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
+                                   pad_token_segment_id=4 if args.model_type in ['xlnet'] else 0,
+                                   shuffle_buffer_size=args.shuffle_buffer_size if data_type == 'train' else 0,
+                                   seed=args.seed, rank=rank, world_size=world_size)
+
+
+def get_argparse():
     parser = argparse.ArgumentParser()
 
     ## Required parameters
@@ -407,14 +761,68 @@ def main():
     parser.add_argument("--warmup_proportion", default=0.1, type=float,
                         help="Proportion of training to perform linear learning rate warmup for,E.g., 0.1 = 10% of training.")
 
+    parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+                        help="Number of processes used to convert examples to features.")
+    parser.add_argument("--streaming", action='store_true',
+                        help="Stream training examples from the data file and convert them on the fly, in constant "
+                             "memory, instead of building the feature cache. Requires --max_steps; the stream is "
+                             "re-read for at most --num_train_epochs passes.")
+    parser.add_argument("--shuffle_buffer_size", default=10000, type=int,
+                        help="With --streaming: number of examples buffered to shuffle the stream (<= 1 disables).")
+    parser.add_argument("--length_bucketing", action='store_true',
+                        help="Batch examples of similar length together (training, evaluation and prediction).")
+    parser.add_argument("--bucket_batches", default=100, type=int,
+                        help="With --length_bucketing: number of batches worth of examples shuffled within one bucket.")
+    parser.add_argument("--max_tokens_per_batch", default=0, type=int,
+                        help="With --length_bucketing: if > 0, also cap every batch at this many padded tokens.")
+
     parser.add_argument('--logging_steps', type=int, default=10,
                         help="Log every X updates steps.")
+    parser.add_argument("--async_eval", action='store_true',
+                        help="Evaluate every --logging_steps in a background thread on a snapshot of the weights, "
+                             "without stalling training.")
+    parser.add_argument("--async_eval_device", default='cpu', type=str,
+                        help="With --async_eval: device running the background evaluations, e.g. cpu or cuda:1.")
     parser.add_argument('--save_steps', type=int, default=1000,
                         help="Save checkpoint every X updates steps.")
+    parser.add_argument("--save_total_limit", type=int, default=0,
+                        help="If > 0: only keep the last X checkpoints, deleting the older ones.")
+    parser.add_argument("--resume_from_checkpoint", default='', type=str,
+                        help="Resume training from a checkpoint directory (weights, optimizer, scheduler, RNG states "
+                             "and data position), or 'latest' for the newest checkpoint of output_dir.")
     parser.add_argument("--eval_all_checkpoints", action='store_true',
                         help="Evaluate all checkpoints starting with the same prefix as model_name ending and ending with step number")
+    parser.add_argument("--eval_num_workers", type=int, default=1,
+                        help="With --eval_all_checkpoints: evaluate checkpoints in that many CPU processes.")
     parser.add_argument("--predict_checkpoints", type=int, default=0,
                         help="predict checkpoints starting with the same prefix as model_name ending and ending with step number")
+    parser.add_argument("--quantize", default='none', type=str, choices=['none', 'dynamic'],
+                        help="With --do_predict: 'dynamic' applies int8 dynamic quantization to the Linear layers "
+                             "(CPU, pytorch>=1.3) and reports accuracy, latency, throughput and size against FP32 "
+                             "on the dev set.")
+    parser.add_argument("--early_exit", action='store_true',
+                        help="(bert, roberta) Add a classifier after every layer, trained jointly, and let confident "
+                             "examples leave the encoder early at evaluation and prediction.")
+    parser.add_argument("--early_exit_threshold", default=0.0, type=float,
+                        help="With --early_exit: exit threshold (0 runs every layer); higher entropy thresholds "
+                             "(lower confidence thresholds) exit earlier, trading accuracy for latency.")
+    parser.add_argument("--early_exit_criterion", default='entropy', type=str, choices=['entropy', 'confidence'],
+                        help="With --early_exit: exit when the prediction entropy is below the threshold, or when "
+                             "the largest probability reaches it.")
+    parser.add_argument("--early_exit_sweep", default='', type=str,
+                        help="With --early_exit and --do_eval: comma separated thresholds evaluated on the dev set, "
+                             "reporting metrics, average exit layer and time to early_exit_sweep.json.")
+    parser.add_argument("--stream_logits", action='store_true',
+                        help="Write test logits straight into test_logits.npy (memmap) while predicting.")
+    parser.add_argument("--profile", action='store_true',
+                        help="Time data loading, H2D copies, forward, backward, clipping, optimizer steps and "
+                             "checkpoint saves, sample memory usage, and write them to a profile file in output_dir.")
+    parser.add_argument("--profile_format", default='jsonl', type=str, choices=['jsonl', 'chrome'],
+                        help="With --profile: 'jsonl' (one event per line) or 'chrome' (chrome://tracing, Perfetto).")
+    parser.add_argument("--profile_trace_steps", default='', type=str,
+                        help="With --profile: 'FIRST,LAST' global steps captured with torch.profiler, e.g. '10,12'.")
+    parser.add_argument("--profile_memory_steps", default=10, type=int,
+                        help="With --profile: sample memory every X update steps.")
     parser.add_argument("--no_cuda", action='store_true',
                         help="Avoid using CUDA when available")
     parser.add_argument('--overwrite_output_dir', action='store_true',
@@ -433,7 +841,11 @@ def main():
                         help="For distributed training: local_rank")
     parser.add_argument('--server_ip', type=str, default='', help="For distant debugging.")
     parser.add_argument('--server_port', type=str, default='', help="For distant debugging.")
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    args = get_argparse().parse_args()
 
     if not os.path.exists(args.output_dir):
         os.mkdir(args.output_dir)
@@ -442,7 +854,7 @@ def main():
         os.mkdir(args.output_dir)
     init_logger(log_file=args.output_dir + '/{}-{}.log'.format(args.model_type, args.task_name))
     if os.path.exists(args.output_dir) and os.listdir(
-            args.output_dir) and args.do_train and not args.overwrite_output_dir:
+            args.output_dir) and args.do_train and not args.overwrite_output_dir and not args.resume_from_checkpoint:
         raise ValueError(
             "Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(
                 args.output_dir))
@@ -465,6 +877,8 @@ def main():
         torch.distributed.init_process_group(backend='nccl')
         args.n_gpu = 1
     args.device = device
+    if args.quantize == 'dynamic' and args.local_rank != -1:
+        raise ValueError("--quantize dynamic runs on a single CPU process, it is not supported with --local_rank")
 
     # Setup logging
     logger.warning("Process rank: %s, device: %s, n_gpu: %s, distributed training: %s, 16-bits training: %s",
@@ -487,8 +901,15 @@ def main():
 
     args.model_type = args.model_type.lower()
     config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    if args.early_exit:
+        if model_class is not transformers.BertForSequenceClassification:
+            raise ValueError("--early_exit is only available for bert and roberta models")
+        model_class = BertForEarlyExitSequenceClassification
     config = config_class.from_pretrained(args.config_name if args.config_name else args.model_name_or_path,
                                           num_labels=num_labels, finetuning_task=args.task_name)
+    if args.early_exit:
+        config.early_exit_threshold = args.early_exit_threshold
+        config.early_exit_criterion = args.early_exit_criterion
     tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path,
                                                 do_lower_case=args.do_lower_case)
     model = model_class.from_pretrained(args.model_name_or_path, from_tf=bool('.ckpt' in args.model_name_or_path),
@@ -498,9 +919,19 @@ def main():
         torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
     model.to(args.device)
     logger.info("Training/evaluation parameters %s", args)
+    if args.profile:
+        trace_steps = tuple(int(x) for x in args.profile_trace_steps.split(',')) if args.profile_trace_steps else None
+        profile_file = os.path.join(args.output_dir, '{}-{}-rank{}.profile.{}'.format(
+            args.model_type, args.task_name, max(args.local_rank, 0),
+            'jsonl' if args.profile_format == 'jsonl' else 'json'))
+        set_profiler(Profiler(profile_file, fmt=args.profile_format, device=args.device, trace_steps=trace_steps,
+                              memory_interval=args.profile_memory_steps))
     # Training
     if args.do_train:
-        train_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='train')
+        if args.streaming:
+            train_dataset = load_streaming_dataset(args, args.task_name, tokenizer, data_type='train')
+        else:
+            train_dataset = load_and_cache_examples(args, args.task_name, tokenizer, data_type='train')
         global_step, tr_loss = train(args, train_dataset, model, tokenizer)
         logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
 
@@ -525,44 +956,58 @@ def main():
         model = model_class.from_pretrained(args.output_dir)
         tokenizer = tokenizer_class.from_pretrained(args.output_dir, do_lower_case=args.do_lower_case)
         model.to(args.device)
+    if args.do_train and args.local_rank != -1:
+        torch.distributed.barrier()  # Make sure the other ranks evaluate and predict with the saved model
 
-    # Evaluation
+    # Evaluation and prediction run on every rank, each on its shard of the data
     results = {}
-    if args.do_eval and args.local_rank in [-1, 0]:
+    if args.do_eval:
         tokenizer = tokenizer_class.from_pretrained(args.output_dir, do_lower_case=args.do_lower_case)
         checkpoints = [args.output_dir]
         if args.eval_all_checkpoints:
-            checkpoints = list(
-                os.path.dirname(c) for c in sorted(glob.glob(args.output_dir + '/**/' + WEIGHTS_NAME, recursive=True)))
+            checkpoints = list_weight_dirs(args.output_dir)
             logging.getLogger("transformers.modeling_utils").setLevel(logging.WARN)  # Reduce logging
         logger.info("Evaluate the following checkpoints: %s", checkpoints)
-        for checkpoint in checkpoints:
-            global_step = checkpoint.split('-')[-1] if len(checkpoints) > 1 else ""
-            prefix = checkpoint.split('/')[-1] if checkpoint.find('checkpoint') != -1 else ""
-            model = model_class.from_pretrained(checkpoint)
-            model.to(args.device)
-            result = evaluate(args, model, tokenizer, prefix=prefix)
-            result = dict((k + '_{}'.format(global_step), v) for k, v in result.items())
-            results.update(result)
-        output_eval_file = os.path.join(args.output_dir, "checkpoint_eval_results.txt")
-        with open(output_eval_file, "w") as writer:
-            for key in sorted(results.keys()):
-                writer.write("%s = %s\n" % (key, str(results[key])))
-
-    if args.do_predict and args.local_rank in [-1, 0]:
+        checkpoint_results = evaluate_checkpoints(args, model_class, tokenizer, checkpoints)
+        if args.local_rank in [-1, 0]:
+            for checkpoint, result in checkpoint_results.items():
+                global_step = checkpoint.split('-')[-1] if len(checkpoints) > 1 else ""
+                result = dict((k + '_{}'.format(global_step), v) for k, v in result.items())
+                results.update(result)
+            output_eval_file = os.path.join(args.output_dir, "checkpoint_eval_results.txt")
+            with open(output_eval_file, "w") as writer:
+                for key in sorted(results.keys()):
+                    writer.write("%s = %s\n" % (key, str(results[key])))
+            # One row per checkpoint, one column per metric
+            metric_names = sorted(set(k for result in checkpoint_results.values() for k in result))
+            output_table_file = os.path.join(args.output_dir, "checkpoint_eval_results.tsv")
+            with open(output_table_file, "w") as writer:
+                writer.write("\t".join(["checkpoint"] + metric_names) + "\n")
+                for checkpoint, result in checkpoint_results.items():
+                    writer.write("\t".join([checkpoint] + [str(result.get(k, "")) for k in metric_names]) + "\n")
+        if args.early_exit and args.early_exit_sweep:
+            early_exit_sweep(args, model_class.from_pretrained(args.output_dir).to(args.device), tokenizer)
+
+    if args.do_predict:
         tokenizer = tokenizer_class.from_pretrained(args.output_dir, do_lower_case=args.do_lower_case)
         checkpoints = [args.output_dir]
         if args.predict_checkpoints > 0:
-            checkpoints = list(
-                os.path.dirname(c) for c in sorted(glob.glob(args.output_dir + '/**/' + WEIGHTS_NAME, recursive=True)))
+            checkpoints = list_weight_dirs(args.output_dir)
             logging.getLogger("transformers.modeling_utils").setLevel(logging.WARN)  # Reduce logging
             checkpoints = [x for x in checkpoints if x.split('-')[-1] == str(args.predict_checkpoints)]
         logger.info("Predict the following checkpoints: %s", checkpoints)
+        predict_args = args
+        if args.quantize == 'dynamic' and args.device.type != 'cpu':
+            logger.warning("Dynamic quantization runs on CPU only, predicting on CPU instead of %s", args.device)
+            predict_args = get_cpu_args(args)
         for checkpoint in checkpoints:
             prefix = checkpoint.split('/')[-1] if checkpoint.find('checkpoint') != -1 else ""
             model = model_class.from_pretrained(checkpoint)
-            model.to(args.device)
-            predict(args, model, tokenizer, label_list, prefix=prefix)
+            model.to(predict_args.device)
+            if args.quantize == 'dynamic':
+                model = quantize_for_inference(predict_args, model, tokenizer, prefix=prefix)
+            predict(predict_args, model, tokenizer, label_list, prefix=prefix)
+    get_profiler().close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+""" Distills a fine-tuned CLUE classifier (teacher) into a smaller Bert/ALBERT student."""
+
+from __future__ import absolute_import, division, print_function
+
+import copy
+import json
+import os
+
+import torch
+from torch.utils.data import DataLoader, SequentialSampler
+
+from processors import clue_output_modes as output_modes
+from processors import clue_processors as processors
+from run_classifier import (MODEL_CLASSES, get_argparse, get_collate_fn, load_and_cache_examples, train, evaluate,
+                            predict)
+from tools.common import seed_everything
+from tools.common import init_logger, logger
+from tools.progressbar import ProgressBar
+from tools.accumulator import PredictionAccumulator
+from tools.distillation import TeacherLogitsDataset, distillation_loss
+from tools.quantization import timed, model_size
+
+
+def teacher_args_of(args):
+    """ A copy of ``args`` describing the teacher, whose features are built with its own tokenizer """
+    teacher_args = copy.copy(args)
+    teacher_args.model_type = args.teacher_model_type
+    teacher_args.model_name_or_path = args.teacher_name_or_path
+    return teacher_args
+
+
+def cache_teacher_logits(args, teacher, teacher_tokenizer, data_type='train'):
+    """
+    Runs the teacher once over the ``data_type`` features and stores its logits in a ``.npy`` file next
+    to the feature caches; later runs (other students, temperatures, ...) reuse it.
+    """
+    teacher_args = teacher_args_of(args)
+    logits_file = os.path.join(args.data_dir, 'cached_{}_{}_{}_{}_teacher_logits.npy'.format(
+        data_type,
+        list(filter(None, args.teacher_name_or_path.split('/'))).pop(),
+        str(args.max_seq_length),
+        str(args.task_name)))
+    if os.path.exists(logits_file) and not args.overwrite_cache:
+        logger.info("Loading teacher logits from cached file %s", logits_file)
+        return logits_file
+
+    dataset = load_and_cache_examples(teacher_args, args.task_name, teacher_tokenizer, data_type=data_type)
+    batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
+    dataloader = DataLoader(dataset, sampler=SequentialSampler(dataset), batch_size=batch_size,
+                            collate_fn=get_collate_fn(dataset))
+    logger.info("******** Computing teacher logits ********")
+    logger.info("  Num examples = %d", len(dataset))
+    tmp_file = '{}.tmp{}'.format(logits_file, os.getpid())
+    accumulator = PredictionAccumulator(len(dataset), teacher.config.num_labels, device=args.device,
+                                        with_labels=False, memmap_file=tmp_file)
+    pbar = ProgressBar(n_total=len(dataloader), desc="Teacher")
+    teacher.eval()
+    for step, batch in enumerate(dataloader):
+        batch = tuple(t.to(args.device) for t in batch)
+        with torch.no_grad():
+            inputs = {'input_ids': batch[0],
+                      'attention_mask': batch[1],
+                      'token_type_ids': batch[2] if args.teacher_model_type in ['bert', 'xlnet', 'albert',
+                                                                                'roberta'] else None}
+            logits = teacher(**inputs)[0]
+        accumulator.update(logits)
+        pbar(step)
+    print(' ')
+    accumulator.result()
+    del accumulator
+    os.rename(tmp_file, logits_file)
+    logger.info("Saving teacher logits into cached file %s", logits_file)
+    return logits_file
+
+
+def compare_teacher_student(args, teacher, teacher_tokenizer, student, tokenizer):
+    """ Dev metrics, latency, throughput and size of the teacher and the student, and their deltas """
+    report = {}
+    for name, model_args, model, model_tokenizer in (('teacher', teacher_args_of(args), teacher, teacher_tokenizer),
+                                                     ('student', args, student, tokenizer)):
+        eval_dataset = load_and_cache_examples(model_args, args.task_name, model_tokenizer, data_type='dev')
+        num_batches = (len(eval_dataset) + args.per_gpu_eval_batch_size - 1) // args.per_gpu_eval_batch_size
+        metrics, elapsed = timed(evaluate, model_args, model, model_tokenizer, prefix=name,
+                                 eval_dataset=eval_dataset, show_progress=False)
+        report[name] = {
+            'metrics': metrics,
+            'seconds': elapsed,
+            'latency_ms_per_batch': 1000.0 * elapsed / max(num_batches, 1),
+            'throughput_examples_per_s': len(eval_dataset) / elapsed if elapsed > 0 else float('inf'),
+            'num_parameters': sum(p.numel() for p in model.parameters()),
+            'size_mb': model_size(model) / 2 ** 20,
+        }
+    teacher_report, student_report = report['teacher'], report['student']
+    report['delta'] = {
+        'metrics': {key: student_report['metrics'][key] - teacher_report['metrics'][key]
+                    for key in teacher_report['metrics'] if key in student_report['metrics']},
+        'speedup': teacher_report['seconds'] / student_report['seconds'] if student_report['seconds'] > 0 else float('inf'),
+        'size_ratio': student_report['size_mb'] / teacher_report['size_mb'],
+    }
+    logger.info("******** Distillation report {} ********".format(args.task_name))
+    for name in ('teacher', 'student'):
+        logger.info("  %s: %s, %.1f ms/batch, %.1f examples/s, %.1fM parameters", name,
+                    ", ".join("%s = %.4f" % (k, v) for k, v in sorted(report[name]['metrics'].items())),
+                    report[name]['latency_ms_per_batch'], report[name]['throughput_examples_per_s'],
+                    report[name]['num_parameters'] / 1e6)
+    logger.info("  delta: %s, speedup = %.2fx, size ratio = %.2f",
+                ", ".join("%s = %+.4f" % (k, v) for k, v in sorted(report['delta']['metrics'].items())),
+                report['delta']['speedup'], report['delta']['size_ratio'])
+    with open(os.path.join(args.output_dir, "distill_report.json"), "w") as writer:
+        json.dump(report, writer, indent=2, sort_keys=True)
+    return report
+
+
+def main():
+    parser = get_argparse()
+    parser.add_argument("--teacher_model_type", default=None, type=str, required=True,
+                        help="Model type of the teacher selected in the list: " + ", ".join(MODEL_CLASSES.keys()))
+    parser.add_argument("--teacher_name_or_path", default=None, type=str, required=True,
+                        help="Path to the teacher, fine-tuned on the task by run_classifier.py.")
+    parser.add_argument("--student_num_hidden_layers", default=0, type=int,
+                        help="If > 0: number of layers of the student, initialised from the first layers of "
+                             "model_name_or_path.")
+    parser.add_argument("--distill_temperature", default=2.0, type=float,
+                        help="Softmax temperature of the soft-label (KL) loss.")
+    parser.add_argument("--distill_alpha", default=0.5, type=float,
+                        help="Weight of the soft-label loss; the hard-label loss gets 1 - alpha.")
+    args = parser.parse_args()
+    if args.streaming:
+        raise ValueError("Distillation reads the teacher logits by feature index, --streaming is not supported")
+
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    args.output_dir = args.output_dir + '{}_student'.format(args.model_type)
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    init_logger(log_file=args.output_dir + '/{}-{}-distill.log'.format(args.model_type, args.task_name))
+    if os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir \
+            and not args.resume_from_checkpoint:
+        raise ValueError(
+            "Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(
+                args.output_dir))
+    if args.local_rank != -1:
+        raise ValueError("Distillation runs on a single process (one or several GPUs through DataParallel)")
+    args.device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    args.n_gpu = torch.cuda.device_count() if not args.no_cuda else 0
+    seed_everything(args.seed)
+
+    args.task_name = args.task_name.lower()
+    if args.task_name not in processors:
+        raise ValueError("Task not found: %s" % (args.task_name))
+    args.output_mode = output_modes[args.task_name]
+    label_list = processors[args.task_name]().get_labels()
+
+    args.model_type = args.model_type.lower()
+    args.teacher_model_type = args.teacher_model_type.lower()
+    _, teacher_class, teacher_tokenizer_class = MODEL_CLASSES[args.teacher_model_type]
+    teacher = teacher_class.from_pretrained(args.teacher_name_or_path)
+    teacher.to(args.device)
+    teacher_tokenizer = teacher_tokenizer_class.from_pretrained(args.teacher_name_or_path,
+                                                                do_lower_case=args.do_lower_case)
+
+    config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    config = config_class.from_pretrained(args.config_name if args.config_name else args.model_name_or_path,
+                                          num_labels=len(label_list), finetuning_task=args.task_name)
+    if args.student_num_hidden_layers > 0:
+        config.num_hidden_layers = args.student_num_hidden_layers
+    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path,
+                                                do_lower_case=args.do_lower_case)
+    student = model_class.from_pretrained(args.model_name_or_path, config=config)
+    student.to(args.device)
+    logger.info("Distillation parameters %s", args)
+
+    if args.do_train:
+        logits_file = cache_teacher_logits(args, teacher, teacher_tokenizer, data_type='train')
+        if args.device.type == 'cuda':
+            teacher.to('cpu')  # frees the device for the student, the teacher is not used while training
+            torch.cuda.empty_cache()
+        features = load_and_cache_examples(args, args.task_name, tokenizer, data_type='train')
+        train_dataset = TeacherLogitsDataset(features, logits_file, get_collate_fn(features))
+
+        def loss_fn(outputs, batch):
+            return distillation_loss(outputs[1], batch[4], outputs[0],
+                                     temperature=args.distill_temperature, alpha=args.distill_alpha)
+
+        global_step, tr_loss = train(args, train_dataset, student, tokenizer, loss_fn=loss_fn)
+        logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
+
+        logger.info("Saving student to %s", args.output_dir)
+        model_to_save = student.module if hasattr(student, 'module') else student
+        model_to_save.save_pretrained(args.output_dir)
+        tokenizer.save_pretrained(args.output_dir)
+        torch.save(args, os.path.join(args.output_dir, 'training_args.bin'))
+        student = model_class.from_pretrained(args.output_dir)
+        student.to(args.device)
+        teacher.to(args.device)
+
+    if args.do_eval:
+        compare_teacher_student(args, teacher, teacher_tokenizer, student, tokenizer)
+
+    if args.do_predict:
+        predict(args, student, tokenizer, label_list)
+
+
+if __name__ == "__main__":
+    main()
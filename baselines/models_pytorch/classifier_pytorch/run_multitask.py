@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+""" Multi-task fine-tuning on CLUE: one shared Bert encoder, one classification head per task."""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import copy
+import collections
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, SequentialSampler
+
+from transformers import BertConfig, BertForMultiTaskClassification, BertTokenizer
+from transformers import AdamW, WarmupLinearSchedule
+from metrics.clue_compute_metrics import compute_metrics
+from processors import clue_output_modes as output_modes
+from processors import clue_processors as processors
+from processors import MultiTaskDataset, MultiTaskBatchSampler
+from run_classifier import load_and_cache_examples, get_collate_fn
+from tools.common import seed_everything, save_numpy
+from tools.common import init_logger, logger
+from tools.progressbar import ProgressBar
+
+MODEL_CLASSES = {
+    ## bert ernie bert_wwm bert_wwwm_ext roberta
+    'bert': (BertConfig, BertForMultiTaskClassification, BertTokenizer),
+    'roberta': (BertConfig, BertForMultiTaskClassification, BertTokenizer),
+}
+
+
+def task_args(args, task):
+    """ A copy of ``args`` pointing at the data of ``task`` (``{data_dir}/{task}``) """
+    targs = copy.copy(args)
+    targs.data_dir = os.path.join(args.data_dir, task)
+    targs.task_name = task
+    targs.output_mode = output_modes[task]
+    return targs
+
+
+def load_multitask_dataset(args, tokenizer, data_type='train'):
+    datasets = [load_and_cache_examples(task_args(args, task), task, tokenizer, data_type=data_type)
+                for task in args.task_names]
+    return MultiTaskDataset(datasets, [get_collate_fn(dataset) for dataset in datasets])
+
+
+def get_inputs(args, batch):
+    inputs = {'input_ids': batch[0],
+              'attention_mask': batch[1],
+              'token_type_ids': batch[2],
+              'labels': batch[3]}
+    return inputs
+
+
+def train(args, train_dataset, model, tokenizer):
+    """ Train the model on the mixture of every task """
+    args.train_batch_size = args.per_gpu_train_batch_size * max(1, args.n_gpu)
+    num_replicas, rank = 1, 0
+    if args.local_rank != -1:
+        num_replicas, rank = torch.distributed.get_world_size(), torch.distributed.get_rank()
+    train_sampler = MultiTaskBatchSampler(train_dataset.sizes, args.train_batch_size,
+                                          temperature=args.task_temperature, seed=args.seed,
+                                          num_replicas=num_replicas, rank=rank)
+    train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=train_dataset.collate_fn)
+
+    if args.max_steps > 0:
+        t_total = args.max_steps
+        args.num_train_epochs = args.max_steps // (len(train_dataloader) // args.gradient_accumulation_steps) + 1
+    else:
+        t_total = len(train_dataloader) // args.gradient_accumulation_steps * args.num_train_epochs
+    args.warmup_steps = int(t_total * args.warmup_proportion)
+    # Prepare optimizer and schedule (linear warmup and decay)
+    no_decay = ['bias', 'LayerNorm.weight']
+    optimizer_grouped_parameters = [
+        {'params': [p for n, p in model.named_parameters() if not any(nd in n for nd in no_decay)],
+         'weight_decay': args.weight_decay},
+        {'params': [p for n, p in model.named_parameters() if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+    ]
+    optimizer = AdamW(optimizer_grouped_parameters, lr=args.learning_rate, eps=args.adam_epsilon)
+    scheduler = WarmupLinearSchedule(optimizer, warmup_steps=args.warmup_steps, t_total=t_total)
+    if args.fp16:
+        try:
+            from apex import amp
+        except ImportError:
+            raise ImportError("Please install apex from https://www.github.com/nvidia/apex to use fp16 training.")
+        model, optimizer = amp.initialize(model, optimizer, opt_level=args.fp16_opt_level)
+
+    # multi-gpu training (should be after apex fp16 initialization)
+    if args.n_gpu > 1:
+        model = torch.nn.DataParallel(model)
+
+    # Distributed training (should be after apex fp16 initialization)
+    if args.local_rank != -1:
+        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.local_rank],
+                                                          output_device=args.local_rank,
+                                                          find_unused_parameters=True)
+
+    # Train!
+    logger.info("***** Running multi-task training *****")
+    for task, size in zip(args.task_names, train_dataset.sizes):
+        logger.info("  Num examples %s = %d", task, size)
+    logger.info("  Num Epochs = %d", args.num_train_epochs)
+    logger.info("  Task sampling temperature = %s", args.task_temperature)
+    logger.info("  Instantaneous batch size per GPU = %d", args.per_gpu_train_batch_size)
+    logger.info("  Gradient Accumulation steps = %d", args.gradient_accumulation_steps)
+    logger.info("  Total optimization steps = %d", t_total)
+
+    global_step = 0
+    tr_loss = 0.0
+    model.zero_grad()
+    seed_everything(args.seed)  # Added here for reproductibility (even between python 2 and 3)
+    for epoch in range(int(args.num_train_epochs)):
+        train_sampler.set_epoch(epoch)
+        pbar = ProgressBar(n_total=len(train_dataloader), desc='Training')
+        for step, batch in enumerate(train_dataloader):
+            model.train()
+            task_name = args.task_names[int(batch[-1])]
+            batch = tuple(t.to(args.device) for t in batch[:-1])
+            inputs = get_inputs(args, batch)
+            outputs = model(task_name=task_name, **inputs)
+            loss = outputs[0]  # model outputs are always tuple in transformers (see doc)
+
+            if args.n_gpu > 1:
+                loss = loss.mean()  # mean() to average on multi-gpu parallel training
+            if args.gradient_accumulation_steps > 1:
+                loss = loss / args.gradient_accumulation_steps
+
+            if args.fp16:
+                with amp.scale_loss(loss, optimizer) as scaled_loss:
+                    scaled_loss.backward()
+                torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), args.max_grad_norm)
+            else:
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+
+            pbar(step, {'loss': loss.item()})
+            tr_loss += loss.item()
+            if (step + 1) % args.gradient_accumulation_steps == 0:
+                optimizer.step()
+                scheduler.step()  # Update learning rate schedule
+                model.zero_grad()
+                global_step += 1
+
+                if args.local_rank == -1 and args.logging_steps > 0 and global_step % args.logging_steps == 0:
+                    print(" ")
+                    evaluate(args, model, tokenizer)
+
+                if args.local_rank in [-1, 0] and args.save_steps > 0 and global_step % args.save_steps == 0:
+                    # Save model checkpoint
+                    output_dir = os.path.join(args.output_dir, 'checkpoint-{}'.format(global_step))
+                    if not os.path.exists(output_dir):
+                        os.makedirs(output_dir)
+                    model_to_save = model.module if hasattr(model, 'module') else model
+                    model_to_save.save_pretrained(output_dir)
+                    torch.save(args, os.path.join(output_dir, 'training_args.bin'))
+                    logger.info("Saving model checkpoint to %s", output_dir)
+                    tokenizer.save_vocabulary(vocab_path=output_dir)
+            if 0 < args.max_steps <= global_step:
+                break
+        print(" ")
+        if 'cuda' in str(args.device):
+            torch.cuda.empty_cache()
+        if 0 < args.max_steps <= global_step:
+            break
+    return global_step, tr_loss / max(global_step, 1)
+
+
+def run_task(args, model, dataset, task_name, desc):
+    """ Logits (and labels) of ``task_name``'s head over ``dataset``, in dataset order """
+    dataloader = DataLoader(dataset, sampler=SequentialSampler(dataset), batch_size=args.eval_batch_size,
+                            collate_fn=get_collate_fn(dataset))
+    all_logits, all_labels = [], []
+    pbar = ProgressBar(n_total=len(dataloader), desc=desc)
+    model.eval()
+    for step, batch in enumerate(dataloader):
+        batch = tuple(t.to(args.device) for t in batch)
+        inputs = get_inputs(args, batch)
+        labels = inputs.pop('labels')
+        with torch.no_grad():
+            logits = model(task_name=task_name, **inputs)[0]
+        all_logits.append(logits)
+        all_labels.append(labels)
+        pbar(step)
+    print(' ')
+    return torch.cat(all_logits).cpu().numpy(), torch.cat(all_labels).cpu().numpy()
+
+
+def evaluate(args, model, tokenizer, prefix=""):
+    """ Evaluates every task on its dev set; ``avg`` is the mean of the per-task main metric """
+    args.eval_batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
+    results = collections.OrderedDict()
+    main_metrics = []
+    for task in args.task_names:
+        eval_dataset = load_and_cache_examples(task_args(args, task), task, tokenizer, data_type='dev')
+        logger.info("********* Running evaluation {} {} ********".format(task, prefix))
+        logger.info("  Num examples = %d", len(eval_dataset))
+        preds, out_label_ids = run_task(args, model, eval_dataset, task, desc="Evaluating " + task)
+        if output_modes[task] == "classification":
+            preds = np.argmax(preds, axis=1)
+        else:
+            preds = np.squeeze(preds)
+        result = compute_metrics(task, preds, out_label_ids)
+        main_metrics.append(list(result.values())[0])
+        for key in sorted(result.keys()):
+            logger.info(" dev %s: %s = %s", task, key, str(result[key]))
+            results['{}_{}'.format(task, key)] = result[key]
+    results['avg'] = float(np.mean(main_metrics))
+    logger.info(" dev: avg = %s", results['avg'])
+    return results
+
+
+def predict(args, model, tokenizer, prefix=""):
+    """ Writes ``{output_dir}/{prefix}/{task}/test_prediction.json`` for every task """
+    args.eval_batch_size = args.per_gpu_eval_batch_size * max(1, args.n_gpu)
+    for task in args.task_names:
+        label_map = {i: label for i, label in enumerate(processors[task]().get_labels())}
+        pred_dataset = load_and_cache_examples(task_args(args, task), task, tokenizer, data_type='test')
+        pred_output_dir = os.path.join(args.output_dir, prefix, task)
+        if not os.path.exists(pred_output_dir):
+            os.makedirs(pred_output_dir)
+        logger.info("******** Running prediction {} {} ********".format(task, prefix))
+        logger.info("  Num examples = %d", len(pred_dataset))
+        preds, _ = run_task(args, model, pred_dataset, task, desc="Predicting " + task)
+        if task == 'copa':
+            # two examples per question, pick the choice with the highest probability of label 1
+            probs = torch.from_numpy(preds).softmax(-1)[:, 1].numpy()
+            predict_label = (probs[1::2] > probs[0::2]).astype(np.int64)
+        elif output_modes[task] == "classification":
+            predict_label = np.argmax(preds, axis=1)
+        else:
+            predict_label = np.squeeze(preds)
+        with open(os.path.join(pred_output_dir, "test_prediction.json"), "w") as writer:
+            for i, pred in enumerate(predict_label):
+                writer.write(json.dumps({'id': i, 'label': str(label_map[pred])}) + '\n')
+        save_numpy(file_path=os.path.join(pred_output_dir, "test_logits"), data=preds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    ## Required parameters
+    parser.add_argument("--data_dir", default=None, type=str, required=True,
+                        help="The input data dir, holding one sub-directory per task (e.g. CLUEdatasets).")
+    parser.add_argument("--model_type", default=None, type=str, required=True,
+                        help="Model type selected in the list: " + ", ".join(MODEL_CLASSES.keys()))
+    parser.add_argument("--model_name_or_path", default=None, type=str, required=True,
+                        help="Path to pre-trained model or shortcut name")
+    parser.add_argument("--task_names", default=None, type=str, required=True,
+                        help="Comma separated tasks trained together, selected in the list: " + ", ".join(
+                            processors.keys()))
+    parser.add_argument("--output_dir", default=None, type=str, required=True,
+                        help="The output directory where the model predictions and checkpoints will be written.")
+
+    ## Other parameters
+    parser.add_argument("--config_name", default="", type=str,
+                        help="Pretrained config name or path if not the same as model_name")
+    parser.add_argument("--tokenizer_name", default="", type=str,
+                        help="Pretrained tokenizer name or path if not the same as model_name")
+    parser.add_argument("--max_seq_length", default=128, type=int,
+                        help="The maximum total input sequence length after tokenization.")
+    parser.add_argument("--do_train", action='store_true',
+                        help="Whether to run training.")
+    parser.add_argument("--do_eval", action='store_true',
+                        help="Whether to run eval on the dev sets.")
+    parser.add_argument("--do_predict", action='store_true',
+                        help="Whether to run the model in inference mode on the test sets.")
+    parser.add_argument("--do_lower_case", action='store_true',
+                        help="Set this flag if you are using an uncased model.")
+    parser.add_argument("--task_temperature", default=1.0, type=float,
+                        help="Task sampling temperature: 1 samples tasks in proportion to their size, larger values "
+                             "up-sample the small tasks.")
+
+    parser.add_argument("--per_gpu_train_batch_size", default=8, type=int,
+                        help="Batch size per GPU/CPU for training.")
+    parser.add_argument("--per_gpu_eval_batch_size", default=8, type=int,
+                        help="Batch size per GPU/CPU for evaluation.")
+    parser.add_argument('--gradient_accumulation_steps', type=int, default=1,
+                        help="Number of updates steps to accumulate before performing a backward/update pass.")
+    parser.add_argument("--learning_rate", default=5e-5, type=float,
+                        help="The initial learning rate for Adam.")
+    parser.add_argument("--weight_decay", default=0.01, type=float,
+                        help="Weight deay if we apply some.")
+    parser.add_argument("--adam_epsilon", default=1e-8, type=float,
+                        help="Epsilon for Adam optimizer.")
+    parser.add_argument("--max_grad_norm", default=1.0, type=float,
+                        help="Max gradient norm.")
+    parser.add_argument("--num_train_epochs", default=3.0, type=float,
+                        help="Total number of training epochs to perform.")
+    parser.add_argument("--max_steps", default=-1, type=int,
+                        help="If > 0: set total number of training steps to perform. Override num_train_epochs.")
+    parser.add_argument("--warmup_proportion", default=0.1, type=float,
+                        help="Proportion of training to perform linear learning rate warmup for,E.g., 0.1 = 10% of training.")
+    parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+                        help="Number of processes used to convert examples to features.")
+
+    parser.add_argument('--logging_steps', type=int, default=10,
+                        help="Log every X updates steps.")
+    parser.add_argument('--save_steps', type=int, default=1000,
+                        help="Save checkpoint every X updates steps.")
+    parser.add_argument("--no_cuda", action='store_true',
+                        help="Avoid using CUDA when available")
+    parser.add_argument('--overwrite_output_dir', action='store_true',
+                        help="Overwrite the content of the output directory")
+    parser.add_argument('--overwrite_cache', action='store_true',
+                        help="Overwrite the cached training and evaluation sets")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="random seed for initialization")
+    parser.add_argument('--fp16', action='store_true',
+                        help="Whether to use 16-bit (mixed) precision (through NVIDIA apex) instead of 32-bit")
+    parser.add_argument('--fp16_opt_level', type=str, default='O1',
+                        help="For fp16: Apex AMP optimization level selected in ['O0', 'O1', 'O2', and 'O3'].")
+    parser.add_argument("--local_rank", type=int, default=-1,
+                        help="For distributed training: local_rank")
+    args = parser.parse_args()
+
+    args.task_names = [task.strip().lower() for task in args.task_names.split(',') if task.strip()]
+    for task in args.task_names:
+        if task not in processors:
+            raise ValueError("Task not found: %s" % (task))
+
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    args.output_dir = args.output_dir + '{}_multitask'.format(args.model_type)
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    init_logger(log_file=args.output_dir + '/{}-{}.log'.format(args.model_type, '-'.join(args.task_names)))
+    if os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir:
+        raise ValueError(
+            "Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(
+                args.output_dir))
+
+    # Setup CUDA, GPU & distributed training
+    if args.local_rank == -1 or args.no_cuda:
+        device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+        args.n_gpu = torch.cuda.device_count()
+    else:  # Initializes the distributed backend which will take care of sychronizing nodes/GPUs
+        torch.cuda.set_device(args.local_rank)
+        device = torch.device("cuda", args.local_rank)
+        torch.distributed.init_process_group(backend='nccl')
+        args.n_gpu = 1
+    args.device = device
+    logger.warning("Process rank: %s, device: %s, n_gpu: %s, distributed training: %s, 16-bits training: %s",
+                   args.local_rank, device, args.n_gpu, bool(args.local_rank != -1), args.fp16)
+    seed_everything(args.seed)
+
+    if args.local_rank not in [-1, 0]:
+        torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
+    args.model_type = args.model_type.lower()
+    config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    config = config_class.from_pretrained(args.config_name if args.config_name else args.model_name_or_path)
+    config.task_num_labels = collections.OrderedDict(
+        (task, 1 if output_modes[task] == "regression" else len(processors[task]().get_labels()))
+        for task in args.task_names)
+    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path,
+                                                do_lower_case=args.do_lower_case)
+    model = model_class.from_pretrained(args.model_name_or_path, from_tf=bool('.ckpt' in args.model_name_or_path),
+                                        config=config)
+    if args.local_rank == 0:
+        torch.distributed.barrier()
+    model.to(args.device)
+    logger.info("Training/evaluation parameters %s", args)
+
+    if args.do_train:
+        train_dataset = load_multitask_dataset(args, tokenizer, data_type='train')
+        global_step, tr_loss = train(args, train_dataset, model, tokenizer)
+        logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
+
+    if args.do_train and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
+        # A single checkpoint holds the encoder and every head, the tasks are recorded in the config
+        logger.info("Saving model checkpoint to %s", args.output_dir)
+        model_to_save = model.module if hasattr(model, 'module') else model
+        model_to_save.save_pretrained(args.output_dir)
+        tokenizer.save_pretrained(args.output_dir)
+        torch.save(args, os.path.join(args.output_dir, 'training_args.bin'))
+
+    if (args.do_eval or args.do_predict) and args.local_rank in [-1, 0]:
+        tokenizer = tokenizer_class.from_pretrained(args.output_dir, do_lower_case=args.do_lower_case)
+        model = model_class.from_pretrained(args.output_dir)
+        model.to(args.device)
+        if args.do_eval:
+            results = evaluate(args, model, tokenizer)
+            output_eval_file = os.path.join(args.output_dir, "eval_results.txt")
+            with open(output_eval_file, "w") as writer:
+                for key in sorted(results.keys()):
+                    writer.write("%s = %s\n" % (key, str(results[key])))
+        if args.do_predict:
+            predict(args, model, tokenizer)
+
+
+if __name__ == "__main__":
+    main()
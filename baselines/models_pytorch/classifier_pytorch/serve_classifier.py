@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived inference server for a fine-tuned CLUE classifier: the checkpoint and the tokenizer are loaded
+once and concurrent requests are grouped into micro-batches.
+
+    POST /predict  {"text_a": "...", "text_b": "..."} -> {"label": "...", "probability": ...}
+                   {"instances": [{"text_a": "..."}, ...]} -> {"predictions": [...]}
+    GET  /metrics  request latency percentiles, latency and batch-size histograms
+    GET  /health
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import functools
+import json
+import logging
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+from processors import InputExample, dynamic_collate_fn
+from processors import clue_convert_examples_to_features as convert_examples_to_features
+from processors import clue_output_modes as output_modes
+from processors import clue_processors as processors
+from run_classifier import MODEL_CLASSES
+from tools.common import init_logger, logger
+from tools.serving import MicroBatcher, ServingStats
+
+
+class ClassifierService(object):
+    """ Featurizes texts as ``run_classifier.py`` does and predicts batches of features with the model """
+
+    def __init__(self, args, model, tokenizer, label_list):
+        self.args = args
+        self.model = model
+        self.tokenizer = tokenizer
+        self.label_list = label_list
+        self.output_mode = output_modes[args.task_name]
+        self.pad_on_left = bool(args.model_type in ['xlnet'])
+        self.pad_token = tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0]
+        self.pad_token_segment_id = 4 if args.model_type in ['xlnet'] else 0
+        self.collate_fn = functools.partial(dynamic_collate_fn, pad_token=self.pad_token,
+                                            pad_token_segment_id=self.pad_token_segment_id,
+                                            pad_on_left=self.pad_on_left)
+
+    def featurize(self, instances):
+        """ ``[{"text_a": ..., "text_b": ...}]`` -> per-example tensors, run in the request threads """
+        examples = []
+        for i, instance in enumerate(instances):
+            if not isinstance(instance, dict) or not isinstance(instance.get('text_a'), str):
+                raise ValueError("every instance needs a 'text_a' string")
+            examples.append(InputExample(guid='serve-%d' % i, text_a=instance['text_a'],
+                                         text_b=instance.get('text_b'), label=self.label_list[0]))
+        features = convert_examples_to_features(examples, self.tokenizer,
+                                                label_list=self.label_list,
+                                                max_length=self.args.max_seq_length,
+                                                output_mode=self.output_mode,
+                                                pad_on_left=self.pad_on_left,
+                                                pad_token=self.pad_token,
+                                                pad_token_segment_id=self.pad_token_segment_id,
+                                                pad_to_max_length=False)
+        return [(torch.from_numpy(np.frombuffer(f.input_ids, dtype=np.int32).astype(np.int64)),
+                 torch.from_numpy(np.frombuffer(f.attention_mask, dtype=np.int8).astype(np.int64)),
+                 torch.from_numpy(np.frombuffer(f.token_type_ids, dtype=np.int8).astype(np.int64)),
+                 torch.tensor(f.input_len), torch.tensor(0)) for f in features]
+
+    def predict(self, items):
+        """ Runs one micro-batch, called by the batcher's worker thread only """
+        input_ids, attention_mask, token_type_ids, _ = self.collate_fn(items)
+        inputs = {'input_ids': input_ids.to(self.args.device),
+                  'attention_mask': attention_mask.to(self.args.device)}
+        if self.args.model_type in ['bert', 'xlnet', 'albert', 'roberta']:
+            inputs['token_type_ids'] = token_type_ids.to(self.args.device)
+        with torch.no_grad():
+            logits = self.model(**inputs)[0]
+        if self.output_mode == "regression":
+            return [{'score': score} for score in logits.view(-1).tolist()]
+        probabilities, labels = logits.softmax(-1).max(-1)
+        return [{'label': self.label_list[label], 'probability': probability}
+                for label, probability in zip(labels.tolist(), probabilities.tolist())]
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, self.server.batcher.stats.snapshot())
+        elif self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            single = 'instances' not in request
+            items = self.server.service.featurize([request] if single else request['instances'])
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        try:
+            predictions = self.server.batcher.submit(items)
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        self._send(200, predictions[0] if single else {'predictions': predictions})
+
+    def log_message(self, format, *args):
+        logger.debug("%s", format % args)
+
+
+class HTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # bursts of concurrent clients are what micro-batching is for
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_type", default=None, type=str, required=True,
+                        help="Model type selected in the list: " + ", ".join(MODEL_CLASSES.keys()))
+    parser.add_argument("--model_name_or_path", default=None, type=str, required=True,
+                        help="Checkpoint fine-tuned by run_classifier.py (weights, config and vocabulary).")
+    parser.add_argument("--task_name", default=None, type=str, required=True,
+                        help="The CLUE task the checkpoint was fine-tuned on: " + ", ".join(processors.keys()))
+    parser.add_argument("--max_seq_length", default=128, type=int,
+                        help="The maximum total input sequence length after tokenization.")
+    parser.add_argument("--do_lower_case", action='store_true',
+                        help="Set this flag if you are using an uncased model.")
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="Address to listen on.")
+    parser.add_argument("--port", default=8000, type=int, help="Port to listen on.")
+    parser.add_argument("--unix_socket", default="", type=str,
+                        help="Listen on this Unix socket instead of --host/--port.")
+    parser.add_argument("--max_batch_size", default=32, type=int,
+                        help="Maximum number of examples per micro-batch.")
+    parser.add_argument("--max_latency_ms", default=5.0, type=float,
+                        help="Longest time a request waits for other requests to share its batch.")
+    parser.add_argument("--num_threads", default=0, type=int,
+                        help="Torch intra-op threads on CPU (0: torch's default).")
+    parser.add_argument("--log_file", default="", type=str, help="Also log to this file.")
+    parser.add_argument("--no_cuda", action='store_true', help="Avoid using CUDA when available")
+    return parser
+
+
+def main():
+    args = get_argparse().parse_args()
+    init_logger(log_file=args.log_file or None)
+    args.task_name = args.task_name.lower()
+    if args.task_name not in processors:
+        raise ValueError("Task not found: %s" % (args.task_name))
+    args.model_type = args.model_type.lower()
+    args.device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    _, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    tokenizer = tokenizer_class.from_pretrained(args.model_name_or_path, do_lower_case=args.do_lower_case)
+    model = model_class.from_pretrained(args.model_name_or_path)
+    model.to(args.device)
+    model.eval()
+    service = ClassifierService(args, model, tokenizer, processors[args.task_name]().get_labels())
+    service.predict(service.featurize([{'text_a': 'warm up'}]))
+    logging.getLogger("processors.clue").setLevel(logging.WARN)  # no example dump per request
+
+    batcher = MicroBatcher(service.predict, max_batch_size=args.max_batch_size, max_latency_ms=args.max_latency_ms,
+                           stats=ServingStats())
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = UnixHTTPServer(args.unix_socket, PredictionHandler)
+        address = args.unix_socket
+    else:
+        server = HTTPServer((args.host, args.port), PredictionHandler)
+        address = 'http://{}:{}'.format(*server.server_address[:2])
+    server.service, server.batcher = service, batcher
+    logger.info("Serving %s (%s) on %s, micro-batches of up to %d examples within %.1f ms", args.model_name_or_path,
+                args.task_name, address, args.max_batch_size, args.max_latency_ms)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+class PredictionAccumulator(object):
+    '''
+    Collects per-batch logits (and labels) into buffers preallocated from the dataset size,
+    instead of growing numpy arrays with np.append on every batch.
+
+    By default the buffers live on ``device``: batches are written into slices without any
+    device-host synchronisation and ``result()`` does a single transfer. With ``memmap_file``
+    the logits are streamed into a ``.npy`` memmap instead, each batch being copied to the host
+    asynchronously (pinned memory + CUDA event) and written while the next batch is computed.
+
+    Rows are filled in arrival order, or at the dataset positions given by ``indices`` when batches
+    come out of order (e.g. from a length-bucketing sampler), so results are always in dataset order.
+
+    Example:
+        >>> accumulator = PredictionAccumulator(len(eval_dataset), num_labels, device=args.device)
+        >>> for batch in eval_dataloader:
+        >>>     accumulator.update(logits, labels)
+        >>> preds, out_label_ids = accumulator.result()
+    '''
+
+    def __init__(self, num_examples, num_labels, device='cpu', with_labels=True, label_dtype=torch.long,
+                 memmap_file=None):
+        self.num_examples = num_examples
+        self.num_labels = num_labels
+        self.device = torch.device(device)
+        self.with_labels = with_labels
+        self.memmap_file = memmap_file
+        self.pos = 0
+        self.extent = 0
+        self._pending = None
+        if memmap_file is not None:
+            self.logits = np.lib.format.open_memmap(memmap_file, mode='w+', dtype=np.float32,
+                                                    shape=(num_examples, num_labels))
+        else:
+            self.logits = torch.empty((num_examples, num_labels), dtype=torch.float, device=self.device)
+        self.labels = torch.empty(num_examples, dtype=label_dtype, device=self.device) if with_labels else None
+
+    def _grow(self, size):
+        # Only reached when a sampler yields more items than announced (e.g. padded distributed batches)
+        capacity = max(size, 2 * self.logits.shape[0])
+        if self.memmap_file is not None:
+            self._drain()
+            old = np.array(self.logits[:self.extent])
+            del self.logits
+            self.logits = np.lib.format.open_memmap(self.memmap_file, mode='w+', dtype=np.float32,
+                                                    shape=(capacity, self.num_labels))
+            self.logits[:self.extent] = old
+        else:
+            logits = torch.empty((capacity, self.num_labels), dtype=self.logits.dtype, device=self.device)
+            logits[:self.extent] = self.logits[:self.extent]
+            self.logits = logits
+        if self.labels is not None:
+            labels = torch.empty(capacity, dtype=self.labels.dtype, device=self.device)
+            labels[:self.extent] = self.labels[:self.extent]
+            self.labels = labels
+
+    def _drain(self):
+        if self._pending is not None:
+            host, event, rows = self._pending
+            if event is not None:
+                event.synchronize()
+            self.logits[rows] = host.numpy()
+            self._pending = None
+
+    def update(self, logits, labels=None, indices=None):
+        '''
+        Stores one batch. ``indices`` are the dataset positions of the batch rows; if omitted,
+        rows are appended after the previous batch.
+        '''
+        logits = logits.detach().view(logits.shape[0], -1)
+        size = logits.shape[0]
+        if indices is None:
+            rows = slice(self.pos, self.pos + size)
+            end = self.pos + size
+        else:
+            rows = np.asarray(indices, dtype=np.int64)
+            end = int(rows.max()) + 1 if size else 0
+        if end > self.logits.shape[0]:
+            self._grow(end)
+        if self.memmap_file is not None:
+            self._drain()
+            if logits.is_cuda:
+                host = torch.empty(logits.shape, dtype=torch.float, pin_memory=True)
+                host.copy_(logits, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+            else:
+                host, event = logits.float(), None
+            self._pending = (host, event, rows)
+        else:
+            self.logits[rows if indices is None else torch.from_numpy(rows).to(self.device)] = logits
+        if self.labels is not None and labels is not None:
+            self.labels[rows if indices is None else torch.from_numpy(rows).to(self.device)] = \
+                labels.detach().to(self.device)
+        self.pos += size
+        self.extent = max(self.extent, end)
+
+    def result(self):
+        '''
+        Returns ``(logits, labels)`` as numpy arrays trimmed to the number of collected rows
+        (``labels`` is ``None`` when ``with_labels=False``). Memmapped logits are flushed to disk.
+        '''
+        if self.memmap_file is not None:
+            self._drain()
+            self.logits.flush()
+            logits = self.logits[:self.extent]
+        else:
+            logits = self.logits[:self.extent].cpu().numpy()
+        labels = self.labels[:self.extent].cpu().numpy() if self.labels is not None else None
+        return logits, labels
+
+
+def gather_predictions(logits, indices, num_examples, dst=0):
+    '''
+    Merges the predictions of a distributed evaluation: every process passes its ``logits`` (numpy rows)
+    and their dataset positions ``indices``. Returns the ``num_examples`` rows in dataset order on
+    rank ``dst`` and ``None`` on the other ranks.
+    '''
+    gathered = [None] * dist.get_world_size() if dist.get_rank() == dst else None
+    dist.gather_object((np.asarray(indices, dtype=np.int64), logits), gathered, dst=dst)
+    if gathered is None:
+        return None
+    merged = np.empty((num_examples,) + logits.shape[1:], dtype=logits.dtype)
+    for rank_indices, rank_logits in gathered:
+        merged[rank_indices] = rank_logits
+    return merged
@@ -0,0 +1,73 @@
+import copy
+import logging
+import threading
+
+import torch
+
+logger = logging.getLogger()
+
+
+class AsyncEvaluator(object):
+    '''
+    Evaluates snapshots of the training weights in a background thread, so that training
+    does not stall while the dev set is scored.
+
+    ``submit`` copies the current weights to ``device`` (a spare GPU, or the CPU) and returns
+    immediately; a worker thread loads them into its own copy of the model and calls
+    ``eval_fn(model, device, tag)``. At most one snapshot waits behind the running evaluation:
+    a newer snapshot replaces a queued one that has not started yet.
+
+    Example:
+        >>> evaluator = AsyncEvaluator(model, eval_fn=lambda m, device, tag: evaluate(args, m, ...), device='cpu')
+        >>> evaluator.submit(model, tag=global_step)
+        >>> evaluator.close()  # waits for the pending evaluations
+    '''
+
+    def __init__(self, model, eval_fn, device='cpu'):
+        self.eval_fn = eval_fn
+        self.device = torch.device(device)
+        model = model.module if hasattr(model, 'module') else model
+        self.model = copy.deepcopy(model).to(self.device)
+        self.model.eval()
+        self.results = []
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='async-eval', daemon=True)
+        self._thread.start()
+
+    def submit(self, model, tag):
+        model = model.module if hasattr(model, 'module') else model
+        snapshot = {name: tensor.detach().to(self.device, copy=True) for name, tensor in model.state_dict().items()}
+        with self._condition:
+            if self._pending is not None:
+                logger.info("Async evaluation of %s skipped, superseded by %s", self._pending[0], tag)
+            self._pending = (tag, snapshot)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                tag, snapshot = self._pending
+                self._pending = None
+            try:
+                self.model.load_state_dict(snapshot)
+                del snapshot
+                result = self.eval_fn(self.model, self.device, tag)
+                self.results.append((tag, result))
+                logger.info("Async eval results at %s: %s", tag,
+                            ", ".join("%s = %s" % (key, result[key]) for key in sorted(result)))
+            except Exception:
+                logger.exception("Async evaluation of %s failed", tag)
+
+    def close(self):
+        ''' Waits for the queued and running evaluations, then stops the worker thread. '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        return self.results
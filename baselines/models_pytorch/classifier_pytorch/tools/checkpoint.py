@@ -0,0 +1,179 @@
+import os
+import re
+import copy
+import json
+import glob
+import pickle
+import random
+import shutil
+import logging
+import threading
+
+import numpy as np
+import torch
+
+from transformers import WEIGHTS_NAME
+
+logger = logging.getLogger()
+
+TRAINER_STATE_NAME = 'trainer_state.json'
+OPTIMIZER_NAME = 'optimizer.pt'
+SCHEDULER_NAME = 'scheduler.pt'
+AMP_NAME = 'amp.pt'
+RNG_STATE_NAME = 'rng_state.pkl'
+CHECKPOINT_PREFIX = 'checkpoint-'
+
+
+def get_rng_state():
+    ''' Python, numpy, torch and (when available) every CUDA device RNG state '''
+    state = {'python': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _to_cpu(obj):
+    ''' Copies every tensor of a (nested) state dict to the host, so it can be written while training goes on '''
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, _to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+
+def checkpoint_step(checkpoint_dir):
+    match = re.search(r'{}(\d+)$'.format(CHECKPOINT_PREFIX), checkpoint_dir.rstrip('/'))
+    return int(match.group(1)) if match else -1
+
+
+def list_checkpoints(output_dir):
+    ''' Complete (resumable) checkpoints of ``output_dir``, oldest first '''
+    checkpoints = [os.path.dirname(path) for path in
+                   glob.glob(os.path.join(output_dir, CHECKPOINT_PREFIX + '*', TRAINER_STATE_NAME))]
+    return sorted((c for c in checkpoints if checkpoint_step(c) >= 0), key=checkpoint_step)
+
+
+def find_checkpoint(output_dir, checkpoint):
+    ''' Resolves ``checkpoint``: a checkpoint directory, or ``latest`` for the newest one in ``output_dir`` '''
+    if checkpoint == 'latest':
+        checkpoints = list_checkpoints(output_dir)
+        if not checkpoints:
+            raise ValueError("No resumable checkpoint found in {}".format(output_dir))
+        return checkpoints[-1]
+    if not os.path.isfile(os.path.join(checkpoint, TRAINER_STATE_NAME)):
+        raise ValueError("{} is not a resumable checkpoint (no {})".format(checkpoint, TRAINER_STATE_NAME))
+    return checkpoint
+
+
+def load_training_state(checkpoint):
+    '''
+    Reads what ``CheckpointSaver`` wrote besides the weights: returns ``(trainer_state, optimizer_state,
+    scheduler_state, amp_state, rng_state)``, ``amp_state`` being ``None`` without fp16.
+    '''
+    with open(os.path.join(checkpoint, TRAINER_STATE_NAME), 'r') as reader:
+        trainer_state = json.load(reader)
+    optimizer_state = torch.load(os.path.join(checkpoint, OPTIMIZER_NAME), map_location='cpu')
+    scheduler_state = torch.load(os.path.join(checkpoint, SCHEDULER_NAME), map_location='cpu')
+    amp_file = os.path.join(checkpoint, AMP_NAME)
+    amp_state = torch.load(amp_file, map_location='cpu') if os.path.isfile(amp_file) else None
+    with open(os.path.join(checkpoint, RNG_STATE_NAME), 'rb') as reader:
+        rng_state = pickle.load(reader)
+    return trainer_state, optimizer_state, scheduler_state, amp_state, rng_state
+
+
+class CheckpointSaver(object):
+    '''
+    Writes resumable checkpoints (weights, config, vocabulary, training args, optimizer, scheduler,
+    amp, RNG states and ``trainer_state.json``) from a background thread.
+
+    ``save`` copies every state to the host on the calling thread, which is the only part that
+    has to wait for the device, and hands the copies to the writer thread; training continues while
+    they are written. Checkpoints are written to ``checkpoint-N.tmp`` and renamed once complete, and
+    only the newest ``keep_last`` checkpoints are kept (``0`` keeps all). At most one save waits
+    behind the one being written, so host memory holds at most two snapshots.
+
+    Example:
+        >>> saver = CheckpointSaver(args.output_dir, keep_last=3)
+        >>> saver.save(global_step, model, optimizer, scheduler, args, tokenizer, trainer_state,
+        >>>            rng_state={'current': get_rng_state(), 'epoch_start': epoch_rng_state})
+        >>> saver.close()  # waits for the pending writes
+    '''
+
+    def __init__(self, output_dir, keep_last=0):
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self._semaphore = threading.Semaphore(2)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def save(self, global_step, model, optimizer, scheduler, args, tokenizer, trainer_state, rng_state, amp=None):
+        model_to_save = model.module if hasattr(model, 'module') else model  # Take care of distributed/parallel training
+        snapshot = {
+            'weights': _to_cpu(model_to_save.state_dict()),
+            'optimizer': _to_cpu(optimizer.state_dict()),
+            'scheduler': copy.deepcopy(scheduler.state_dict()),
+            'amp': _to_cpu(amp.state_dict()) if amp is not None else None,
+            'rng': rng_state,
+            'trainer_state': dict(trainer_state, global_step=global_step),
+        }
+        self._semaphore.acquire()
+        thread = threading.Thread(target=self._write, name='checkpoint-saver',
+                                  args=(global_step, model_to_save.config, args, tokenizer, snapshot))
+        thread.start()
+        self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        return os.path.join(self.output_dir, '{}{}'.format(CHECKPOINT_PREFIX, global_step))
+
+    def _write(self, global_step, config, args, tokenizer, snapshot):
+        try:
+            with self._lock:  # one checkpoint written at a time, in order
+                output_dir = os.path.join(self.output_dir, '{}{}'.format(CHECKPOINT_PREFIX, global_step))
+                tmp_dir = output_dir + '.tmp'
+                if os.path.exists(tmp_dir):
+                    shutil.rmtree(tmp_dir)
+                os.makedirs(tmp_dir)
+                torch.save(snapshot['weights'], os.path.join(tmp_dir, WEIGHTS_NAME))
+                config.save_pretrained(tmp_dir)
+                tokenizer.save_vocabulary(vocab_path=tmp_dir)
+                torch.save(args, os.path.join(tmp_dir, 'training_args.bin'))
+                torch.save(snapshot['optimizer'], os.path.join(tmp_dir, OPTIMIZER_NAME))
+                torch.save(snapshot['scheduler'], os.path.join(tmp_dir, SCHEDULER_NAME))
+                if snapshot['amp'] is not None:
+                    torch.save(snapshot['amp'], os.path.join(tmp_dir, AMP_NAME))
+                with open(os.path.join(tmp_dir, RNG_STATE_NAME), 'wb') as writer:
+                    pickle.dump(snapshot['rng'], writer)
+                with open(os.path.join(tmp_dir, TRAINER_STATE_NAME), 'w') as writer:
+                    json.dump(snapshot['trainer_state'], writer, indent=2, sort_keys=True)
+                if os.path.exists(output_dir):
+                    shutil.rmtree(output_dir)
+                os.rename(tmp_dir, output_dir)
+                logger.info("Saving model checkpoint to %s", output_dir)
+                self._rotate()
+        except Exception:
+            logger.exception("Saving checkpoint %d failed", global_step)
+        finally:
+            self._semaphore.release()
+
+    def _rotate(self):
+        if self.keep_last <= 0:
+            return
+        for checkpoint in list_checkpoints(self.output_dir)[:-self.keep_last]:
+            logger.info("Deleting older checkpoint %s (keeping the last %d)", checkpoint, self.keep_last)
+            shutil.rmtree(checkpoint, ignore_errors=True)
+
+    def close(self):
+        ''' Waits until every checkpoint is written '''
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
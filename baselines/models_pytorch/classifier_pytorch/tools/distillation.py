@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+
+
+def distillation_loss(student_logits, teacher_logits, hard_loss, temperature=2.0, alpha=0.5):
+    '''
+    ``alpha * T^2 * KL(softmax(teacher / T) || softmax(student / T)) + (1 - alpha) * hard_loss``,
+    the soft-label term being scaled by ``T^2`` so that its gradients keep the magnitude of the hard one
+    (Hinton et al., 2015). For a regression task (a single logit) the soft term is the MSE to the teacher.
+    '''
+    teacher_logits = teacher_logits.to(student_logits.dtype)
+    if student_logits.size(-1) == 1:
+        soft_loss = F.mse_loss(student_logits.view(-1), teacher_logits.view(-1))
+    else:
+        soft_loss = F.kl_div(F.log_softmax(student_logits / temperature, dim=-1),
+                             F.softmax(teacher_logits / temperature, dim=-1),
+                             reduction='batchmean') * temperature ** 2
+    return alpha * soft_loss + (1.0 - alpha) * hard_loss.mean()
+
+
+class TeacherLogitsDataset(Dataset):
+    '''
+    Pairs every feature of ``dataset`` with the row of precomputed teacher logits at the same index.
+
+    ``logits_file`` is a ``.npy`` file (e.g. written by ``PredictionAccumulator(memmap_file=...)``)
+    opened as a read-only memmap, so the teacher never runs during training and the logits are paged
+    in on demand. ``collate_fn`` pads the features with the collate function of ``dataset`` and appends
+    the teacher logits of the batch, so batches are
+    ``(input_ids, attention_mask, token_type_ids, labels, teacher_logits)``.
+    '''
+
+    def __init__(self, dataset, logits_file, collate_fn):
+        self.dataset = dataset
+        self.logits_file = logits_file
+        self.base_collate_fn = collate_fn
+        self.meta = dataset.meta
+        self._logits = None
+        if len(self._open()) != len(dataset):
+            raise ValueError("{} holds {} teacher logits for {} features".format(
+                logits_file, len(self._open()), len(dataset)))
+
+    def _open(self):
+        if self._logits is None:
+            self._logits = np.load(self.logits_file, mmap_mode='r')
+        return self._logits
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_logits'] = None
+        return state
+
+    @property
+    def lengths(self):
+        return self.dataset.lengths
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.dataset[index], np.array(self._open()[index], dtype=np.float32)
+
+    def collate_fn(self, batch):
+        features, logits = zip(*batch)
+        return tuple(self.base_collate_fn(list(features))) + (torch.from_numpy(np.stack(logits)),)
@@ -0,0 +1,122 @@
+import inspect
+import logging
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+logger = logging.getLogger()
+
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+OUTPUT_NAMES = ['logits']
+OPTIMIZATION_LEVELS = ('disable', 'basic', 'extended', 'all')
+
+
+class _LogitsOnly(nn.Module):
+    ''' Positional (input_ids, attention_mask, token_type_ids) -> logits, the signature that is exported '''
+
+    def __init__(self, model):
+        super(_LogitsOnly, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+
+def export_onnx(model, onnx_file, opset_version=14):
+    '''
+    Exports a Bert/Albert sequence classifier to ``onnx_file`` with dynamic batch and sequence axes,
+    so the graph accepts the dynamically padded batches of ``dynamic_collate_fn``.
+    '''
+    model = model.module if hasattr(model, 'module') else model
+    model.eval()
+    device = next(model.parameters()).device
+    dummy = torch.ones((2, 8), dtype=torch.long, device=device)
+    dynamic_axes = dict((name, {0: 'batch', 1: 'sequence'}) for name in INPUT_NAMES)
+    dynamic_axes['logits'] = {0: 'batch'}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False  # the TorchScript exporter, which dynamic_axes belongs to
+    with torch.no_grad():
+        torch.onnx.export(_LogitsOnly(model), (dummy, dummy, torch.zeros_like(dummy)), onnx_file,
+                          input_names=INPUT_NAMES, output_names=OUTPUT_NAMES, dynamic_axes=dynamic_axes,
+                          opset_version=opset_version, do_constant_folding=True, **kwargs)
+    logger.info("Model exported to %s", onnx_file)
+    return onnx_file
+
+
+def create_session(onnx_file, optimization='all', num_threads=0, optimized_file=None, use_cuda=False):
+    '''
+    An ``onnxruntime.InferenceSession`` over ``onnx_file``. ``optimization`` is the graph optimization
+    level (``disable``, ``basic``, ``extended`` or ``all``); ``optimized_file``, if given, receives the
+    optimized graph so later sessions can load it with ``optimization='disable'``.
+    '''
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("Please install onnxruntime (pip install onnxruntime) to run ONNX models.")
+    levels = {'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+              'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+              'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+              'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL}
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = levels[optimization]
+    options.intra_op_num_threads = num_threads if num_threads > 0 else torch.get_num_threads()
+    if optimized_file is not None:
+        options.optimized_model_filepath = optimized_file
+    providers = ['CPUExecutionProvider']
+    if use_cuda and 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+        providers.insert(0, 'CUDAExecutionProvider')
+    return onnxruntime.InferenceSession(onnx_file, options, providers=providers)
+
+
+class OnnxModel(object):
+    '''
+    Runs an exported classifier through onnxruntime behind the calling convention of the PyTorch
+    models, so ``evaluate()`` and ``predict()`` use it unchanged: ``model(input_ids=..., attention_mask=...,
+    token_type_ids=..., labels=...)`` returns ``(loss, logits)``, or ``(logits,)`` without labels,
+    as torch tensors.
+
+    Example:
+        >>> model = OnnxModel(create_session('model.onnx'), num_labels=len(label_list))
+        >>> predict(args, model, tokenizer, label_list)
+    '''
+
+    def __init__(self, session, num_labels):
+        self.session = session
+        self.num_labels = num_labels
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None, labels=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        feeds = dict((name, tensor.detach().cpu().numpy().astype(np.int64))
+                     for name, tensor in zip(INPUT_NAMES, (input_ids, attention_mask, token_type_ids)))
+        logits = torch.from_numpy(self.session.run(OUTPUT_NAMES, feeds)[0]).to(input_ids.device)
+        if labels is None:
+            return (logits,)
+        if self.num_labels == 1:
+            loss = F.mse_loss(logits.view(-1), labels.view(-1).to(logits.dtype))
+        else:
+            loss = F.cross_entropy(logits.view(-1, self.num_labels), labels.view(-1))
+        return loss, logits
+
+
+def check_parity(model, onnx_model, batches):
+    ''' Largest absolute logit difference between ``model`` and ``onnx_model`` over ``batches`` '''
+    model.eval()
+    max_diff = 0.0
+    with torch.no_grad():
+        for input_ids, attention_mask, token_type_ids in batches:
+            expected = model(input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+            actual = onnx_model(input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+            max_diff = max(max_diff, float((expected - actual).abs().max()))
+    return max_diff
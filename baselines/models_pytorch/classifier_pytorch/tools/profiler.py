@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+import torch
+
+logger = logging.getLogger()
+
+
+class NullProfiler(object):
+    '''
+    The do-nothing instrumentation used when profiling is off: every hook is free, so the
+    training/evaluation code can call them unconditionally.
+    '''
+    enabled = False
+
+    @contextlib.contextmanager
+    def timer(self, name, cat='train'):
+        yield
+
+    def timed(self, iterable, name='data', cat='train'):
+        return iterable
+
+    def step(self, global_step):
+        pass
+
+    def sample_memory(self, tag=''):
+        pass
+
+    def close(self):
+        pass
+
+
+class Profiler(NullProfiler):
+    '''
+    Named timers, memory samples and an optional ``torch.profiler`` capture, written to one file per run.
+
+    * ``timer(name, cat)`` measures a block (data, h2d, forward, backward, clip, optimizer, save, ...).
+      On CUDA the device is synchronised at both ends so the time belongs to the block, which is
+      what profiling wants and why this is opt-in.
+    * ``step(global_step)`` samples the memory (RSS, and CUDA allocated/peak when present) every
+      ``memory_interval`` steps and opens/closes the ``torch.profiler`` window ``trace_steps``
+      (``(first, last)`` global steps, inclusive); that trace is exported next to ``output_file``.
+    * ``output_file`` is written as JSON lines (``fmt='jsonl'``, one event per line, appended as the
+      run goes) or as a Chrome trace (``fmt='chrome'``, open it in chrome://tracing or Perfetto).
+
+    Example:
+        >>> profiler = Profiler(os.path.join(output_dir, 'profile.jsonl'), device=args.device)
+        >>> set_profiler(profiler)
+        >>> with profiler.timer('forward'):
+        >>>     outputs = model(**inputs)
+        >>> profiler.step(global_step)
+        >>> profiler.close()
+    '''
+    enabled = True
+
+    def __init__(self, output_file, fmt='jsonl', device='cpu', trace_steps=None, memory_interval=10):
+        if fmt not in ('jsonl', 'chrome'):
+            raise ValueError("Unknown profile format: {}".format(fmt))
+        self.output_file = output_file
+        self.fmt = fmt
+        self.device = torch.device(device)
+        self.trace_steps = trace_steps
+        self.memory_interval = memory_interval
+        self.pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._events = []
+        self._lock = threading.Lock()
+        self._trace = None
+        self._writer = open(output_file, 'w') if fmt == 'jsonl' else None
+        logger.info("Profiling to %s", output_file)
+
+    def _now_us(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def _emit(self, event):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.write(json.dumps(event) + '\n')
+            else:
+                self._events.append(event)
+
+    @contextlib.contextmanager
+    def timer(self, name, cat='train'):
+        self._sync()
+        start = self._now_us()
+        if self._trace is not None:
+            with torch.autograd.profiler.record_function(name):
+                yield
+        else:
+            yield
+        self._sync()
+        self._emit({'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': self._now_us() - start,
+                    'pid': self.pid, 'tid': threading.get_ident()})
+
+    def timed(self, iterable, name='data', cat='train'):
+        ''' Iterates over ``iterable`` (e.g. a DataLoader), timing every fetch '''
+        iterator = iter(iterable)
+        while True:
+            with self.timer(name, cat=cat):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def sample_memory(self, tag=''):
+        memory = {'rss_mb': _rss_bytes() / 2 ** 20}
+        if self.device.type == 'cuda':
+            memory['cuda_allocated_mb'] = torch.cuda.memory_allocated(self.device) / 2 ** 20
+            memory['cuda_max_allocated_mb'] = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+        self._emit({'name': 'memory', 'cat': 'memory', 'ph': 'C', 'ts': self._now_us(), 'pid': self.pid,
+                    'args': memory, 'tag': str(tag)})
+
+    def _start_trace(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._trace.__enter__()
+
+    def _stop_trace(self):
+        trace, self._trace = self._trace, None
+        trace.__exit__(None, None, None)
+        trace_file = '{}.torch_trace_steps{}-{}.json'.format(os.path.splitext(self.output_file)[0], *self.trace_steps)
+        trace.export_chrome_trace(trace_file)
+        logger.info("torch.profiler trace of steps %d-%d written to %s", self.trace_steps[0], self.trace_steps[1],
+                    trace_file)
+
+    def step(self, global_step):
+        ''' Call after optimizer step ``global_step``; trace window and memory samples follow the global step '''
+        if self.memory_interval > 0 and global_step % self.memory_interval == 0:
+            self.sample_memory(tag=global_step)
+        if self.trace_steps is not None:
+            if self._trace is None and global_step + 1 == self.trace_steps[0]:
+                self._start_trace()  # the next step is the first one of the window
+            elif self._trace is not None and global_step >= self.trace_steps[1]:
+                self._stop_trace()
+
+    def close(self):
+        if self._trace is not None:
+            self._stop_trace()
+        self.sample_memory(tag='end')
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            with open(self.output_file, 'w') as writer:
+                json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, writer)
+
+
+def _rss_bytes():
+    ''' Resident set size of this process, from /proc when available, else the peak RSS '''
+    try:
+        with open('/proc/self/statm') as reader:
+            return int(reader.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+_profiler = NullProfiler()
+
+
+def set_profiler(profiler):
+    ''' Installs ``profiler`` as the process-wide instrumentation returned by ``get_profiler`` '''
+    global _profiler
+    _profiler = profiler if profiler is not None else NullProfiler()
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
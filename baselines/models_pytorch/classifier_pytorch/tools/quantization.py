@@ -0,0 +1,64 @@
+import io
+import time
+import logging
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger()
+
+
+def quantize_dynamic(model):
+    '''
+    int8 dynamic quantization of every ``nn.Linear`` (weights quantized ahead of time,
+    activations on the fly). CPU only, needs pytorch>=1.3.
+    :param model:
+    :return: the quantized copy of the model
+    '''
+    model = model.module if hasattr(model, 'module') else model
+    model = model.to('cpu').eval()
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def model_size(model):
+    '''
+    Serialized size of the state_dict in bytes (packed int8 weights included)
+    :param model:
+    :return:
+    '''
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def compare_quantized(fp32_model, int8_model, eval_fn, num_examples, num_batches):
+    '''
+    Runs ``eval_fn(model) -> metrics dict`` on both models and reports the metric,
+    latency, throughput and size deltas.
+    Example:
+        >>> report = compare_quantized(model, quantize_dynamic(model), eval_fn, len(dataset), len(dataloader))
+    '''
+    report = {}
+    for name, model in (('fp32', fp32_model), ('int8', int8_model)):
+        metrics, elapsed = timed(eval_fn, model)
+        report[name] = {
+            'metrics': metrics,
+            'seconds': elapsed,
+            'latency_ms_per_batch': 1000.0 * elapsed / max(num_batches, 1),
+            'throughput_examples_per_s': num_examples / elapsed if elapsed > 0 else float('inf'),
+            'size_mb': model_size(model) / 2 ** 20,
+        }
+    fp32, int8 = report['fp32'], report['int8']
+    report['delta'] = {
+        'metrics': {key: int8['metrics'][key] - fp32['metrics'][key] for key in fp32['metrics']
+                    if key in int8['metrics']},
+        'speedup': fp32['seconds'] / int8['seconds'] if int8['seconds'] > 0 else float('inf'),
+        'size_ratio': int8['size_mb'] / fp32['size_mb'],
+    }
+    return report
@@ -0,0 +1,163 @@
+import time
+import queue
+import logging
+import threading
+import collections
+
+import numpy as np
+
+logger = logging.getLogger()
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class ServingStats(object):
+    '''
+    Request latencies and batch sizes of a server. Percentiles are computed over the latest ``window``
+    requests, the latency and batch-size histograms count every request/batch since the start.
+    '''
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._batch_sizes = collections.Counter()
+        self._model_seconds = 0.0
+        self._num_requests = 0
+        self._num_examples = 0
+        self._start = time.time()
+
+    def record_request(self, seconds, num_examples=1):
+        milliseconds = 1000.0 * seconds
+        with self._lock:
+            self._latencies.append(milliseconds)
+            self._latency_counts[np.searchsorted(LATENCY_BUCKETS_MS, milliseconds)] += 1
+            self._num_requests += 1
+            self._num_examples += num_examples
+
+    def record_batch(self, size, seconds):
+        with self._lock:
+            self._batch_sizes[size] += 1
+            self._model_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self._latencies, dtype=np.float64)
+            num_batches = sum(self._batch_sizes.values())
+            summary = {
+                'uptime_s': time.time() - self._start,
+                'requests': self._num_requests,
+                'examples': self._num_examples,
+                'batches': num_batches,
+                'mean_batch_size': sum(size * count for size, count in self._batch_sizes.items()) / max(num_batches, 1),
+                'model_ms_per_batch': 1000.0 * self._model_seconds / max(num_batches, 1),
+                'latency_histogram_ms': collections.OrderedDict(
+                    ('<={}'.format(bound), count) for bound, count in zip(LATENCY_BUCKETS_MS, self._latency_counts)),
+                'batch_size_histogram': collections.OrderedDict(
+                    (str(size), self._batch_sizes[size]) for size in sorted(self._batch_sizes)),
+            }
+            summary['latency_histogram_ms']['>{}'.format(LATENCY_BUCKETS_MS[-1])] = self._latency_counts[-1]
+        if len(latencies):
+            summary['latency_ms'] = {
+                'p50': float(np.percentile(latencies, 50)),
+                'p90': float(np.percentile(latencies, 90)),
+                'p99': float(np.percentile(latencies, 99)),
+                'mean': float(latencies.mean()),
+                'max': float(latencies.max()),
+            }
+        return summary
+
+
+class _Request(object):
+    __slots__ = ('items', 'arrival', 'done', 'results', 'error')
+
+    def __init__(self, items):
+        self.items = items
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    '''
+    Groups the items of concurrent requests into batches for ``predict_fn(items) -> results``, run by a
+    single worker thread.
+
+    A batch is closed when it holds ``max_batch_size`` items or when ``max_latency_ms`` have passed since
+    its first request arrived, whichever comes first: under load batches fill up, and a lone request waits
+    at most ``max_latency_ms``. Requests larger than ``max_batch_size`` are split.
+
+    Example:
+        >>> batcher = MicroBatcher(predict_fn, max_batch_size=32, max_latency_ms=5)
+        >>> results = batcher.submit(items)  # from any thread, blocks until the items are predicted
+        >>> batcher.close()
+    '''
+
+    def __init__(self, predict_fn, max_batch_size=32, max_latency_ms=5.0, stats=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.stats = stats if stats is not None else ServingStats()
+        self._queue = queue.Queue()
+        self._pending = []  # a request taken from the queue that opens the next batch
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        request = _Request(list(items))
+        self._queue.put(request)
+        request.done.wait()
+        self.stats.record_request(time.perf_counter() - request.arrival, len(request.items))
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self):
+        first = self._pending.pop() if self._pending else self._queue.get()
+        if first is None:
+            return None
+        batch, size = [first], len(first.items)
+        deadline = first.arrival + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None or size + len(request.items) > self.max_batch_size:
+                self._pending.append(request)  # opens the next batch (or stops the worker)
+                break
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            items = [item for request in batch for item in request.items]
+            try:
+                results = []
+                for start in range(0, len(items), self.max_batch_size):
+                    chunk = items[start:start + self.max_batch_size]
+                    started = time.perf_counter()
+                    results.extend(self.predict_fn(chunk))
+                    self.stats.record_batch(len(chunk), time.perf_counter() - started)
+                offset = 0
+                for request in batch:
+                    request.results = results[offset:offset + len(request.items)]
+                    offset += len(request.items)
+            except Exception as e:
+                logger.exception("Prediction of a batch of %d items failed", len(items))
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,141 @@
+import time
+import collections
+import contextlib
+
+import torch
+
+PHASES = ('data', 'h2d', 'forward', 'backward', 'clip', 'optimizer', 'save')
+
+
+class TrainingMetrics(object):
+    '''
+    Running training loss, throughput and per-phase timings that never synchronise the device
+    on the training step.
+
+    The loss and token counts are summed into device tensors; they are copied to the host once
+    per ``flush()`` (every ``logging_steps``). Phases are timed with CUDA events on the device
+    timeline when training on GPU (so ``data`` is the time the device waits for input), and with
+    ``time.perf_counter`` on CPU. Events are only read back in ``flush()``.
+
+    ``last`` holds the summary of the latest flush, e.g. to be shown by ``ProgressBar``.
+    Every phase is also reported to ``profiler`` (see ``tools.profiler``), if given.
+
+    Example:
+        >>> metrics = TrainingMetrics(args.device)
+        >>> for step, batch in enumerate(metrics.timed(train_dataloader)):
+        >>>     with metrics.phase('forward'):
+        >>>         loss = model(**inputs)[0]
+        >>>     with metrics.phase('backward'):
+        >>>         loss.backward()
+        >>>     metrics.update(loss, batch_size, attention_mask)
+        >>>     pbar(step, metrics.progress_info())
+        >>>     with metrics.phase('optimizer'):
+        >>>         optimizer.step()
+        >>>     metrics.step()
+        >>>     if global_step % logging_steps == 0:
+        >>>         logger.info(metrics.format(metrics.flush()))
+    '''
+
+    def __init__(self, device, profiler=None):
+        self.device = torch.device(device)
+        self.profiler = profiler
+        self.use_events = self.device.type == 'cuda'
+        self.total_loss = 0.0
+        self.last = {}
+        self._loss = torch.zeros((), dtype=torch.float, device=self.device)
+        self._tokens = torch.zeros((), dtype=torch.long, device=self.device)
+        self._reset()
+
+    def _reset(self):
+        self._loss.zero_()
+        self._tokens.zero_()
+        self._examples = 0
+        self._steps = 0
+        self._seconds = collections.defaultdict(float)
+        self._events = collections.defaultdict(list)
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.profiler is not None and self.profiler.enabled:
+            with self.profiler.timer(name, cat='train'), self._phase(name):
+                yield
+        else:
+            with self._phase(name):
+                yield
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        if self.use_events:
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            self._events[name].append((start, end))
+        else:
+            start = time.perf_counter()
+            yield
+            self._seconds[name] += time.perf_counter() - start
+
+    def timed(self, iterable, name='data'):
+        ''' Iterates over ``iterable`` (e.g. a DataLoader), timing every fetch as phase ``name`` '''
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    item = StopIteration
+            if item is StopIteration:
+                return
+            yield item
+
+    def update(self, loss, batch_size, attention_mask=None):
+        ''' Adds one micro-batch; ``loss`` is already scaled for gradient accumulation '''
+        self._loss += loss.detach().float()
+        if attention_mask is not None:
+            self._tokens += attention_mask.sum()
+        self._examples += batch_size
+
+    def step(self):
+        ''' Marks one optimizer step '''
+        self._steps += 1
+
+    def flush(self):
+        '''
+        Reads the window back to the host (a single device sync) and returns its summary: mean loss
+        per optimizer step, examples/s, tokens/s and the mean milliseconds per step of every phase.
+        '''
+        loss, tokens = torch.stack([self._loss, self._tokens.float()]).tolist()
+        elapsed = max(time.perf_counter() - self._start, 1e-12)
+        seconds = dict(self._seconds)
+        for name, events in self._events.items():
+            seconds[name] = seconds.get(name, 0.0) + sum(start.elapsed_time(end) for start, end in events) / 1000.0
+        steps = max(self._steps, 1)
+        self.total_loss += loss
+        summary = collections.OrderedDict()
+        summary['loss'] = loss / steps
+        summary['examples/s'] = self._examples / elapsed
+        summary['tokens/s'] = tokens / elapsed
+        for name in PHASES:
+            if name in seconds:
+                summary['%s_ms' % name] = 1000.0 * seconds[name] / steps
+        self.last = summary
+        self._reset()
+        return summary
+
+    def running_total_loss(self):
+        ''' Loss summed over every step so far, including the current window (reads the device) '''
+        return self.total_loss + self._loss.item()
+
+    def reset_clock(self):
+        ''' Restarts the throughput clock, e.g. after an evaluation that should not count as training time '''
+        self._start = time.perf_counter()
+
+    def progress_info(self):
+        ''' The subset of ``last`` shown by ``ProgressBar`` '''
+        return dict((key, self.last[key]) for key in ('loss', 'examples/s') if key in self.last)
+
+    @staticmethod
+    def format(summary):
+        return ", ".join("%s = %.4f" % (key, value) for key, value in summary.items())
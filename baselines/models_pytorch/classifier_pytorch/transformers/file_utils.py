@@ -17,37 +17,17 @@ from functools import wraps
 from hashlib import sha256
 from io import open
 
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
-import requests
-from tqdm import tqdm
-
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-try:
-    import tensorflow as tf
-    assert hasattr(tf, '__version__') and int(tf.__version__[0]) >= 2
-    _tf_available = True  # pylint: disable=invalid-name
-    logger.info("TensorFlow version {} available.".format(tf.__version__))
-except (ImportError, AssertionError):
-    _tf_available = False  # pylint: disable=invalid-name
-
-try:
-    import torch
-    _torch_available = True  # pylint: disable=invalid-name
-    logger.info("PyTorch version {} available.".format(torch.__version__))
-except ImportError:
-    _torch_available = False  # pylint: disable=invalid-name
-
+# boto3, requests and tqdm are only imported to download a file, and TensorFlow and PyTorch only
+# when their availability is first asked for, to keep ``import transformers`` fast.
+_tf_available = None  # pylint: disable=invalid-name
+_torch_available = None  # pylint: disable=invalid-name
 
-try:
-    from torch.hub import _get_torch_home
-    torch_cache_home = _get_torch_home()
-except ImportError:
-    torch_cache_home = os.path.expanduser(
-        os.getenv('TORCH_HOME', os.path.join(
-            os.getenv('XDG_CACHE_HOME', '~/.cache'), 'torch')))
+# Same as ``torch.hub._get_torch_home()``, without importing torch
+torch_cache_home = os.path.expanduser(
+    os.getenv('TORCH_HOME', os.path.join(
+        os.getenv('XDG_CACHE_HOME', '~/.cache'), 'torch')))
 default_cache_path = os.path.join(torch_cache_home, 'transformers')
 
 try:
@@ -68,14 +48,32 @@ PYTORCH_TRANSFORMERS_CACHE = PYTORCH_PRETRAINED_BERT_CACHE  # Kept for backward
 TRANSFORMERS_CACHE = PYTORCH_PRETRAINED_BERT_CACHE  # Kept for backward compatibility
 
 WEIGHTS_NAME = "pytorch_model.bin"
+FLAT_WEIGHTS_NAME = "pytorch_model.flat"
 TF2_WEIGHTS_NAME = 'tf_model.h5'
 TF_WEIGHTS_NAME = 'model.ckpt'
 CONFIG_NAME = "config.json"
 
 def is_torch_available():
+    global _torch_available
+    if _torch_available is None:
+        try:
+            import torch
+            _torch_available = True
+            logger.info("PyTorch version {} available.".format(torch.__version__))
+        except ImportError:
+            _torch_available = False
     return _torch_available
 
 def is_tf_available():
+    global _tf_available
+    if _tf_available is None:
+        try:
+            import tensorflow as tf
+            assert hasattr(tf, '__version__') and int(tf.__version__[0]) >= 2
+            _tf_available = True
+            logger.info("TensorFlow version {} available.".format(tf.__version__))
+        except (ImportError, AssertionError):
+            _tf_available = False
     return _tf_available
 
 if not six.PY2:
@@ -206,6 +204,7 @@ def s3_request(func):
 
     @wraps(func)
     def wrapper(url, *args, **kwargs):
+        from botocore.exceptions import ClientError
         try:
             return func(url, *args, **kwargs)
         except ClientError as exc:
@@ -220,6 +219,8 @@ def s3_request(func):
 @s3_request
 def s3_etag(url, proxies=None):
     """Check ETag on S3 object."""
+    import boto3
+    from botocore.config import Config
     s3_resource = boto3.resource("s3", config=Config(proxies=proxies))
     bucket_name, s3_path = split_s3_path(url)
     s3_object = s3_resource.Object(bucket_name, s3_path)
@@ -229,12 +230,16 @@ def s3_etag(url, proxies=None):
 @s3_request
 def s3_get(url, temp_file, proxies=None):
     """Pull a file directly from S3."""
+    import boto3
+    from botocore.config import Config
     s3_resource = boto3.resource("s3", config=Config(proxies=proxies))
     bucket_name, s3_path = split_s3_path(url)
     s3_resource.Bucket(bucket_name).download_fileobj(s3_path, temp_file)
 
 
 def http_get(url, temp_file, proxies=None):
+    import requests
+    from tqdm import tqdm
     req = requests.get(url, stream=True, proxies=proxies)
     content_length = req.headers.get('Content-Length')
     total = int(content_length) if content_length is not None else None
@@ -265,6 +270,7 @@ def get_from_cache(url, cache_dir=None, force_download=False, proxies=None):
     if url.startswith("s3://"):
         etag = s3_etag(url, proxies=proxies)
     else:
+        import requests
         try:
             response = requests.head(url, allow_redirects=True, proxies=proxies)
             if response.status_code != 200:
@@ -529,6 +529,8 @@ BERT_INPUTS_DOCSTRING = r"""
             Mask to nullify selected heads of the self-attention modules.
             Mask values selected in ``[0, 1]``:
             ``1`` indicates the head is **not masked**, ``0`` indicates the head is **masked**.
+            A list of ``num_layers`` masks of shape ``(num_heads_of_the_layer,)`` is accepted too, for models whose
+            layers were pruned to different numbers of heads.
 """
 
 @add_start_docstrings("The bare Bert Model transformer outputting raw hidden-states without any specific head on top.",
@@ -585,12 +587,7 @@ class BertModel(BertPreTrainedModel):
         for layer, heads in heads_to_prune.items():
             self.encoder.layer[layer].attention.prune_heads(heads)
 
-    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, head_mask=None):
-        if attention_mask is None:
-            attention_mask = torch.ones_like(input_ids)
-        if token_type_ids is None:
-            token_type_ids = torch.zeros_like(input_ids)
-
+    def get_extended_attention_mask(self, attention_mask):
         # We create a 3D attention mask from a 2D tensor mask.
         # Sizes are [batch_size, 1, 1, to_seq_length]
         # So we can broadcast to [batch_size, num_heads, from_seq_length, to_seq_length]
@@ -605,13 +602,19 @@ class BertModel(BertPreTrainedModel):
         # effectively the same as removing these entirely.
         extended_attention_mask = extended_attention_mask.to(dtype=next(self.parameters()).dtype) # fp16 compatibility
         extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        return extended_attention_mask
 
+    def get_head_mask(self, head_mask):
         # Prepare head mask if needed
         # 1.0 in head_mask indicate we keep the head
         # attention_probs has shape bsz x n_heads x N x N
         # input head_mask has shape [num_heads] or [num_hidden_layers x num_heads]
         # and head_mask is converted to shape [num_hidden_layers x batch x num_heads x seq_length x seq_length]
-        if head_mask is not None:
+        # A list of one [num_heads] mask per layer is accepted too, e.g. when layers have been pruned differently
+        if isinstance(head_mask, (list, tuple)):
+            head_mask = [mask.view(1, -1, 1, 1).to(dtype=next(self.parameters()).dtype) if mask is not None else None
+                         for mask in head_mask]
+        elif head_mask is not None:
             if head_mask.dim() == 1:
                 head_mask = head_mask.unsqueeze(0).unsqueeze(0).unsqueeze(-1).unsqueeze(-1)
                 head_mask = head_mask.expand(self.config.num_hidden_layers, -1, -1, -1, -1)
@@ -620,6 +623,16 @@ class BertModel(BertPreTrainedModel):
             head_mask = head_mask.to(dtype=next(self.parameters()).dtype) # switch to fload if need + fp16 compatibility
         else:
             head_mask = [None] * self.config.num_hidden_layers
+        return head_mask
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, head_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+
+        extended_attention_mask = self.get_extended_attention_mask(attention_mask)
+        head_mask = self.get_head_mask(head_mask)
 
         embedding_output = self.embeddings(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
         encoder_outputs = self.encoder(embedding_output,
@@ -916,6 +929,224 @@ class BertForSequenceClassification(BertPreTrainedModel):
         return outputs  # (loss), logits, (hidden_states), (attentions)
 
 
+class BertExitHead(nn.Module):
+    """ Intermediate classifier of an early-exit model: pooling of the first token, then a linear layer """
+    def __init__(self, config):
+        super(BertExitHead, self).__init__()
+        self.pooler = BertPooler(config)
+        self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        self.classifier = nn.Linear(config.hidden_size, config.num_labels)
+
+    def forward(self, hidden_states):
+        return self.classifier(self.dropout(self.pooler(hidden_states)))
+
+
+@add_start_docstrings("""Bert Model transformer with a sequence classification head on top and intermediate
+    classification heads after some layers, so that confident examples can leave the encoder early. """,
+    BERT_START_DOCSTRING, BERT_INPUTS_DOCSTRING)
+class BertForEarlyExitSequenceClassification(BertPreTrainedModel):
+    r"""
+    Configuration attributes (all optional):
+        ``early_exit_layers``: layers (0-based) followed by an exit head; defaults to every layer but the last,
+            which is followed by the usual pooler and classifier.
+        ``early_exit_threshold``: exit criterion used in eval mode; ``0`` runs every layer.
+        ``early_exit_criterion``: ``entropy`` (exit when the entropy of the prediction is below the threshold)
+            or ``confidence`` (exit when the largest probability reaches the threshold).
+
+    In training mode every head is run and the loss is the average of the head losses weighted by depth.
+    In eval mode with a threshold, the batch shrinks as it goes up the encoder: rows whose prediction
+    satisfies the criterion at an exit head are finished and the remaining layers only process the others.
+    The final layer keeps the parameter names of ``BertForSequenceClassification``, so a fine-tuned
+    classifier can be loaded and its exit heads trained.
+
+        **labels**: (`optional`) ``torch.LongTensor`` of shape ``(batch_size,)``:
+            Labels for computing the sequence classification/regression loss.
+
+    Outputs: `Tuple` comprising various elements depending on the configuration (config) and inputs:
+        **loss**: (`optional`, returned when ``labels`` is provided) ``torch.FloatTensor`` of shape ``(1,)``:
+            Joint loss of every head in training mode, loss of the returned logits in eval mode.
+        **logits**: ``torch.FloatTensor`` of shape ``(batch_size, config.num_labels)``
+            Logits of the last layer in training mode, of the head each example exited at in eval mode.
+        **exit_layers**: ``torch.LongTensor`` of shape ``(batch_size,)``
+            Number of layers each example went through.
+
+    Examples::
+
+        model = BertForEarlyExitSequenceClassification.from_pretrained('bert-base-chinese', num_labels=15)
+        model.eval()
+        model.early_exit_threshold = 0.3
+        logits, exit_layers = model(input_ids)[:2]
+
+    """
+    def __init__(self, config):
+        super(BertForEarlyExitSequenceClassification, self).__init__(config)
+        self.num_labels = config.num_labels
+        self.early_exit_layers = sorted(getattr(config, 'early_exit_layers', None) or
+                                        range(config.num_hidden_layers - 1))
+        self.early_exit_threshold = getattr(config, 'early_exit_threshold', 0.0)
+        self.early_exit_criterion = getattr(config, 'early_exit_criterion', 'entropy')
+
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        self.classifier = nn.Linear(config.hidden_size, self.config.num_labels)
+        self.exit_heads = nn.ModuleDict([(str(layer), BertExitHead(config)) for layer in self.early_exit_layers
+                                         if layer < config.num_hidden_layers - 1])
+
+        self.init_weights()
+
+    def _final_logits(self, hidden_states):
+        return self.classifier(self.dropout(self.bert.pooler(hidden_states)))
+
+    def _exits(self, logits):
+        probs = nn.functional.softmax(logits, dim=-1)
+        if self.early_exit_criterion == 'confidence':
+            return probs.max(dim=-1)[0] >= self.early_exit_threshold
+        entropy = -(probs * torch.log(probs.clamp(min=1e-12))).sum(dim=-1)
+        return entropy < self.early_exit_threshold
+
+    def _loss(self, logits, labels):
+        if self.num_labels == 1:
+            #  We are doing regression
+            return MSELoss()(logits.view(-1), labels.view(-1))
+        return CrossEntropyLoss()(logits.view(-1, self.num_labels), labels.view(-1))
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None,
+                position_ids=None, head_mask=None, labels=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        extended_attention_mask = self.bert.get_extended_attention_mask(attention_mask)
+        head_mask = self.bert.get_head_mask(head_mask)
+        hidden_states = self.bert.embeddings(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
+        num_layers = len(self.bert.encoder.layer)
+
+        if self.training or self.early_exit_threshold <= 0 or self.num_labels == 1:
+            all_logits, depths = [], []
+            for i, layer_module in enumerate(self.bert.encoder.layer):
+                hidden_states = layer_module(hidden_states, extended_attention_mask, head_mask[i])[0]
+                if self.training and str(i) in self.exit_heads:
+                    all_logits.append(self.exit_heads[str(i)](hidden_states))
+                    depths.append(i + 1)
+            logits = self._final_logits(hidden_states)
+            exit_layers = torch.full((input_ids.size(0),), num_layers, dtype=torch.long, device=input_ids.device)
+            outputs = (logits, exit_layers)
+            if labels is not None:
+                if self.training:
+                    all_logits.append(logits)
+                    depths.append(num_layers)
+                    loss = sum(depth * self._loss(head_logits, labels)
+                               for depth, head_logits in zip(depths, all_logits)) / float(sum(depths))
+                else:
+                    loss = self._loss(logits, labels)
+                outputs = (loss,) + outputs
+            return outputs  # (loss), logits, exit_layers
+
+        batch_size = input_ids.size(0)
+        logits = hidden_states.new_zeros((batch_size, self.num_labels))
+        exit_layers = torch.full((batch_size,), num_layers, dtype=torch.long, device=input_ids.device)
+        active = torch.arange(batch_size, device=input_ids.device)  # rows of the batch still in the encoder
+        for i, layer_module in enumerate(self.bert.encoder.layer):
+            layer_head_mask = head_mask[i]
+            if layer_head_mask is not None and layer_head_mask.size(0) == batch_size:
+                layer_head_mask = layer_head_mask[active]
+            hidden_states = layer_module(hidden_states, extended_attention_mask, layer_head_mask)[0]
+            if i == num_layers - 1:
+                logits[active] = self._final_logits(hidden_states).to(logits.dtype)
+                break
+            if str(i) not in self.exit_heads:
+                continue
+            head_logits = self.exit_heads[str(i)](hidden_states)
+            done = self._exits(head_logits)
+            if done.any():
+                logits[active[done]] = head_logits[done].to(logits.dtype)
+                exit_layers[active[done]] = i + 1
+                keep = ~done
+                if not keep.any():
+                    break
+                active = active[keep]
+                hidden_states = hidden_states[keep]
+                extended_attention_mask = extended_attention_mask[keep]
+
+        outputs = (logits, exit_layers)
+        if labels is not None:
+            outputs = (self._loss(logits, labels),) + outputs
+        return outputs  # (loss), logits, exit_layers
+
+
+@add_start_docstrings("""Bert Model transformer with one sequence classification/regression head per task on top of
+    a shared encoder (a linear layer per task on top of the pooled output), for multi-task fine-tuning. """,
+    BERT_START_DOCSTRING, BERT_INPUTS_DOCSTRING)
+class BertForMultiTaskClassification(BertPreTrainedModel):
+    r"""
+    The tasks and their number of labels are read from ``config.task_num_labels``, an ordered mapping
+    ``{task_name: num_labels}`` that is saved with the configuration.
+
+        **task_name**: (`optional`) ``str``:
+            Task of the batch. If ``None``, the encoder is run once and every head is applied to its output.
+        **labels**: (`optional`) ``torch.LongTensor`` of shape ``(batch_size,)``:
+            Labels of ``task_name`` for computing the classification (or regression if the task has a single
+            label) loss.
+
+    Outputs: `Tuple` comprising various elements depending on the configuration (config) and inputs:
+        **loss**: (`optional`, returned when ``labels`` is provided) ``torch.FloatTensor`` of shape ``(1,)``:
+            Classification (or regression) loss of ``task_name``.
+        **logits**: ``torch.FloatTensor`` of shape ``(batch_size, num_labels)`` of ``task_name``, or,
+            when ``task_name`` is ``None``, a dict mapping every task name to its logits.
+        **hidden_states**: (`optional`, returned when ``config.output_hidden_states=True``)
+        **attentions**: (`optional`, returned when ``config.output_attentions=True``)
+
+    Examples::
+
+        config = BertConfig.from_pretrained('bert-base-chinese')
+        config.task_num_labels = {'afqmc': 2, 'tnews': 15}
+        model = BertForMultiTaskClassification.from_pretrained('bert-base-chinese', config=config)
+        loss, logits = model(input_ids, task_name='tnews', labels=labels)[:2]
+        all_logits = model(input_ids)[0]  # {'afqmc': ..., 'tnews': ...}
+
+    """
+    def __init__(self, config):
+        super(BertForMultiTaskClassification, self).__init__(config)
+        self.task_num_labels = dict(config.task_num_labels)
+
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        self.classifiers = nn.ModuleDict([(task, nn.Linear(config.hidden_size, num_labels))
+                                          for task, num_labels in config.task_num_labels.items()])
+
+        self.init_weights()
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None,
+                position_ids=None, head_mask=None, task_name=None, labels=None):
+
+        outputs = self.bert(input_ids,
+                            attention_mask=attention_mask,
+                            token_type_ids=token_type_ids,
+                            position_ids=position_ids,
+                            head_mask=head_mask)
+
+        pooled_output = self.dropout(outputs[1])
+        if task_name is None:
+            logits = dict((task, classifier(pooled_output)) for task, classifier in self.classifiers.items())
+            return (logits,) + outputs[2:]
+
+        logits = self.classifiers[task_name](pooled_output)
+        outputs = (logits,) + outputs[2:]  # add hidden states and attention if they are here
+
+        if labels is not None:
+            num_labels = self.task_num_labels[task_name]
+            if num_labels == 1:
+                #  We are doing regression
+                loss_fct = MSELoss()
+                loss = loss_fct(logits.view(-1), labels.view(-1))
+            else:
+                loss_fct = CrossEntropyLoss()
+                loss = loss_fct(logits.view(-1, num_labels), labels.view(-1))
+            outputs = (loss,) + outputs
+
+        return outputs  # (loss), logits, (hidden_states), (attentions)
+
+
 @add_start_docstrings("""Bert Model with a multiple choice classification head on top (a linear layer on top of
     the pooled output and a softmax) e.g. for RocStories/SWAG tasks. """,
     BERT_START_DOCSTRING, BERT_INPUTS_DOCSTRING)
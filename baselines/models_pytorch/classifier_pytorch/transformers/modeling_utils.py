@@ -18,12 +18,15 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import collections
 import copy
 import json
 import logging
 import os
+import struct
 from io import open
 
+import numpy as np
 import six
 import torch
 from torch import nn
@@ -31,7 +34,7 @@ from torch.nn import CrossEntropyLoss
 from torch.nn import functional as F
 
 from .configuration_utils import PretrainedConfig
-from .file_utils import cached_path, WEIGHTS_NAME, TF_WEIGHTS_NAME, TF2_WEIGHTS_NAME
+from .file_utils import cached_path, WEIGHTS_NAME, FLAT_WEIGHTS_NAME, TF_WEIGHTS_NAME, TF2_WEIGHTS_NAME
 
 logger = logging.getLogger(__name__)
 
@@ -203,9 +206,12 @@ class PreTrainedModel(nn.Module):
 
         base_model._prune_heads(heads_to_prune)
 
-    def save_pretrained(self, save_directory):
+    def save_pretrained(self, save_directory, flat_weights=False):
         """ Save a model and its configuration file to a directory, so that it
             can be re-loaded using the `:func:`~transformers.PreTrainedModel.from_pretrained`` class method.
+
+            With ``flat_weights=True`` the weights are written as a flat checkpoint (see :func:`save_flat_state_dict`)
+            that ``from_pretrained`` memory-maps instead of unpickling.
         """
         assert os.path.isdir(save_directory), "Saving path should be a directory where the model and configuration can be saved"
 
@@ -216,8 +222,16 @@ class PreTrainedModel(nn.Module):
         model_to_save.config.save_pretrained(save_directory)
 
         # If we save using the predefined names, we can load using `from_pretrained`
-        output_model_file = os.path.join(save_directory, WEIGHTS_NAME)
-        torch.save(model_to_save.state_dict(), output_model_file)
+        if flat_weights:
+            output_model_file = os.path.join(save_directory, FLAT_WEIGHTS_NAME)
+            save_flat_state_dict(model_to_save.state_dict(), output_model_file)
+        else:
+            output_model_file = os.path.join(save_directory, WEIGHTS_NAME)
+            torch.save(model_to_save.state_dict(), output_model_file)
+        # ``from_pretrained`` prefers the flat weights: never leave stale weights of the other format behind
+        stale_model_file = os.path.join(save_directory, WEIGHTS_NAME if flat_weights else FLAT_WEIGHTS_NAME)
+        if os.path.isfile(stale_model_file):
+            os.remove(stale_model_file)
         logger.info("Model weights saved in {}".format(output_model_file))
 
     @classmethod
@@ -269,6 +283,11 @@ class PreTrainedModel(nn.Module):
             output_loading_info: (`optional`) boolean:
                 Set to ``True`` to also return a dictionnary containing missing keys, unexpected keys and error messages.
 
+            zero_copy: (`optional`) boolean, default False:
+                Only for flat checkpoints (``pytorch_model.flat``, see :func:`save_flat_state_dict`), which are always memory-mapped.
+                Set to ``True`` to use the memory-mapped weights as the parameters of the model instead of copying them into the parameters:
+                processes loading the same checkpoint on a host then share its pages until they modify a parameter.
+
             kwargs: (`optional`) Remaining dictionary of keyword arguments:
                 Can be used to update the configuration object (after it being loaded) and initiate the model. (e.g. ``output_attention=True``). Behave differently depending on whether a `config` is provided or automatically loaded:
 
@@ -293,6 +312,7 @@ class PreTrainedModel(nn.Module):
         force_download = kwargs.pop('force_download', False)
         proxies = kwargs.pop('proxies', None)
         output_loading_info = kwargs.pop('output_loading_info', False)
+        zero_copy = kwargs.pop('zero_copy', False)
 
         # Load config
         if config is None:
@@ -316,6 +336,9 @@ class PreTrainedModel(nn.Module):
                 elif from_tf and os.path.isfile(os.path.join(pretrained_model_name_or_path, TF2_WEIGHTS_NAME)):
                     # Load from a TF 2.0 checkpoint
                     archive_file = os.path.join(pretrained_model_name_or_path, TF2_WEIGHTS_NAME)
+                elif os.path.isfile(os.path.join(pretrained_model_name_or_path, FLAT_WEIGHTS_NAME)):
+                    # Load from a flat PyTorch checkpoint
+                    archive_file = os.path.join(pretrained_model_name_or_path, FLAT_WEIGHTS_NAME)
                 elif os.path.isfile(os.path.join(pretrained_model_name_or_path, WEIGHTS_NAME)):
                     # Load from a PyTorch checkpoint
                     archive_file = os.path.join(pretrained_model_name_or_path, WEIGHTS_NAME)
@@ -358,7 +381,10 @@ class PreTrainedModel(nn.Module):
         model = cls(config, *model_args, **model_kwargs)
 
         if state_dict is None and not from_tf:
-            state_dict = torch.load(resolved_archive_file, map_location='cpu')
+            if resolved_archive_file.endswith('.flat'):
+                state_dict = load_flat_state_dict(resolved_archive_file)
+            else:
+                state_dict = torch.load(resolved_archive_file, map_location='cpu')
 
         missing_keys = []
         unexpected_keys = []
@@ -415,7 +441,24 @@ class PreTrainedModel(nn.Module):
             if hasattr(model, cls.base_model_prefix) and not any(s.startswith(cls.base_model_prefix) for s in state_dict.keys()):
                 model_to_load = getattr(model, cls.base_model_prefix)
 
+            shared_keys = set()
+            if zero_copy:
+                # Point the parameters and buffers at the mapped weights; ``load`` then no longer sees them.
+                # A tied parameter appears under several names: it is mapped once and its aliases are skipped.
+                mapped_tensors = set()
+                for name, tensor in model_to_load.state_dict(keep_vars=True).items():
+                    key = start_prefix + name
+                    mapped = state_dict.get(key)
+                    if mapped is None or mapped.shape != tensor.shape or mapped.dtype != tensor.dtype:
+                        continue
+                    if id(tensor) not in mapped_tensors:
+                        tensor.data = mapped
+                        mapped_tensors.add(id(tensor))
+                    del state_dict[key]
+                    shared_keys.add(key)
+
             load(model_to_load, prefix=start_prefix)
+            missing_keys[:] = [key for key in missing_keys if key not in shared_keys]
             if len(missing_keys) > 0:
                 logger.info("Weights of {} not initialized from pretrained model: {}".format(
                     model.__class__.__name__, missing_keys))
@@ -439,6 +482,88 @@ class PreTrainedModel(nn.Module):
         return model
 
 
+# Element types of a flat checkpoint, as named in its header
+_FLAT_DTYPES = collections.OrderedDict([
+    ('F64', (torch.float64, np.float64)),
+    ('F32', (torch.float32, np.float32)),
+    ('F16', (torch.float16, np.float16)),
+    ('I64', (torch.int64, np.int64)),
+    ('I32', (torch.int32, np.int32)),
+    ('I16', (torch.int16, np.int16)),
+    ('I8', (torch.int8, np.int8)),
+    ('U8', (torch.uint8, np.uint8)),
+])
+if hasattr(torch, 'bool'):
+    _FLAT_DTYPES['BOOL'] = (torch.bool, np.bool_)
+if hasattr(torch, 'bfloat16'):
+    _FLAT_DTYPES['BF16'] = (torch.bfloat16, np.int16)  # no bfloat16 in numpy: read as int16 and reinterpreted
+
+
+def save_flat_state_dict(state_dict, path, metadata=None):
+    """ Writes ``state_dict`` as a flat checkpoint that :func:`load_flat_state_dict` memory-maps.
+
+        The layout is that of safetensors: an 8 byte little-endian header size, a JSON header mapping every
+        name to its ``dtype``, ``shape`` and ``data_offsets`` in the data section, then the raw tensors back
+        to back. Tensors are ordered by decreasing element size, so that each one is aligned in the file.
+    """
+    torch_to_flat = dict((torch_dtype, name) for name, (torch_dtype, _) in _FLAT_DTYPES.items())
+    tensors = []
+    for name, tensor in state_dict.items():
+        if tensor.dtype not in torch_to_flat:
+            raise ValueError("Cannot save {} of type {} in a flat checkpoint".format(name, tensor.dtype))
+        tensors.append((name, tensor.detach().cpu().contiguous()))
+    tensors.sort(key=lambda item: -item[1].element_size())
+
+    header = collections.OrderedDict()
+    if metadata:
+        header['__metadata__'] = dict((str(key), str(value)) for key, value in metadata.items())
+    offset = 0
+    for name, tensor in tensors:
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': torch_to_flat[tensor.dtype], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + size]}
+        offset += size
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-len(header) % 8)  # keeps the data section 8 byte aligned
+
+    with open(path, 'wb') as writer:
+        writer.write(struct.pack('<Q', len(header)))
+        writer.write(header)
+        for name, tensor in tensors:
+            if tensor.dtype == getattr(torch, 'bfloat16', None):
+                tensor = tensor.view(torch.int16)
+            writer.write(tensor.numpy().tobytes())
+
+
+def load_flat_state_dict(path):
+    """ Memory-maps a checkpoint written by :func:`save_flat_state_dict` and returns its tensors without copying them.
+
+        The tensors are copy-on-write views of the file: nothing is read before a tensor is used, every process
+        mapping the same file shares its pages through the page cache, and writing to a tensor only copies the
+        pages it touches.
+    """
+    with open(path, 'rb') as reader:
+        header_size, = struct.unpack('<Q', reader.read(8))
+        header = json.loads(reader.read(header_size).decode('utf-8'), object_pairs_hook=collections.OrderedDict)
+    header.pop('__metadata__', None)
+    data_size = max([0] + [info['data_offsets'][1] for info in header.values()])
+    if data_size:
+        data = np.memmap(path, dtype=np.uint8, mode='c', offset=8 + header_size, shape=(data_size,))
+    else:
+        data = np.empty(0, dtype=np.uint8)  # mmap cannot map an empty range
+
+    state_dict = collections.OrderedDict()
+    for name, info in header.items():
+        torch_dtype, np_dtype = _FLAT_DTYPES[info['dtype']]
+        start, end = info['data_offsets']
+        array = data[start:end].view(np_dtype).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if tensor.dtype != torch_dtype:
+            tensor = tensor.view(torch_dtype)
+        state_dict[name] = tensor
+    return state_dict
+
+
 class Conv1D(nn.Module):
     def __init__(self, nf, nx):
         """ Conv1D layer as defined by Radford et al. for OpenAI GPT (and also used in GPT-2)
@@ -19,6 +19,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import collections
 import logging
 import os
+import re
 import unicodedata
 from io import open
 
@@ -164,7 +165,7 @@ class BertTokenizer(PreTrainedTokenizer):
             self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case,
                                                   never_split=never_split,
                                                   tokenize_chinese_chars=tokenize_chinese_chars)
-        self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token)
+        self.wordpiece_tokenizer = TrieWordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token)
 
     @property
     def vocab_size(self):
@@ -180,6 +181,16 @@ class BertTokenizer(PreTrainedTokenizer):
             split_tokens = self.wordpiece_tokenizer.tokenize(text)
         return split_tokens
 
+    def _ids_cache_key(self, text):
+        """ Runs of whitespace only ever separate tokens: texts that differ in them share their cache entry,
+        unless an added or special token contains whitespace itself (or the text is only whitespace, which
+        ``tokenize`` does not turn into an empty list). """
+        key = _get_char_tables().whitespace_re.sub(" ", text).strip(" ")
+        if key != text and (not key or any(_get_char_tables().whitespace_re.search(token)
+                                           for token in list(self.added_tokens_encoder) + self.all_special_tokens)):
+            return text
+        return key
+
     def _convert_token_to_id(self, token):
         """ Converts a token (str/unicode) in an id using the vocab. """
         return self.vocab.get(token, self.vocab.get(self.unk_token))
@@ -335,36 +346,11 @@ class BasicTokenizer(object):
         """Splits punctuation on a piece of text."""
         if never_split is not None and text in never_split:
             return [text]
-        chars = list(text)
-        i = 0
-        start_new_word = True
-        output = []
-        while i < len(chars):
-            char = chars[i]
-            if _is_punctuation(char):
-                output.append([char])
-                start_new_word = True
-            else:
-                if start_new_word:
-                    output.append([])
-                start_new_word = False
-                output[-1].append(char)
-            i += 1
-
-        return ["".join(x) for x in output]
+        return [piece for piece in _get_char_tables().punctuation_re.split(text) if piece]
 
     def _tokenize_chinese_chars(self, text):
         """Adds whitespace around any CJK character."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if self._is_chinese_char(cp):
-                output.append(" ")
-                output.append(char)
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
+        return text.translate(_get_char_tables().chinese_map)
 
     def _is_chinese_char(self, cp):
         """Checks whether CP is the codepoint of a CJK character."""
@@ -376,30 +362,11 @@ class BasicTokenizer(object):
         # as is Japanese Hiragana and Katakana. Those alphabets are used to write
         # space-separated words, so they are not treated specially and handled
         # like the all of the other languages.
-        if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-                (cp >= 0x3400 and cp <= 0x4DBF) or  #
-                (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-                (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-                (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-                (cp >= 0x2B820 and cp <= 0x2CEAF) or
-                (cp >= 0xF900 and cp <= 0xFAFF) or  #
-                (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-            return True
-
-        return False
+        return bool(_get_char_tables().flags[cp] & _CHINESE)
 
     def _clean_text(self, text):
         """Performs invalid character removal and whitespace cleanup on text."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if cp == 0 or cp == 0xfffd or _is_control(char):
-                continue
-            if _is_whitespace(char):
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
+        return text.translate(_get_char_tables().clean_map)
 
 
 class WordpieceTokenizer(object):
@@ -462,41 +429,157 @@ class WordpieceTokenizer(object):
         return output_tokens
 
 
+class TrieWordpieceTokenizer(WordpieceTokenizer):
+    """Runs WordPiece tokenization with the vocabulary compiled into prefix tries.
+
+    The output is the one of :class:`WordpieceTokenizer`: its greedy longest-match-first search rebuilds
+    and looks up every candidate substring, from the whole word down to a single character, while here
+    one walk down a trie from each piece start finds the longest vocabulary piece, in time linear in
+    the length of the piece.
+    """
+
+    def __init__(self, vocab, unk_token, max_input_chars_per_word=100):
+        super(TrieWordpieceTokenizer, self).__init__(vocab, unk_token, max_input_chars_per_word)
+        self.word_trie = {}  # every vocabulary entry, walked from the start of a word
+        self.subword_trie = {}  # "##" pieces without their "##", walked from inside a word
+        for piece in vocab:
+            _trie_insert(self.word_trie, piece, piece)
+            if piece.startswith("##") and len(piece) > 2:
+                _trie_insert(self.subword_trie, piece[2:], piece)
+
+    def tokenize(self, text):
+        output_tokens = []
+        for token in whitespace_tokenize(text):
+            if len(token) > self.max_input_chars_per_word:
+                output_tokens.append(self.unk_token)
+                continue
+            if token in self.vocab:  # the first candidate of the greedy search, and the common case
+                output_tokens.append(token)
+                continue
+
+            sub_tokens = []
+            start, trie = 0, self.word_trie
+            while start < len(token):
+                node, cur_substr, end = trie, None, start
+                for i in range(start, len(token)):
+                    node = node.get(token[i])
+                    if node is None:
+                        break
+                    if _TRIE_PIECE in node:
+                        cur_substr, end = node[_TRIE_PIECE], i + 1
+                if cur_substr is None:
+                    sub_tokens = None
+                    break
+                sub_tokens.append(cur_substr)
+                start, trie = end, self.subword_trie
+
+            if sub_tokens is None:
+                output_tokens.append(self.unk_token)
+            else:
+                output_tokens.extend(sub_tokens)
+        return output_tokens
+
+
+_TRIE_PIECE = None  # key of the vocabulary piece ending at a trie node, never a character
+
+
+def _trie_insert(trie, chars, piece):
+    node = trie
+    for char in chars:
+        node = node.setdefault(char, {})
+    node[_TRIE_PIECE] = piece
+
+
 def _is_whitespace(char):
     """Checks whether `chars` is a whitespace character."""
-    # \t, \n, and \r are technically contorl characters but we treat them
-    # as whitespace since they are generally considered as such.
-    if char == " " or char == "\t" or char == "\n" or char == "\r":
-        return True
-    cat = unicodedata.category(char)
-    if cat == "Zs":
-        return True
-    return False
+    return bool(_get_char_tables().flags[ord(char)] & _WHITESPACE)
 
 
 def _is_control(char):
     """Checks whether `chars` is a control character."""
-    # These are technically control characters but we count them as whitespace
-    # characters.
-    if char == "\t" or char == "\n" or char == "\r":
-        return False
-    cat = unicodedata.category(char)
-    if cat.startswith("C"):
-        return True
-    return False
+    return bool(_get_char_tables().flags[ord(char)] & _CONTROL)
 
 
 def _is_punctuation(char):
     """Checks whether `chars` is a punctuation character."""
-    cp = ord(char)
+    return bool(_get_char_tables().flags[ord(char)] & _PUNCTUATION)
+
+
+# Classes of a code point in ``_CharTables.flags``
+_WHITESPACE, _CONTROL, _PUNCTUATION, _CHINESE, _INVALID = 1, 2, 4, 8, 16
+
+# The CJK Unified Ideographs blocks of ``BasicTokenizer._is_chinese_char``
+_CHINESE_RANGES = ((0x4E00, 0x9FFF), (0x3400, 0x4DBF), (0x20000, 0x2A6DF), (0x2A700, 0x2B73F),
+                   (0x2B740, 0x2B81F), (0x2B820, 0x2CEAF), (0xF900, 0xFAFF), (0x2F800, 0x2FA1F))
+
+
+# Classes of the Unicode general categories, before the exceptions of ``_build_char_flags``
+_CATEGORY_FLAGS = dict([("Zs", _WHITESPACE)] +
+                       [(cat, _CONTROL | _INVALID) for cat in ("Cc", "Cf", "Cs", "Co", "Cn")] +
+                       [(cat, _PUNCTUATION) for cat in ("Pc", "Pd", "Ps", "Pe", "Pi", "Pf", "Po")])
+
+
+def _build_char_flags():
+    """Classes of every code point, the only place that asks ``unicodedata`` about a character."""
+    category = unicodedata.category
+    flags = bytearray(_CATEGORY_FLAGS.get(category(chr(cp)), 0) for cp in range(0x110000))
+    # \t, \n, and \r are technically control characters but we treat them
+    # as whitespace since they are generally considered as such.
+    for char in " \t\n\r":
+        flags[ord(char)] = _WHITESPACE
     # We treat all non-letter/number ASCII as punctuation.
     # Characters such as "^", "$", and "`" are not in the Unicode
     # Punctuation class but we treat them as punctuation anyways, for
     # consistency.
-    if ((cp >= 33 and cp <= 47) or (cp >= 58 and cp <= 64) or
-            (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126)):
-        return True
-    cat = unicodedata.category(char)
-    if cat.startswith("P"):
-        return True
-    return False
+    for start, end in ((33, 47), (58, 64), (91, 96), (123, 126)):
+        for cp in range(start, end + 1):
+            flags[cp] |= _PUNCTUATION
+    for start, end in _CHINESE_RANGES:
+        flags[start:end + 1] = bytearray(flag | _CHINESE for flag in flags[start:end + 1])
+    flags[0] |= _INVALID
+    flags[0xfffd] |= _INVALID
+    return flags
+
+
+class _TranslationMap(dict):
+    """``str.translate`` table that computes the translation of a code point from its flags on first sight."""
+
+    def __init__(self, flags, translate):
+        super(_TranslationMap, self).__init__()
+        self.flags = flags
+        self.translate = translate
+
+    def __missing__(self, cp):
+        value = self[cp] = self.translate(cp, self.flags[cp])
+        return value
+
+
+class _CharTables(object):
+    """Per-code-point classes of every Unicode character and the translation tables and patterns derived from them."""
+
+    def __init__(self):
+        self.flags = _build_char_flags()
+        self.clean_map = _TranslationMap(
+            self.flags, lambda cp, flags: None if flags & _INVALID else " " if flags & _WHITESPACE else cp)
+        self.chinese_map = _TranslationMap(
+            self.flags, lambda cp, flags: " %s " % chr(cp) if flags & _CHINESE else cp)
+        self.punctuation_re = re.compile("([%s])" % "".join(
+            "%s-%s" % (re.escape(chr(start)), re.escape(chr(end))) for start, end in self.ranges(_PUNCTUATION)))
+        self.whitespace_re = re.compile("[%s]+" % "".join(
+            "%s-%s" % (re.escape(chr(start)), re.escape(chr(end))) for start, end in self.ranges(_WHITESPACE)))
+
+    def ranges(self, flag):
+        """Inclusive (first, last) code point ranges of the characters of class `flag`."""
+        in_class = self.flags.translate(bytes(bytearray(1 if i & flag else 0 for i in range(256))))
+        return [(match.start(), match.end() - 1) for match in re.finditer(b"\x01+", in_class)]
+
+
+_char_tables = None
+
+
+def _get_char_tables():
+    """Builds the character tables on first use and shares them afterwards."""
+    global _char_tables
+    if _char_tables is None:
+        _char_tables = _CharTables()
+    return _char_tables
@@ -16,22 +16,25 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import collections
 import logging
 import os
 import json
 import six
 import copy
+import threading
 from io import open
 
-from .file_utils import cached_path, is_tf_available, is_torch_available
+import numpy as np
 
-if is_tf_available():
-    import tensorflow as tf
-if is_torch_available():
-    import torch
+from .file_utils import cached_path, is_tf_available, is_torch_available
 
 logger = logging.getLogger(__name__)
 
+# Guards the token ids caches of every tokenizer, which may be shared by the threads of a server. Held
+# around the cache bookkeeping only, never while tokenizing; module level so that tokenizers still pickle.
+_ids_cache_lock = threading.Lock()
+
 SPECIAL_TOKENS_MAP_FILE = 'special_tokens_map.json'
 ADDED_TOKENS_FILE = 'added_tokens.json'
 TOKENIZER_CONFIG_FILE = 'tokenizer_config.json'
@@ -204,7 +207,7 @@ class PreTrainedTokenizer(object):
         """ Ids of all the additional special tokens in the vocabulary (list of integers). Log an error if used while not having been set. """
         return self.convert_tokens_to_ids(self.additional_special_tokens)
 
-    def __init__(self, max_len=None, **kwargs):
+    def __init__(self, max_len=None, ids_cache_size=65536, **kwargs):
         self._bos_token = None
         self._eos_token = None
         self._unk_token = None
@@ -220,6 +223,12 @@ class PreTrainedTokenizer(object):
         self.added_tokens_encoder = {}
         self.added_tokens_decoder = {}
 
+        # LRU cache of the token ids of the texts encoded by ``encode_plus`` and ``batch_encode_plus``
+        self.ids_cache_size = ids_cache_size
+        self._ids_cache = collections.OrderedDict()
+        self._ids_cache_hits = 0
+        self._ids_cache_misses = 0
+
         # inputs and kwargs for saving and re-loading (see ``from_pretrained`` and ``save_pretrained``)
         self.init_inputs = ()
         self.init_kwargs = {}
@@ -522,6 +531,8 @@ class PreTrainedTokenizer(object):
         added_tok_decoder = {v:k for k, v in added_tok_encoder.items()}
         self.added_tokens_encoder.update(added_tok_encoder)
         self.added_tokens_decoder.update(added_tok_decoder)
+        if to_add_tokens:
+            self.clear_ids_cache()
 
         return len(to_add_tokens)
 
@@ -595,6 +606,7 @@ class PreTrainedTokenizer(object):
                 added_tokens += self.add_tokens([value])
             logger.info("Assigning %s to the %s key of the tokenizer", value, key)
             setattr(self, key, value)
+        self.clear_ids_cache()
 
         return added_tokens
 
@@ -770,21 +782,11 @@ class PreTrainedTokenizer(object):
                 - 'do_not_truncate': Does not truncate (raise an error if the input sequence is longer than max_length)
             return_tensors: (optional) can be set to 'tf' or 'pt' to return respectively TensorFlow tf.constant
                 or PyTorch torch.Tensor instead of a list of python integers.
-            **kwargs: passed to the `self.tokenize()` method
+            **kwargs: passed to the `self.tokenize()` method; texts tokenized with extra kwargs bypass the token ids
+                cache (see ``ids_cache_size`` and ``ids_cache_info``)
         """
-
-        def get_input_ids(text):
-            if isinstance(text, six.string_types):
-                return self.convert_tokens_to_ids(self.tokenize(text, **kwargs))
-            elif isinstance(text, (list, tuple)) and len(text) > 0 and isinstance(text[0], six.string_types):
-                return self.convert_tokens_to_ids(text)
-            elif isinstance(text, (list, tuple)) and len(text) > 0 and isinstance(text[0], int):
-                return text
-            else:
-                raise ValueError("Input is not valid. Should be a string, a list/tuple of strings or a list/tuple of integers.")
-
-        first_ids = get_input_ids(text)
-        second_ids = get_input_ids(text_pair) if text_pair is not None else None
+        first_ids = self._get_cached_input_ids(text, **kwargs)
+        second_ids = self._get_cached_input_ids(text_pair, **kwargs) if text_pair is not None else None
 
         return self.prepare_for_model(first_ids,
                                       pair_ids=second_ids,
@@ -794,6 +796,129 @@ class PreTrainedTokenizer(object):
                                       truncation_strategy=truncation_strategy,
                                       return_tensors=return_tensors)
 
+    def _get_input_ids(self, text, **kwargs):
+        if isinstance(text, six.string_types):
+            return self.convert_tokens_to_ids(self.tokenize(text, **kwargs))
+        elif isinstance(text, (list, tuple)) and len(text) > 0 and isinstance(text[0], six.string_types):
+            return self.convert_tokens_to_ids(text)
+        elif isinstance(text, (list, tuple)) and len(text) > 0 and isinstance(text[0], int):
+            return text
+        else:
+            raise ValueError("Input is not valid. Should be a string, a list/tuple of strings or a list/tuple of integers.")
+
+    def _ids_cache_key(self, text):
+        """ Key of ``text`` in the token ids cache: texts with the same key must tokenize to the same ids.
+        The raw text by default; tokenizers override it with the normalization their tokenization undoes anyway. """
+        return text
+
+    def _get_cached_input_ids(self, text, **kwargs):
+        """ ``_get_input_ids`` through the LRU cache: only strings tokenized without extra ``kwargs`` are cached. """
+        if not self.ids_cache_size or kwargs or not isinstance(text, six.string_types):
+            return self._get_input_ids(text, **kwargs)
+        key = self._ids_cache_key(text)
+        with _ids_cache_lock:
+            ids = self._ids_cache.get(key)
+            if ids is not None:
+                self._ids_cache_hits += 1
+                self._ids_cache.move_to_end(key)
+                return list(ids)
+            self._ids_cache_misses += 1
+        ids = self._get_input_ids(text)
+        with _ids_cache_lock:
+            self._ids_cache[key] = tuple(ids)
+            if len(self._ids_cache) > self.ids_cache_size:
+                self._ids_cache.popitem(last=False)
+        return ids
+
+    def ids_cache_info(self):
+        """ Hits, misses, current and maximum size and hit rate of the token ids cache of ``encode_plus``. """
+        with _ids_cache_lock:
+            lookups = self._ids_cache_hits + self._ids_cache_misses
+            return {'hits': self._ids_cache_hits,
+                    'misses': self._ids_cache_misses,
+                    'size': len(self._ids_cache),
+                    'max_size': self.ids_cache_size,
+                    'hit_rate': self._ids_cache_hits / lookups if lookups else 0.0}
+
+    def clear_ids_cache(self):
+        """ Empties the token ids cache of ``encode_plus`` and resets its statistics. """
+        with _ids_cache_lock:
+            self._ids_cache.clear()
+            self._ids_cache_hits = 0
+            self._ids_cache_misses = 0
+
+    def batch_encode_plus(self,
+                          texts,
+                          text_pairs=None,
+                          add_special_tokens=False,
+                          max_length=None,
+                          stride=0,
+                          truncation_strategy='longest_first',
+                          pad_to_max_length=False,
+                          pad_on_left=False,
+                          pad_token_segment_id=0,
+                          **kwargs):
+        """
+        Encodes a batch of sequences or sequence pairs like ``encode_plus`` and returns them padded into NumPy arrays.
+
+        The token ids of every string are kept in a bounded LRU cache keyed on the normalized string (see
+        ``_ids_cache_key``, ``ids_cache_size`` and ``ids_cache_info``), so a text repeated across the batch or
+        across calls is only tokenized once.
+
+        Args:
+            texts: list of first sequences, each one a string, a list of strings or a list of integers (see ``encode_plus``)
+            text_pairs: Optional list of second sequences, of the same length as ``texts``
+            add_special_tokens, max_length, stride, truncation_strategy: see ``encode_plus``
+            pad_to_max_length: if set to ``True``, pad every sequence to ``max_length`` instead of to the longest one
+            pad_on_left: if set to ``True``, pad on the left (XLNet) instead of on the right
+            pad_token_segment_id: token type id of the padding
+            **kwargs: passed to the `self.tokenize()` method; texts tokenized with extra kwargs bypass the cache
+
+        Return:
+            A Dictionary of int64 arrays::
+
+                {
+                    input_ids: [batch_size, seq_len],
+                    token_type_ids: [batch_size, seq_len],
+                    attention_mask: [batch_size, seq_len], 1 for sequence tokens and 0 for padding
+                    input_len: [batch_size], length of each sequence before padding
+                }
+        """
+        if text_pairs is not None and len(text_pairs) != len(texts):
+            raise ValueError("Got {} texts but {} text pairs".format(len(texts), len(text_pairs)))
+        if pad_to_max_length and not max_length:
+            raise ValueError("pad_to_max_length requires a max_length")
+
+        sequences = []
+        for i, text in enumerate(texts):
+            pair_ids = None
+            if text_pairs is not None and text_pairs[i] is not None:
+                pair_ids = self._get_cached_input_ids(text_pairs[i], **kwargs)
+            encoded_inputs = self.prepare_for_model(self._get_cached_input_ids(text, **kwargs),
+                                                    pair_ids=pair_ids,
+                                                    max_length=max_length,
+                                                    add_special_tokens=add_special_tokens,
+                                                    stride=stride,
+                                                    truncation_strategy=truncation_strategy)
+            sequences.append((encoded_inputs["input_ids"], encoded_inputs["token_type_ids"]))
+
+        seq_len = max_length if pad_to_max_length else max([0] + [len(ids) for ids, _ in sequences])
+        pad_token_id = self.pad_token_id if self._pad_token is not None else 0
+        input_ids = np.full((len(sequences), seq_len), pad_token_id, dtype=np.int64)
+        token_type_ids = np.full((len(sequences), seq_len), pad_token_segment_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), seq_len), dtype=np.int64)
+        input_len = np.zeros(len(sequences), dtype=np.int64)
+        for i, (ids, type_ids) in enumerate(sequences):
+            span = slice(seq_len - len(ids), seq_len) if pad_on_left else slice(0, len(ids))
+            input_ids[i, span] = ids
+            token_type_ids[i, span] = type_ids
+            attention_mask[i, span] = 1
+            input_len[i] = len(ids)
+        return {"input_ids": input_ids,
+                "token_type_ids": token_type_ids,
+                "attention_mask": attention_mask,
+                "input_len": input_len}
+
     def prepare_for_model(self, ids, pair_ids=None, max_length=None, add_special_tokens=False, stride=0,
                           truncation_strategy='longest_first', return_tensors=None):
         """
@@ -861,9 +986,11 @@ class PreTrainedTokenizer(object):
             token_type_ids = [0] * len(ids) + ([1] * len(pair_ids) if pair else [])
 
         if return_tensors == 'tf' and is_tf_available():
+            import tensorflow as tf
             sequence = tf.constant([sequence])
             token_type_ids = tf.constant([token_type_ids])
         elif return_tensors == 'pt' and is_torch_available():
+            import torch
             sequence = torch.tensor([sequence])
             token_type_ids = torch.tensor([token_type_ids])
         elif return_tensors is not None: